@@ -13,12 +13,53 @@ import importlib
 import argparse
 import StringIO
 import multiprocessing
+import fileIO
+from functools import partial
 from ConfigParser import SafeConfigParser
 from loggers import logging, init_logger
 from models.modelChecker import checkAlignmentModel
-from fileIO import loadDataset, exportToFile, loadAlignment
+from corpus import Corpus, datasetFactors, internDataset, sampleDataset,\
+    mergeCorpora
+from symmetrisation import symmetrise, methods
+from session import AlignmentSession, reversedModelFile
+from fileIO import iterDataset, loadCachedCorpus, parallelLoadCorpus,\
+    parallelLoadAlignment, exportToFile, findFile, AlignmentWriter,\
+    AlignmentBuilder, countLines, shardRange, iterDatasetRange,\
+    loadAlignmentRange, iterStreamBatches, formatAlignment
 __version__ = "0.6a"
 
+# Datasets loaded before the workers are forked, see sharedDataset
+sharedDatasets = {}
+
+
+def sharedDataset(name):
+    '''
+    @param name: str, the name of a dataset in sharedDatasets
+    @return: Corpus, the dataset
+    '''
+    return sharedDatasets[name]
+
+
+def mixedDataset(loader, mixLoader, mixSize):
+    '''
+    @param loader: function returning the new training data
+    @param mixLoader: function returning the older training data
+    @param mixSize: int, the number of older sentences to mix in
+    @return: Corpus, the new training data followed by a random sample of
+        the older data, see corpus.sampleDataset
+    '''
+    datasets = [loader()]
+    sample = sampleDataset(mixLoader(), mixSize)
+    if sample:
+        datasets.append(sample)
+    corpora = []
+    for dataset in datasets:
+        if not isinstance(dataset, Corpus):
+            factors, dataset = datasetFactors(dataset)
+            dataset = internDataset(dataset, factors)
+        corpora.append(dataset)
+    return mergeCorpora(corpora)
+
 
 if __name__ == '__main__':
     # Default values:
@@ -42,6 +83,24 @@ if __name__ == '__main__':
         'output': 'o.wa',
         'showFigure': 0,
         'intersect': False,
+        'hashBuckets': '',
+        'frequencyOrder': False,
+        'noCorpusCache': False,
+        'rebuildCache': False,
+        'parseWorkers': 1,
+        'compressionThreads': 1,
+        'shard': '',
+        'symmetrisation': 'intersection',
+        'decodeWorkers': 1,
+        'ibm1Cache': '',
+        'loadIBM1': '',
+        'continueTraining': False,
+        'mixData': '',
+        'mixDataTag': '',
+        'mixSize': 1000,
+        'stream': False,
+        'streamBatch': 100,
+        'streamDelay': 0.1,
 
         'loadModel': "",
         'saveModel': "",
@@ -135,6 +194,86 @@ if __name__ == '__main__':
         ap.add_argument(
             "--intersect", dest="intersect", action='store_true',
             help="Do intersection training.")
+        ap.add_argument(
+            "--symmetrise", dest="symmetrisation", choices=methods,
+            help="How the alignments of both directions are combined in " +
+                 "--intersect mode, default intersection")
+        ap.add_argument(
+            "--hash-buckets", dest="hashBuckets",
+            help="Hash the words of each factor into a fixed number of " +
+                 "buckets, comma separated, e.g. 1000000,0 hashes FORM " +
+                 "only. Only used when training a new model")
+        ap.add_argument(
+            "--frequency-order", dest="frequencyOrder", action='store_true',
+            help="Number new words by descending frequency and keep the " +
+                 "training data in the narrowest integer type possible")
+        ap.add_argument(
+            "--no-corpus-cache", dest="noCorpusCache", action='store_true',
+            help="Parse the data files on every run instead of keeping a " +
+                 "binary cache of them next to the data")
+        ap.add_argument(
+            "--rebuild-cache", dest="rebuildCache", action='store_true',
+            help="Parse the data files again and rewrite their binary cache")
+        ap.add_argument(
+            "--parse-workers", dest="parseWorkers", type=int,
+            help="Number of processes parsing the data and reference " +
+                 "files, default 1")
+        ap.add_argument(
+            "--compression-threads", dest="compressionThreads", type=int,
+            help="Number of threads compressing and decompressing .gz, " +
+                 ".bz2 and .xz files, with pigz, lbzip2/pbzip2 or xz if " +
+                 "installed. Default 1")
+        ap.add_argument(
+            "--shard", dest="shard",
+            help="Only use shard K of N of the training and testing data, " +
+                 "written as K/N with K counting from 0. Each shard is " +
+                 "read directly from its first line, through line indexes " +
+                 "kept next to the data files")
+        ap.add_argument(
+            "--decode-workers", dest="decodeWorkers", type=int,
+            help="Number of processes decoding each direction, default 1. " +
+                 "They are forked once the model is loaded and share it")
+        ap.add_argument(
+            "--ibm1-cache", dest="ibm1Cache",
+            help="Directory keeping the IBM model 1 the HMM models start " +
+                 "from, which is reused when trained on the same data for " +
+                 "as many iterations")
+        ap.add_argument(
+            "--load-ibm1", dest="loadIBM1",
+            help="IBM1 model file the HMM models start from instead of " +
+                 "training one. In --intersect mode, the reverse model is " +
+                 "the one saved next to it")
+        ap.add_argument(
+            "--continue", dest="continueTraining", action='store_true',
+            help="Continue training the model given by -l on the training " +
+                 "data, extending its lexikon and tables, instead of " +
+                 "training a new model")
+        ap.add_argument(
+            "--mix-data", dest="mixData",
+            help="Text file prefix of older training data, a random " +
+                 "sample of which is mixed with the training data in " +
+                 "--continue mode")
+        ap.add_argument(
+            "--mix-data-tag", dest="mixDataTag",
+            help="Tag file prefix of the older training data")
+        ap.add_argument(
+            "--mix-size", dest="mixSize", type=int,
+            help="Number of sentences of the older training data mixed in, " +
+                 "default 1000")
+        ap.add_argument(
+            "--stream", dest="stream", action='store_true',
+            help="Align the sentence pairs read from the standard input, " +
+                 "one 'source ||| target' pair per line with factors as " +
+                 "in word|POS, and write their alignment to the standard " +
+                 "output. Requires a model to load")
+        ap.add_argument(
+            "--stream-batch", dest="streamBatch", type=int,
+            help="Number of sentences decoded together in --stream mode, " +
+                 "default 100")
+        ap.add_argument(
+            "--stream-delay", dest="streamDelay", type=float,
+            help="Longest time in seconds a sentence waits for the rest of " +
+                 "its batch in --stream mode, default 0.1")
         args = ap.parse_args()
 
     # Process config file
@@ -173,6 +312,33 @@ if __name__ == '__main__':
     if not checkAlignmentModel(Model):
         raise TypeError("Invalid Model class")
 
+    if config['continueTraining'] is True and\
+            (config['loadModel'] == "" or config['trainData'] == ""):
+        __logger.error("A model to load and training data are required in " +
+                       "--continue mode")
+        sys.exit(1)
+
+    if config['stream'] is True:
+        # The models are loaded once, and every batch read from the standard
+        # input is written out as soon as it is decoded. Logs go to the
+        # standard error.
+        if config['loadModel'] == "":
+            __logger.error("A model to load is required in --stream mode")
+            sys.exit(1)
+        session = AlignmentSession(
+            Model, config['loadModel'],
+            reversedModelFile(config['loadModel'])
+            if config['intersect'] is True else None,
+            config['symmetrisation'], config['forceLoad'],
+            batchSize=config['streamBatch'],
+            decodeWorkers=config['decodeWorkers'])
+        for batch in iterStreamBatches(sys.stdin, config['streamBatch'],
+                                       config['streamDelay']):
+            sys.stdout.writelines([formatAlignment(sentenceAlignment) for
+                                   sentenceAlignment in session.align(batch)])
+            sys.stdout.flush()
+        sys.exit(0)
+
     aligner = Model()
     if "version" in vars(aligner):
         __logger.info("Model version: " + str(aligner.version))
@@ -180,6 +346,30 @@ if __name__ == '__main__':
         alignerReverse = Model()
 
     # Load datasets
+    fileIO.compressionThreads = config['compressionThreads']
+    if config['noCorpusCache'] is not True:
+        loadData = partial(loadCachedCorpus, rebuild=config['rebuildCache'],
+                           processes=config['parseWorkers'])
+    elif config['parseWorkers'] > 1:
+        loadData = partial(parallelLoadCorpus,
+                           processes=config['parseWorkers'])
+    else:
+        loadData = iterDataset
+
+    if config['shard'] != '':
+        shard, shards = [int(k) for k in config['shard'].split('/')]
+
+    def datasetLoader(sourceFiles, linesToLoad):
+        # Returns the loader of a dataset, reading linesToLoad sentences, or
+        # the selected shard of them from the data files
+        if config['shard'] == '':
+            return partial(loadData, linesToLoad=linesToLoad)
+        start, end = shardRange(min(countLines(sourceFiles[0]), linesToLoad),
+                                shard, shards)
+        __logger.info("Using sentences [%d, %d) of %s" %
+                      (start, end, sourceFiles[0]))
+        return partial(iterDatasetRange, start=start, end=end)
+
     if config['trainData'] != "":
         trainSourceFiles = [os.path.expanduser(
             "%s.%s" % (os.path.join(config['dataDir'], config['trainData']),
@@ -201,22 +391,42 @@ if __name__ == '__main__':
                 config['trainAlignment']))
         else:
             trainAlignment = ''
-        __logger.info("Loading dataset")
-        trainDataset = loadDataset(trainSourceFiles,
-                                   trainTargetFiles,
-                                   trainAlignment,
-                                   linesToLoad=config['trainSize'])
-        if config['intersect'] is True:
-            __logger.info("Loading reversed dataset")
-            trainDataset2 = loadDataset(trainTargetFiles,
-                                        trainSourceFiles,
-                                        trainAlignment,
-                                        reverse=True,
-                                        linesToLoad=config['trainSize'])
-        else:
-            trainDataset2 = None
+        # Compressed files are used when the plain ones don't exist
+        trainSourceFiles = [findFile(fileName) for fileName in
+                            trainSourceFiles]
+        trainTargetFiles = [findFile(fileName) for fileName in
+                            trainTargetFiles]
+        if trainAlignment != '':
+            trainAlignment = findFile(trainAlignment)
+        # The datasets are read by each worker, lazily sentence by sentence
+        # or from the corpus cache
+        trainLoader = datasetLoader(trainSourceFiles, config['trainSize'])
+        trainDataset = partial(trainLoader,
+                               trainSourceFiles,
+                               trainTargetFiles,
+                               trainAlignment)
+
+        if config['continueTraining'] is True and config['mixData'] != '':
+            mixSourceFiles, mixTargetFiles = [], []
+            for prefix in (config['mixData'], config['mixDataTag']):
+                if prefix == '':
+                    continue
+                prefix = os.path.join(config['dataDir'], prefix)
+                mixSourceFiles.append(findFile(os.path.expanduser(
+                    "%s.%s" % (prefix, config['sourceLanguage']))))
+                mixTargetFiles.append(findFile(os.path.expanduser(
+                    "%s.%s" % (prefix, config['targetLanguage']))))
+            mixAlignment = ''
+            if config['trainAlignment'] != '':
+                mixAlignment = findFile(os.path.expanduser("%s.%s" % (
+                    os.path.join(config['dataDir'], config['mixData']),
+                    config['trainAlignment'])))
+            trainDataset = partial(
+                mixedDataset, trainDataset,
+                partial(iterDataset, mixSourceFiles, mixTargetFiles,
+                        mixAlignment), config['mixSize'])
     else:
-        trainDataset = trainDataset2 = None
+        trainDataset = None
 
     if config['testData'] != "":
         testSourceFiles = [os.path.expanduser(
@@ -232,15 +442,50 @@ if __name__ == '__main__':
             testTargetFiles.append(os.path.expanduser("%s.%s" % (
                 os.path.join(config['dataDir'], config['testDataTag']),
                 config['targetLanguage'])))
-        testDataset = loadDataset(testSourceFiles, testTargetFiles,
-                                  linesToLoad=config['testSize'])
-        if config['intersect'] is True:
-            testDataset2 = loadDataset(testTargetFiles, testSourceFiles,
-                                       linesToLoad=config['testSize'])
-        else:
-            testDataset2 = None
+        testSourceFiles = [findFile(fileName) for fileName in testSourceFiles]
+        testTargetFiles = [findFile(fileName) for fileName in testTargetFiles]
+        testLoader = datasetLoader(testSourceFiles, config['testSize'])
+        testDataset = partial(testLoader, testSourceFiles, testTargetFiles)
     else:
-        testDataset = testDataset2 = None
+        testDataset = None
+
+    trainDataset2 = testDataset2 = None
+    if config['intersect'] is True:
+        # Both directions use the same files. They are parsed only once here,
+        # the reversed datasets are derived from the result, and the workers
+        # forked below inherit all of them instead of receiving copies.
+        for name, loader in (("train", trainDataset), ("test", testDataset)):
+            if loader is None:
+                continue
+            __logger.info("Loading " + name + " dataset for both directions")
+            dataset = loader()
+            if not isinstance(dataset, Corpus):
+                factors, dataset = datasetFactors(dataset)
+                dataset = internDataset(dataset, factors)
+            sharedDatasets[name] = dataset
+            sharedDatasets[name + "Reversed"] = dataset.reversed()
+        if trainDataset is not None:
+            trainDataset = partial(sharedDataset, "train")
+            trainDataset2 = partial(sharedDataset, "trainReversed")
+        if testDataset is not None:
+            testDataset = partial(sharedDataset, "test")
+            testDataset2 = partial(sharedDataset, "testReversed")
+
+    # Without intersection, the alignment of each sentence is written out as
+    # soon as it is decoded
+    streamOutput = config['intersect'] is not True and config['output'] != ""
+    # and then it can also be scored straight away, instead of the whole
+    # output being read back
+    evaluateOutput = streamOutput and config['reference'] != "" and\
+        config['showFigure'] == 0 and bool(aligner.evaluate)
+
+    def loadReference():
+        if config['shard'] != '':
+            return loadAlignmentRange(findFile(config['reference']),
+                                      testLoader.keywords['start'],
+                                      testLoader.keywords['end'])
+        return parallelLoadAlignment(findFile(config['reference']),
+                                     processes=config['parseWorkers'])
 
     def work(arguments):
         trainDataset, testDataset, reversed = arguments
@@ -249,12 +494,30 @@ if __name__ == '__main__':
         if config['loadModel'] != "":
             loadFile = config['loadModel']
             if reversed:
-                loadFile = ".".join(loadFile.split(".")[:-1] + ["rev"] +
-                                    [loadFile.split(".")[-1]])
+                loadFile = reversedModelFile(loadFile)
             aligner.loadModel(loadFile, force=config['forceLoad'])
 
+        if config['hashBuckets'] != '':
+            aligner.hashBuckets =\
+                [int(buckets) for buckets in config['hashBuckets'].split(',')]
+        aligner.frequencyOrder = config['frequencyOrder']
+        aligner.decodeWorkers = config['decodeWorkers']
+        if "ibm1CacheDir" in vars(aligner):
+            aligner.ibm1CacheDir = config['ibm1Cache']
+            aligner.ibm1File = config['loadIBM1']
+            if reversed and config['loadIBM1'] != "":
+                aligner.ibm1File = reversedModelFile(config['loadIBM1'])
+
         if trainDataset is not None:
-            aligner.train(trainDataset, config['iterations'])
+            if reversed:
+                __logger.info("Loading reversed dataset")
+            else:
+                __logger.info("Loading dataset")
+            if config['continueTraining'] is True:
+                aligner.continueTraining(trainDataset(),
+                                         config['iterations'])
+            else:
+                aligner.train(trainDataset(), config['iterations'])
 
         if config['saveModel'] != "":
             saveFile = config['saveModel']
@@ -266,19 +529,58 @@ if __name__ == '__main__':
                     saveFile += ".rev"
             aligner.saveModel(saveFile)
 
+        if testDataset is not None and evaluateOutput:
+            with AlignmentWriter(config['output']) as writer:
+                decoded = writer.passThrough(
+                    aligner.iterDecode(testDataset()))
+                aligner.evaluate(decoded, loadReference(), 0)
+                # The reference may be shorter than the test data
+                for sentenceAlignment in decoded:
+                    pass
+            return (reversed, None)
+        if testDataset is not None and streamOutput:
+            with AlignmentWriter(config['output']) as writer:
+                aligner.decode(testDataset(), config['showFigure'],
+                               output=writer)
+            return (reversed, None)
         if testDataset is not None:
-            alignResult = aligner.decode(testDataset, config['showFigure'])
-            return (reversed, alignResult)
+            # The alignment is collected into arrays, which are far cheaper
+            # to send back to the main process than lists of tuples
+            builder = AlignmentBuilder()
+            aligner.decode(testDataset(), config['showFigure'],
+                           output=builder)
+            return (reversed, builder.alignment())
         return (None, None)
 
     arg = [(trainDataset, testDataset, False), ]
     if config['intersect'] is True:
         arg.append((trainDataset2, testDataset2, True))
 
+    def runWork(arguments, connection):
+        connection.send(work(arguments))
+        connection.close()
+
     if len(arg) == 1:
         result = [work(arg[0])]
     else:
-        result = multiprocessing.Pool(2).map(work, arg)
+        # One process per direction. They are not daemonic, unlike those of
+        # a Pool, so that they can start decoding processes of their own.
+        workers = []
+        for arguments in arg:
+            receiver, sender = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(target=runWork,
+                                              args=(arguments, sender))
+            process.start()
+            sender.close()
+            workers.append((process, receiver))
+        result = []
+        for process, receiver in workers:
+            try:
+                result.append(receiver.recv())
+            except EOFError:
+                raise RuntimeError("Worker process failed")
+        for process, receiver in workers:
+            process.join()
 
     if config['testData'] != "":
         for (resultReversed, resultAlignment) in result:
@@ -288,29 +590,28 @@ if __name__ == '__main__':
                 alignResult = resultAlignment
 
         if config['intersect'] is True:
-            # Intersection is performed here.
-            result = []
-            for align, alignRev in zip(alignResult, alignResultRev):
-                sentenceAlignment = []
-                for item in align:
-                    if len(item) == 2:
-                        # Without alignment type
-                        if (item[1], item[0]) in alignRev:
-                            sentenceAlignment.append(item)
-                    else:
-                        # With alignment type
-                        if (item[1], item[0], item[2]) in alignRev:
-                            sentenceAlignment.append(item)
-                result.append(sentenceAlignment)
-            alignResult = result
-
-        if config['output'] != "":
+            # Symmetrisation is performed here.
+            alignResult = symmetrise(alignResult, alignResultRev.reversed(),
+                                     config['symmetrisation'])
+        if alignResult is not None:
+            alignResult = [sentenceAlignment["certain"] for sentenceAlignment
+                           in alignResult]
+
+        if config['output'] != "" and not streamOutput:
             exportToFile(alignResult, config['output'])
 
-        if config['reference'] != "":
-            reference = loadAlignment(config['reference'])
+        if config['reference'] != "" and streamOutput and\
+                not evaluateOutput:
+            # The alignment was not kept in memory, it is read back instead
+            alignResult = [sentenceAlignment["certain"] for sentenceAlignment
+                           in parallelLoadAlignment(
+                               config['output'],
+                               processes=config['parseWorkers'])]
+
+        if config['reference'] != "" and not evaluateOutput:
             if aligner.evaluate:
-                aligner.evaluate(alignResult, reference, config['showFigure'])
+                aligner.evaluate(alignResult, loadReference(),
+                                 config['showFigure'])
         if config['showFigure'] > 0:
             from models.plot import showPlot
             showPlot()
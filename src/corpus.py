@@ -0,0 +1,721 @@
+# -*- coding: utf-8 -*-
+
+#
+# Corpus of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the columnar representation of a lexicalised dataset. Instead of
+# keeping every sentence as a list of tuples of Python ints, the word ids of
+# every factor (FORM, POS, etc.) are kept in one flat integer array per side,
+# with an offset array marking where each sentence starts. Sentences are
+# handed out as zero-copy views of shape (sentenceLength, factors), so they
+# can be used exactly like the old lists of tuples (f[i][index]) while whole
+# columns can be taken without any conversion (f[:, index]).
+#
+import os
+import random
+import unittest
+from array import array
+from itertools import chain, islice
+import numpy as np
+__version__ = "0.1a"
+
+
+class Corpus():
+    def __init__(self, fWords, fOffsets, eWords, eOffsets, alignment=None,
+                 fVocab=None, eVocab=None):
+        '''
+        @param fWords: np.ndarray, shape (factors, tokens). Ids of all source
+            language tokens, one row per factor.
+        @param fOffsets: np.ndarray, shape (sentences + 1,). Sentence i
+            occupies the columns fOffsets[i]:fOffsets[i + 1] of fWords.
+        @param eWords: np.ndarray, same as fWords for target language.
+        @param eOffsets: np.ndarray, same as fOffsets for target language.
+        @param alignment: list, the alignment of each sentence. Empty lists
+            are used if not specified.
+        @param fVocab: list of lists of str, one list per factor. When given,
+            the ids in fWords are not those of a model lexikon but positions
+            in this vocabulary of the corpus itself, see internDataset.
+        @param eVocab: list of lists of str, same as fVocab for target
+            language.
+        '''
+        if len(fOffsets) != len(eOffsets):
+            raise ValueError("Source and target offsets differ in length")
+        self.fWords = fWords
+        self.fOffsets = fOffsets
+        self.eWords = eWords
+        self.eOffsets = eOffsets
+        if alignment is None:
+            alignment = [[] for i in range(len(fOffsets) - 1)]
+        self.alignment = alignment
+        self.fVocab = fVocab
+        self.eVocab = eVocab
+        return
+
+    def __len__(self):
+        return len(self.fOffsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("Corpus only supports contiguous slices")
+            return self.subCorpus(start, max(start, stop))
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Corpus index out of range")
+        return (self.fWords[:, self.fOffsets[i]:self.fOffsets[i + 1]].T,
+                self.eWords[:, self.eOffsets[i]:self.eOffsets[i + 1]].T,
+                self.alignment[i])
+
+    def __iter__(self):
+        fWords, eWords, alignment = self.fWords, self.eWords, self.alignment
+        fOffsets = self.fOffsets.tolist()
+        eOffsets = self.eOffsets.tolist()
+        for i in range(len(self)):
+            yield (fWords[:, fOffsets[i]:fOffsets[i + 1]].T,
+                   eWords[:, eOffsets[i]:eOffsets[i + 1]].T,
+                   alignment[i])
+
+    def subCorpus(self, start, stop):
+        '''
+        Return the sentences in [start, stop) as a new Corpus. The word arrays
+        are shared with this corpus, only the offsets are copied.
+
+        @param start: int, the first sentence
+        @param stop: int, the sentence after the last one
+        @return: Corpus
+        '''
+        fStart, fStop = self.fOffsets[start], self.fOffsets[stop]
+        eStart, eStop = self.eOffsets[start], self.eOffsets[stop]
+        return Corpus(self.fWords[:, fStart:fStop],
+                      self.fOffsets[start:stop + 1] - fStart,
+                      self.eWords[:, eStart:eStop],
+                      self.eOffsets[start:stop + 1] - eStart,
+                      self.alignment[start:stop],
+                      self.fVocab, self.eVocab)
+
+    def reversed(self):
+        '''
+        Return the corpus with the source and target languages swapped, as
+        loaded by fileIO.iterDataset with the files swapped and reverse set.
+        The word arrays and vocabularies are shared with this corpus, only
+        the alignment entries are rebuilt, with their positions swapped.
+
+        @return: Corpus
+        '''
+        alignment = [[(item[1], item[0]) + tuple(item[2:])
+                      for item in sentenceAlignment]
+                     for sentenceAlignment in self.alignment]
+        return Corpus(self.eWords, self.eOffsets, self.fWords, self.fOffsets,
+                      alignment, self.eVocab, self.fVocab)
+
+    def lexicalise(self, fLookup, eLookup, dtype=np.int64):
+        '''
+        Map a corpus carrying its own vocabularies to the ids of a lexikon.
+        Every distinct word is looked up only once, the word arrays are then
+        rewritten with a single gather per factor.
+
+        @param fLookup: list of functions, one per factor, each mapping a list
+            of source language words to the list of their ids in the lexikon.
+        @param eLookup: list of functions, same as fLookup for target
+            language.
+        @param dtype: numpy dtype of the new word arrays
+        @return: Corpus, without vocabularies
+        '''
+        if self.fVocab is None or self.eVocab is None:
+            raise RuntimeError("Corpus has no vocabulary to lexicalise")
+
+        def remap(words, vocab, lookup):
+            result = np.zeros((len(lookup), words.shape[1]), dtype=dtype)
+            for index in range(len(lookup)):
+                mapping = np.asarray(lookup[index](vocab[index]), dtype=dtype)
+                result[index] = mapping[words[index]]
+            return result
+
+        return Corpus(remap(self.fWords, self.fVocab, fLookup),
+                      self.fOffsets,
+                      remap(self.eWords, self.eVocab, eLookup),
+                      self.eOffsets,
+                      self.alignment)
+
+    def sortVocab(self):
+        '''
+        Reorder the vocabularies of the corpus by descending frequency of the
+        words in the corpus, words of the same frequency keeping the order of
+        their first occurrence. A lexikon extended by lexicalise afterwards
+        gives its new words ids in this order, so the most frequent words get
+        the smallest ids and sit together at the start of the tables indexed
+        by them.
+
+        @return: Corpus, with sorted vocabularies
+        '''
+        if self.fVocab is None or self.eVocab is None:
+            raise RuntimeError("Corpus has no vocabulary to sort")
+
+        def sort(words, vocab):
+            result = np.zeros(words.shape, dtype=words.dtype)
+            newVocab = []
+            for index in range(len(vocab)):
+                counts = np.bincount(words[index], minlength=len(vocab[index]))
+                order = np.argsort(-counts, kind='mergesort')
+                rank = np.zeros(len(order), dtype=words.dtype)
+                rank[order] = np.arange(len(order))
+                result[index] = rank[words[index]]
+                newVocab.append([vocab[index][i] for i in order.tolist()])
+            return result, newVocab
+
+        fWords, fVocab = sort(self.fWords, self.fVocab)
+        eWords, eVocab = sort(self.eWords, self.eVocab)
+        return Corpus(fWords, self.fOffsets, eWords, self.eOffsets,
+                      self.alignment, fVocab, eVocab)
+
+    def narrow(self):
+        '''
+        @return: Corpus, with the word arrays stored in the narrowest signed
+            integer type that holds all of the ids, see narrowestType.
+        '''
+        dtype = narrowestType(
+            max([words.max() for words in (self.fWords, self.eWords)
+                 if words.size] + [0]),
+            min([words.min() for words in (self.fWords, self.eWords)
+                 if words.size] + [0]))
+        return Corpus(self.fWords.astype(dtype, copy=False), self.fOffsets,
+                      self.eWords.astype(dtype, copy=False), self.eOffsets,
+                      self.alignment, self.fVocab, self.eVocab)
+
+    def factors(self):
+        '''
+        @return: int, the number of factors (FORM, POS, etc.) of each word.
+        '''
+        return self.fWords.shape[0]
+
+    def nbytes(self):
+        '''
+        @return: int, memory used by the word and offset arrays in bytes.
+        '''
+        return (self.fWords.nbytes + self.fOffsets.nbytes +
+                self.eWords.nbytes + self.eOffsets.nbytes)
+
+
+class CorpusBuilder():
+    def __init__(self, factors, typecode='i'):
+        '''
+        Accumulates lexicalised sentences into growable buffers, so that a
+        Corpus can be built in a single pass over a dataset.
+
+        @param factors: int, the number of factors of each word
+        @param typecode: str, typecode of the buffers, see module array. The
+            default 'i' produces int32 arrays.
+        '''
+        self.typecode = typecode
+        self.fWords = [array(typecode) for i in range(factors)]
+        self.eWords = [array(typecode) for i in range(factors)]
+        self.fOffsets = array('l', [0])
+        self.eOffsets = array('l', [0])
+        self.alignment = []
+        return
+
+    def append(self, fIds, eIds, alignment):
+        '''
+        @param fIds: list of lists of int, the ids of the source sentence, one
+            list per factor.
+        @param eIds: list of lists of int, the same for target sentence.
+        @param alignment: list, the alignment of the sentence.
+        '''
+        for index in range(len(self.fWords)):
+            self.fWords[index].extend(fIds[index])
+            self.eWords[index].extend(eIds[index])
+        self.fOffsets.append(len(self.fWords[0]))
+        self.eOffsets.append(len(self.eWords[0]))
+        self.alignment.append(alignment)
+        return
+
+    def corpus(self, dtype=np.int32):
+        '''
+        @param dtype: numpy dtype of the word arrays
+        @return: Corpus
+        '''
+        def stack(buffers, offsets):
+            words = np.zeros((len(buffers), offsets[-1]), dtype=dtype)
+            for index in range(len(buffers)):
+                words[index] = np.frombuffer(buffers[index],
+                                             dtype=buffers[index].typecode)
+            return words
+
+        return Corpus(stack(self.fWords, self.fOffsets),
+                      np.array(self.fOffsets, dtype=np.int64),
+                      stack(self.eWords, self.eOffsets),
+                      np.array(self.eOffsets, dtype=np.int64),
+                      self.alignment)
+
+
+def _joinWords(words):
+    # Words come from whitespace separated files, so they never contain "\n"
+    return np.array(bytearray("\n".join(words)), dtype=np.uint8)
+
+
+def _splitWords(buf):
+    if len(buf) == 0:
+        return []
+    return buf.tostring().split("\n")
+
+
+def saveCorpus(corpus, fileName):
+    '''
+    Save a Corpus in the NumPy .npz format. The word and offset arrays are
+    stored as they are, the vocabularies (if any) and the alignment are
+    flattened into arrays as well, so nothing is pickled. The file is written
+    under a temporary name first and renamed once complete, so a crashed run
+    never leaves a truncated file behind.
+
+    @param corpus: Corpus, lexicalised or carrying its own vocabularies
+    @param fileName: str, the file to save to
+    '''
+    alignOffsets = [0]
+    alignPositions = []
+    alignTypes = []
+    typeVocab = {}
+    for sentenceAlignment in corpus.alignment:
+        for item in sentenceAlignment:
+            alignPositions.append(item[:2])
+            if len(item) > 2:
+                alignTypes.append(_internWords(typeVocab, [item[2]])[0])
+            else:
+                alignTypes.append(-1)
+        alignOffsets.append(len(alignPositions))
+    typeList = [None] * len(typeVocab)
+    for alignmentType in typeVocab:
+        typeList[typeVocab[alignmentType]] = alignmentType
+
+    arrays = {
+        "fWords": corpus.fWords,
+        "fOffsets": corpus.fOffsets,
+        "eWords": corpus.eWords,
+        "eOffsets": corpus.eOffsets,
+        "alignOffsets": np.array(alignOffsets, dtype=np.int64),
+        "alignPositions": np.array(alignPositions,
+                                   dtype=np.int32).reshape(-1, 2),
+        "alignTypes": np.array(alignTypes, dtype=np.int32),
+        "alignTypeVocab": _joinWords(typeList)}
+    if corpus.fVocab is not None and corpus.eVocab is not None:
+        for index in range(len(corpus.fVocab)):
+            arrays["fVocab%d" % index] = _joinWords(corpus.fVocab[index])
+            arrays["eVocab%d" % index] = _joinWords(corpus.eVocab[index])
+
+    tmpFileName = fileName + ".tmp%d" % os.getpid()
+    output = open(tmpFileName, "wb")
+    try:
+        np.savez(output, **arrays)
+    finally:
+        output.close()
+    os.rename(tmpFileName, fileName)
+    return
+
+
+def loadCorpus(fileName):
+    '''
+    Load a Corpus saved by saveCorpus.
+
+    @param fileName: str, the file to load
+    @return: Corpus
+    '''
+    data = np.load(fileName)
+    try:
+        typeList = _splitWords(data["alignTypeVocab"])
+        alignOffsets = data["alignOffsets"].tolist()
+        alignPositions = [tuple(item) for item in
+                          data["alignPositions"].tolist()]
+        alignTypes = data["alignTypes"].tolist()
+        alignment = []
+        for i in range(len(alignOffsets) - 1):
+            sentenceAlignment = []
+            for k in range(alignOffsets[i], alignOffsets[i + 1]):
+                if alignTypes[k] < 0:
+                    sentenceAlignment.append(alignPositions[k])
+                else:
+                    sentenceAlignment.append(alignPositions[k] +
+                                             (typeList[alignTypes[k]], ))
+            alignment.append(sentenceAlignment)
+
+        fVocab = eVocab = None
+        if "fVocab0" in data.files:
+            factors = data["fWords"].shape[0]
+            fVocab = [_splitWords(data["fVocab%d" % index])
+                      for index in range(factors)]
+            eVocab = [_splitWords(data["eVocab%d" % index])
+                      for index in range(factors)]
+        return Corpus(data["fWords"], data["fOffsets"],
+                      data["eWords"], data["eOffsets"],
+                      alignment, fVocab, eVocab)
+    finally:
+        data.close()
+
+
+def narrowestType(maxValue, minValue=0):
+    '''
+    @param maxValue: int, the largest value to be stored
+    @param minValue: int, the smallest value to be stored
+    @return: numpy dtype, the narrowest signed integer type holding both.
+    '''
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= minValue and maxValue <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _internWords(vocab, words):
+    ids = []
+    for word in words:
+        i = vocab.get(word)
+        if i is None:
+            i = vocab[word] = len(vocab)
+        ids.append(i)
+    return ids
+
+
+def datasetFactors(dataset):
+    '''
+    Find the number of factors (FORM, POS, etc.) of the words of a dataset,
+    without losing any sentence of the dataset if it can only be iterated
+    over once.
+
+    @param dataset: Dataset or iterable of sentences
+    @return: (int, Dataset), the number of factors and the dataset to use
+        from now on.
+    '''
+    if isinstance(dataset, Corpus):
+        return dataset.factors(), dataset
+    if isinstance(dataset, (list, tuple)):
+        return len(dataset[0][0][0]), dataset
+    dataset = iter(dataset)
+    first = next(dataset)
+    return len(first[0][0]), chain((first, ), dataset)
+
+
+def iterChunks(dataset, chunkSize):
+    '''
+    Go through a dataset a number of sentences at a time. Lists and Corpora
+    are sliced, any other iterable, such as the one returned by
+    fileIO.iterDataset, is read lazily.
+
+    @param dataset: Dataset, Corpus or iterable of sentences
+    @param chunkSize: int, the number of sentences in each chunk
+    @return: generator of Datasets or Corpora
+    '''
+    if isinstance(dataset, (list, tuple, Corpus)):
+        for start in range(0, len(dataset), chunkSize):
+            yield dataset[start:start + chunkSize]
+        return
+    dataset = iter(dataset)
+    chunk = list(islice(dataset, chunkSize))
+    while chunk:
+        yield chunk
+        chunk = list(islice(dataset, chunkSize))
+    return
+
+
+def sampleDataset(dataset, size, seed=0):
+    '''
+    Draw a uniform random sample of the sentences of a dataset in a single
+    pass (reservoir sampling), so that a dataset read lazily, such as the one
+    returned by fileIO.iterDataset, is never held in memory as a whole.
+
+    @param dataset: Dataset or any iterable of sentences
+    @param size: int, the number of sentences to draw, all of them if the
+        dataset has fewer
+    @param seed: int, the seed of the random number generator, the same seed
+        draws the same sentences
+    @return: Dataset, the sentences drawn, in the order of the dataset
+    '''
+    generator = random.Random(seed)
+    sample = []
+    for k, sentence in enumerate(dataset):
+        if k < size:
+            sample.append((k, sentence))
+            continue
+        r = generator.randint(0, k)
+        if r < size:
+            sample[r] = (k, sentence)
+    sample.sort(key=lambda item: item[0])
+    return [sentence for k, sentence in sample]
+
+
+def internDataset(dataset, factors):
+    '''
+    Turn a dataset of words into a Corpus in a single pass, without touching
+    any lexikon. Each distinct word of each factor is kept only once, in the
+    fVocab and eVocab of the returned Corpus, and the word arrays hold the
+    positions of the words in these vocabularies. Use Corpus.lexicalise to
+    obtain the ids of a model's lexikon afterwards.
+
+    @param dataset: Dataset. A dataset, or any iterable of sentences
+    @param factors: int, the number of factors (FORM, POS, etc.) to keep
+    @return: Corpus
+    '''
+    fVocab = [{} for index in range(factors)]
+    eVocab = [{} for index in range(factors)]
+    builder = CorpusBuilder(factors)
+    for f, e, alignment in dataset:
+        builder.append(
+            [_internWords(fVocab[index], [fWord[index] for fWord in f])
+             for index in range(factors)],
+            [_internWords(eVocab[index], [eWord[index] for eWord in e])
+             for index in range(factors)],
+            alignment)
+
+    corpus = builder.corpus()
+    corpus.fVocab = [_vocabList(vocab) for vocab in fVocab]
+    corpus.eVocab = [_vocabList(vocab) for vocab in eVocab]
+    return corpus
+
+
+def _vocabList(vocab):
+    words = [None] * len(vocab)
+    for word in vocab:
+        words[vocab[word]] = word
+    return words
+
+
+def mergeCorpora(corpora):
+    '''
+    Concatenate Corpora, such as the ones interned from consecutive chunks of
+    a dataset. If all of them carry vocabularies, the vocabularies are merged
+    and the ids of each Corpus are remapped with a single gather per factor;
+    the result is then the same as interning the whole dataset at once.
+
+    @param corpora: list of Corpus, in order
+    @return: Corpus
+    '''
+    if len(corpora) == 0:
+        raise ValueError("No Corpus to merge")
+    factors = corpora[0].factors()
+    withVocab = all([corpus.fVocab is not None and corpus.eVocab is not None
+                     for corpus in corpora])
+    fVocab = [{} for index in range(factors)]
+    eVocab = [{} for index in range(factors)]
+
+    def remap(words, vocab, corpusVocab):
+        if not withVocab:
+            return words
+        remapped = np.zeros(words.shape, dtype=words.dtype)
+        for index in range(factors):
+            mapping = np.array(_internWords(vocab[index], corpusVocab[index]),
+                               dtype=words.dtype)
+            remapped[index] = mapping[words[index]]
+        return remapped
+
+    def concatenate(wordsList, offsetsList):
+        start = 0
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for words, corpusOffsets in zip(wordsList, offsetsList):
+            offsets.append(corpusOffsets[1:] + start)
+            start += words.shape[1]
+        return np.concatenate(wordsList, axis=1), np.concatenate(offsets)
+
+    alignment = []
+    for corpus in corpora:
+        alignment += corpus.alignment
+    fWords, fOffsets = concatenate(
+        [remap(corpus.fWords, fVocab, corpus.fVocab) for corpus in corpora],
+        [corpus.fOffsets for corpus in corpora])
+    eWords, eOffsets = concatenate(
+        [remap(corpus.eWords, eVocab, corpus.eVocab) for corpus in corpora],
+        [corpus.eOffsets for corpus in corpora])
+    result = Corpus(fWords, fOffsets, eWords, eOffsets, alignment)
+    if withVocab:
+        result.fVocab = [_vocabList(vocab) for vocab in fVocab]
+        result.eVocab = [_vocabList(vocab) for vocab in eVocab]
+    return result
+
+
+class TestCorpus(unittest.TestCase):
+    def buildCorpus(self):
+        builder = CorpusBuilder(2)
+        builder.append([[0, 1, 2], [3, 4, 5]], [[0, 1], [2, 3]], [(1, 1)])
+        builder.append([[], []], [[4], [5]], [])
+        builder.append([[6], [7]], [[6, 7, 8], [9, 10, 11]], [(1, 3)])
+        return builder.corpus()
+
+    def testSentenceViews(self):
+        corpus = self.buildCorpus()
+        self.assertEqual(len(corpus), 3)
+        f, e, alignment = corpus[0]
+        self.assertEqual(f.dtype, np.int32)
+        self.assertEqual(f.shape, (3, 2))
+        self.assertSequenceEqual([tuple(w) for w in f],
+                                 [(0, 3), (1, 4), (2, 5)])
+        self.assertSequenceEqual(e[:, 1].tolist(), [2, 3])
+        self.assertSequenceEqual(alignment, [(1, 1)])
+        self.assertEqual(len(corpus[1][0]), 0)
+        self.assertEqual(corpus[-1][1][2][1], 11)
+        # views share memory with the corpus
+        self.assertTrue(np.may_share_memory(corpus[2][1], corpus.eWords))
+        return
+
+    def testIteration(self):
+        corpus = self.buildCorpus()
+        for i, (f, e, alignment) in enumerate(corpus):
+            self.assertSequenceEqual(f.tolist(), corpus[i][0].tolist())
+            self.assertSequenceEqual(e.tolist(), corpus[i][1].tolist())
+            self.assertSequenceEqual(alignment, corpus[i][2])
+        return
+
+    def testSubCorpus(self):
+        corpus = self.buildCorpus()
+        sub = corpus[1:]
+        self.assertEqual(len(sub), 2)
+        self.assertSequenceEqual(sub[1][1].tolist(), corpus[2][1].tolist())
+        self.assertSequenceEqual(sub[1][2], [(1, 3)])
+        self.assertEqual(len(corpus[3:]), 0)
+        return
+
+    def testReversed(self):
+        corpus = self.buildCorpus()
+        reversedCorpus = corpus.reversed()
+        self.assertEqual(len(reversedCorpus), 3)
+        for (f, e, alignment), (rf, re, rAlignment) in\
+                zip(corpus, reversedCorpus):
+            self.assertSequenceEqual(rf.tolist(), e.tolist())
+            self.assertSequenceEqual(re.tolist(), f.tolist())
+            self.assertSequenceEqual(rAlignment,
+                                     [(e, f) for f, e in alignment])
+        self.assertTrue(reversedCorpus.fWords is corpus.eWords)
+        typed = internDataset([([("a", )], [("b", )], [(1, 2, "SEM")])], 1)
+        self.assertSequenceEqual(typed.reversed().fVocab, [["b"]])
+        self.assertSequenceEqual(typed.reversed().alignment,
+                                 [[(2, 1, "SEM")]])
+        return
+
+    def testInternAndLexicalise(self):
+        dataset = [
+            ([("a", "X"), ("b", "Y"), ("a", "Y")], [("A", "X")], []),
+            ([], [("B", "X"), ("C", "Z")], [(1, 1)])
+        ]
+        corpus = internDataset(dataset, 2)
+        self.assertSequenceEqual(corpus.fVocab, [["a", "b"], ["X", "Y"]])
+        self.assertSequenceEqual(corpus[0][0].tolist(),
+                                 [[0, 0], [1, 1], [0, 1]])
+        fIndex = {"a": 5, "b": 6, "X": 1, "Y": 2}
+        eIndex = {"A": 0, "B": 1, "X": 7}
+        fLookup = [lambda words: [fIndex.get(word, -1) for word in words]]
+        eLookup = [lambda words: [eIndex.get(word, -1) for word in words]]
+        result = corpus.lexicalise(fLookup * 2, eLookup * 2)
+        self.assertIsNone(result.fVocab)
+        self.assertSequenceEqual(result[0][0].tolist(),
+                                 [[5, 1], [6, 2], [5, 2]])
+        self.assertSequenceEqual(result[1][1].tolist(), [[1, 7], [-1, -1]])
+        self.assertSequenceEqual(result[1][2], [(1, 1)])
+        self.assertEqual(len(result[1][0]), 0)
+        return
+
+    def testStreaming(self):
+        dataset = [
+            ([("a", "X")], [("A", "X")], []),
+            ([("b", "Y")], [("B", "X")], [(1, 1)]),
+            ([("c", "Y")], [("C", "Z")], [])
+        ]
+        factors, stream = datasetFactors(iter(dataset))
+        self.assertEqual(factors, 2)
+        self.assertSequenceEqual(list(stream), dataset)
+        chunks = list(iterChunks(iter(dataset), 2))
+        self.assertSequenceEqual(chunks, [dataset[:2], dataset[2:]])
+        corpus = internDataset(dataset, 2)
+        chunks = list(iterChunks(corpus, 2))
+        self.assertSequenceEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertSequenceEqual(chunks[1][0][1].tolist(),
+                                 corpus[2][1].tolist())
+        self.assertSequenceEqual(
+            internDataset(iter(dataset), 2)[1][1].tolist(), [[1, 0]])
+        return
+
+    def testMergeCorpora(self):
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], [(1, 1)]),
+            ([], [("B", "X")], []),
+            ([("c", "Y"), ("a", "Y")], [("C", "Z")], [(2, 1)]),
+            ([("b", "Z")], [("A", "Z")], [])
+        ]
+        whole = internDataset(dataset, 2)
+        merged = mergeCorpora([internDataset(dataset[:1], 2),
+                               internDataset(dataset[1:3], 2),
+                               internDataset(dataset[3:], 2)])
+        self.assertSequenceEqual(merged.fVocab, whole.fVocab)
+        self.assertSequenceEqual(merged.eVocab, whole.eVocab)
+        self.assertSequenceEqual(merged.fOffsets.tolist(),
+                                 whole.fOffsets.tolist())
+        self.assertSequenceEqual(merged.eWords.tolist(),
+                                 whole.eWords.tolist())
+        self.assertSequenceEqual(merged.fWords.tolist(),
+                                 whole.fWords.tolist())
+        self.assertSequenceEqual(merged.alignment, whole.alignment)
+        corpus = self.buildCorpus()
+        merged = mergeCorpora([corpus[:1], corpus[1:]])
+        self.assertIsNone(merged.fVocab)
+        self.assertSequenceEqual(merged[2][1].tolist(),
+                                 corpus[2][1].tolist())
+        return
+
+    def testSampleDataset(self):
+        dataset = [([(str(k), )], [(str(k), )], []) for k in range(100)]
+        sample = sampleDataset(iter(dataset), 10, seed=1)
+        self.assertEqual(len(sample), 10)
+        self.assertSequenceEqual(sample, sorted(sample,
+                                                key=lambda s: int(s[0][0][0])))
+        self.assertTrue(all([sentence in dataset for sentence in sample]))
+        self.assertSequenceEqual(sampleDataset(dataset, 10, seed=1), sample)
+        self.assertNotEqual(sampleDataset(dataset, 10, seed=2), sample)
+        self.assertSequenceEqual(sampleDataset(dataset[:5], 10), dataset[:5])
+        return
+
+    def testSaveAndLoad(self):
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], [(1, 1, "SEM")]),
+            ([], [("B", "X")], []),
+            ([("c", "Y")], [("C", "Z")], [(1, 1), (1, 1, "FUN")])
+        ]
+        fileName = "support/ut_corpus.npz"
+        for corpus in (internDataset(dataset, 2), self.buildCorpus()):
+            saveCorpus(corpus, fileName)
+            loaded = loadCorpus(fileName)
+            os.remove(fileName)
+            self.assertEqual(len(loaded), len(corpus))
+            self.assertEqual(loaded.fWords.dtype, corpus.fWords.dtype)
+            self.assertEqual(loaded.fVocab, corpus.fVocab)
+            self.assertEqual(loaded.eVocab, corpus.eVocab)
+            for sentence, loadedSentence in zip(corpus, loaded):
+                self.assertSequenceEqual(loadedSentence[0].tolist(),
+                                         sentence[0].tolist())
+                self.assertSequenceEqual(loadedSentence[1].tolist(),
+                                         sentence[1].tolist())
+                self.assertSequenceEqual(loadedSentence[2], sentence[2])
+        return
+
+    def testSortVocabAndNarrow(self):
+        dataset = [
+            ([("a", "X"), ("b", "Y"), ("b", "Y")], [("A", "X")], []),
+            ([("c", "Y")], [("B", "X"), ("B", "Z")], [(1, 1)])
+        ]
+        corpus = internDataset(dataset, 2).sortVocab()
+        self.assertSequenceEqual(corpus.fVocab, [["b", "a", "c"], ["Y", "X"]])
+        self.assertSequenceEqual(corpus.eVocab,
+                                 [["B", "A"], ["X", "Z"]])
+        self.assertSequenceEqual(corpus[0][0].tolist(),
+                                 [[1, 1], [0, 0], [0, 0]])
+        self.assertSequenceEqual(corpus[1][1].tolist(), [[0, 0], [0, 1]])
+        narrowCorpus = corpus.narrow()
+        self.assertEqual(narrowCorpus.fWords.dtype, np.int8)
+        self.assertSequenceEqual(narrowCorpus[1][1].tolist(),
+                                 [[0, 0], [0, 1]])
+        self.assertEqual(narrowestType(127), np.int8)
+        self.assertEqual(narrowestType(128), np.int16)
+        self.assertEqual(narrowestType(40000), np.int32)
+        self.assertEqual(narrowestType(424242424242), np.int64)
+        self.assertEqual(narrowestType(0, -129), np.int16)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,869 @@
+# -*- coding: utf-8 -*-
+
+#
+# Distributed training of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the programme that trains a model on several machines sharing
+# nothing but a directory, each holding a shard of the training data. Every
+# pass over the data is split between the workers, one per shard: the
+# coordinator publishes the parameters in the directory, each worker goes
+# through its shard with them and writes its counts next to them (the E-step,
+# see the countComponents of the models), and the coordinator adds them up
+# and estimates the parameters of the next iteration (the M-step). The rest
+# of training is that of the model itself, so the model trained is the one
+# aligner.py trains on the shards put together in order.
+#
+#     python distributed.py worker --shard 0/4 --dir /shared/run -d data \
+#         --train train --source cn --target en       (on every machine)
+#     python distributed.py coordinator -m HMM -i 5 --shards 4 \
+#         --dir /shared/run -s hmm.pklz
+#
+# The files in the directory, in the order they are written:
+#
+#     shard.K.pkl         the vocabulary and the target sentence lengths of
+#                         shard K, written by its worker when it starts
+#     lexikon.pkl         the lexikon, built from the vocabularies
+#     parameters.N.pkl    the parameters the workers use in pass N
+#     pass.N.json         what the workers do in pass N
+#     counts.N.K.npz      the counts of shard K in pass N
+#     error.K.txt         the error that stopped the worker of shard K
+#     stop                written once training is over, or has failed
+#
+# Every file is written under a temporary name and renamed once complete, so
+# none is read half written, and the files of a pass are removed once it is
+# over. A directory is used for one training only. With "local" instead, the
+# workers are processes started by the coordinator on shards of the same
+# files, standing in for the machines.
+#
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import argparse
+import tempfile
+import importlib
+import traceback
+import multiprocessing
+import unittest
+import numpy as np
+import cPickle as pickle
+from collections import defaultdict
+from itertools import chain
+from functools import partial
+from loggers import logging, init_logger
+from models.modelChecker import checkAlignmentModel
+from models.modelBase import isLambda
+from corpus import internDataset, datasetFactors
+from fileIO import loadDataset, iterDatasetRange, shardRange, countLines,\
+    findFile
+__version__ = "0.1a"
+logger = logging.getLogger('DISTRIBUTED')
+
+# The components of a model holding its lexikon, which is published once
+_lexikonComponents = ("fLex", "eLex", "fIndex", "eIndex")
+
+
+def _writeFile(fileName, write):
+    # Write a file under a temporary name, and rename it once complete
+    tmpFileName = fileName + ".tmp%d" % os.getpid()
+    output = open(tmpFileName, "wb")
+    try:
+        write(output)
+    finally:
+        output.close()
+    os.rename(tmpFileName, fileName)
+    return
+
+
+def _dump(content, fileName):
+    _writeFile(fileName, lambda output: pickle.dump(
+        content, output, pickle.HIGHEST_PROTOCOL))
+    return
+
+
+def _load(fileName):
+    with open(fileName, "rb") as inputFile:
+        return pickle.load(inputFile)
+
+
+def _wait(fileName, pollInterval, timeout=None, check=None):
+    # Wait for another machine to write a file, calling check in between
+    deadline = None if timeout is None else time.time() + timeout
+    while not os.path.isfile(fileName):
+        if check is not None:
+            check()
+        if deadline is not None and time.time() > deadline:
+            raise RuntimeError("Timed out waiting for " + fileName)
+        time.sleep(pollInterval)
+    return
+
+
+class _TrainingOver(Exception):
+    pass
+
+
+def _lastLengths(lengths):
+    # initialValues(Len) sets the transitions of every length up to Len, so
+    # only the target sentences longer than all the following ones leave
+    # their initial values to the end of the first iteration
+    result = []
+    longest = 0
+    for Len in reversed(lengths):
+        if Len > longest:
+            result.append(Len)
+            longest = Len
+    return result[::-1]
+
+
+def _parameters(model):
+    # The components of a model but its lexikon. Tables of defaultdicts
+    # whose default values come from lambdas can't be pickled.
+    parameters = {}
+    for name in model.modelComponents:
+        if name in _lexikonComponents:
+            continue
+        value = getattr(model, name)
+        if isinstance(value, list):
+            value = [defaultdict(float, row)
+                     if isinstance(row, defaultdict) and
+                     isLambda(row.default_factory) else row
+                     for row in value]
+        parameters[name] = value
+    return parameters
+
+
+def saveCounts(counts, fileName):
+    '''
+    Save the counts of a pass over a shard in the NumPy .npz format, under a
+    temporary name first as models.modelBase.saveTranslationTable does.
+    Tables, lists with a dict from target language word ids to counts for
+    each source language word id, are kept as flat arrays of the sizes of the
+    dicts, the ids and the counts. A count is a float or, as in c_feh, an
+    array with one for each alignment type.
+
+    @param counts: dict, from names to NumPy arrays or tables
+    @param fileName: str, the file to save to
+    '''
+    arrays = {}
+    for name, count in counts.items():
+        if isinstance(count, np.ndarray):
+            arrays[name] = count
+            continue
+        sizes = np.array([len(row) for row in count], dtype=np.int64)
+        arrays[name + ".sizes"] = sizes
+        arrays[name + ".e"] = np.fromiter(
+            chain.from_iterable([row.iterkeys() for row in count]),
+            dtype=np.int64, count=int(sizes.sum()))
+        arrays[name + ".values"] = np.array(
+            list(chain.from_iterable([row.itervalues() for row in count])),
+            dtype=np.float64)
+    _writeFile(fileName, lambda output: np.savez(output, **arrays))
+    return
+
+
+def loadCounts(fileName):
+    '''
+    Load the counts saved by saveCounts.
+
+    @param fileName: str, the file to load
+    @return: dict, from names to NumPy arrays or tables, the rows of tables
+        being defaultdict(float)
+    '''
+    data = np.load(fileName)
+    try:
+        arrays = dict([(name, data[name]) for name in data.files])
+    finally:
+        data.close()
+    counts = {}
+    for name in arrays:
+        if name.endswith(".sizes"):
+            name = name[:-len(".sizes")]
+            e = arrays[name + ".e"].tolist()
+            values = arrays[name + ".values"]
+            if values.ndim == 1:
+                values = values.tolist()
+            table = []
+            start = 0
+            for size in arrays[name + ".sizes"].tolist():
+                table.append(defaultdict(float, zip(
+                    e[start:start + size], values[start:start + size])))
+                start += size
+            counts[name] = table
+        elif not name.endswith((".e", ".values")):
+            counts[name] = arrays[name]
+    return counts
+
+
+def addCounts(counts, newCounts):
+    '''
+    Add counts to others, in place.
+
+    @param counts: dict, from names to NumPy arrays or tables, see saveCounts.
+        The rows of the tables are defaultdicts.
+    @param newCounts: dict, the counts to add, with names among those of
+        counts
+    '''
+    for name, newCount in newCounts.items():
+        count = counts[name]
+        if isinstance(count, np.ndarray):
+            if count.shape != newCount.shape:
+                raise ValueError("Counts of " + name + " differ in shape: " +
+                                 str(count.shape) + ", " +
+                                 str(newCount.shape))
+            count += newCount
+            continue
+        if len(count) < len(newCount):
+            raise ValueError("Counts of " + name + " have more rows " +
+                             "than the lexikon")
+        for row, newRow in zip(count, newCount):
+            for j, value in newRow.iteritems():
+                row[j] += value
+    return
+
+
+class _ShardedDataset():
+    # The training data on the coordinator, which only knows the shards from
+    # what their workers tell about them
+    def __init__(self, shards):
+        self.shards = shards
+        self.factors = shards[0]["factors"]
+        self.lengths = {}
+        lastLengths = []
+        for shard in shards:
+            if shard["factors"] != self.factors:
+                raise ValueError("The shards have different factors")
+            self.lengths.update(dict.fromkeys(shard["lengths"], 1))
+            lastLengths += shard["lastLengths"]
+        self.lastLengths = _lastLengths(lastLengths)
+        self.size = sum([shard["sentences"] for shard in shards])
+        return
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        raise TypeError("The sentences are kept by the workers")
+
+
+class _CoordinatedModel():
+    # Mixed into a model class by Coordinator.model, makes the workers run
+    # the passes of the model over the training data instead
+
+    def _counts(self):
+        return dict([(name, getattr(self, name))
+                     for name in self.countComponents])
+
+    def extendLexikon(self, dataset, newDataset=False):
+        return self.coordinator.publishLexikon(self, dataset)
+
+    def initialiseBiwordCount(self, dataset, index=0):
+        # The word pairs of each shard are added by its worker before EStep
+        if len(self.t) < len(self.fLex[index]):
+            self.t += [defaultdict(float)
+                       for i in range(len(self.fLex[index]) - len(self.t))]
+        return
+
+    def alignTypeCount(self, dataset):
+        typeCount = {}
+        typeList = []
+        for counts in self.coordinator.runPass(self, "alignTypeCount"):
+            for typ, count in zip(counts["types"].tolist(),
+                                  counts["typeCounts"].tolist()):
+                if typ not in typeCount:
+                    typeCount[typ] = 0
+                    typeList.append(typ)
+                typeCount[typ] += count
+        return [(typ, typeCount[typ]) for typ in typeList]
+
+    def sCount(self, dataset, index=0):
+        total = None
+        for counts in self.coordinator.runPass(self, "sCount", [index]):
+            if total is None:
+                total = counts
+            else:
+                addCounts(total, counts)
+        return total["count"], total["feCount"]
+
+
+class _CoordinatedIBM1(_CoordinatedModel):
+    def EStep(self, dataset, index=0):
+        self._beginningOfIteration(index)
+        counts = self._counts()
+        for shardCounts in self.coordinator.runPass(self, "EStep", [index]):
+            addCounts(counts, shardCounts)
+        return
+
+
+class _CoordinatedHMM(_CoordinatedModel):
+    def trainIBM1(self, dataset, iterations, index=0):
+        alignerIBM1 = self.coordinator.model(_ibm1Model(self))
+        alignerIBM1.sharedLexikon(self)
+        alignerIBM1.initialiseBiwordCount(dataset, index)
+        alignerIBM1.EM(dataset, iterations, index)
+        return alignerIBM1
+
+    def targetLengths(self, dataset):
+        return dict(dataset.lengths)
+
+    def EStep(self, dataset, maxE, index=0, initialise=False):
+        self._beginningOfIteration(dataset, maxE, index)
+        if initialise:
+            for Len in dataset.lastLengths:
+                self.initialValues(Len)
+        # The workers start from the raw transition probabilities
+        self.rawA = self.a
+        counts = self._counts()
+        counts["logLikelihood"] = np.zeros(())
+        for shardCounts in self.coordinator.runPass(
+                self, "EStep", [maxE, index, initialise]):
+            addCounts(counts, shardCounts)
+        return float(counts["logLikelihood"])
+
+
+def _ibm1Model(model):
+    # The IBM model 1 an HMM model starts from, that of its base module
+    for cls in inspect.getmro(model.__class__):
+        module = sys.modules[cls.__module__]
+        if "AlignerIBM1" in vars(module):
+            return module.AlignerIBM1
+    raise TypeError("No IBM model 1 found for " + model.modelName)
+
+
+class Coordinator():
+    def __init__(self, directory, shards, pollInterval=0.1, timeout=None):
+        '''
+        @param directory: str, the directory shared with the workers, not
+            used by any training before
+        @param shards: int, the number of shards, one for each worker
+        @param pollInterval: float, the time in seconds between two looks for
+            the files of the workers
+        @param timeout: float, the time in seconds after which a worker not
+            writing the file expected is given up on. None to wait forever.
+        '''
+        self.directory = os.path.expanduser(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        if os.path.isfile(self._path("lexikon.pkl")) or\
+                os.path.isfile(self._path("stop")):
+            raise RuntimeError("The directory " + directory + " has been " +
+                               "used for training already")
+        self.shards = shards
+        self.pollInterval = pollInterval
+        self.timeout = timeout
+        self.passes = 0
+        return
+
+    def _path(self, fileName):
+        return os.path.join(self.directory, fileName)
+
+    def _checkWorkers(self):
+        for shard in range(self.shards):
+            errorFile = self._path("error.%d.txt" % shard)
+            if os.path.isfile(errorFile):
+                with open(errorFile) as inputFile:
+                    raise RuntimeError("The worker of shard %d failed:\n%s" %
+                                       (shard, inputFile.read()))
+        return
+
+    def _wait(self, fileName):
+        _wait(self._path(fileName), self.pollInterval, self.timeout,
+              self._checkWorkers)
+        return
+
+    def model(self, Model):
+        '''
+        @param Model: class, the AlignmentModel of a module in models
+        @return: a new model of the class, whose passes over the training
+            data are run by the workers. Its train method trains it on the
+            dataset given by self.dataset.
+        '''
+        if "baumWelch" in dir(Model):
+            Coordinated = _CoordinatedHMM
+        else:
+            Coordinated = _CoordinatedIBM1
+        model = type(Model)(Model.__name__, (Coordinated, Model), {
+            "__module__": Model.__module__})()
+        model.coordinator = self
+        return model
+
+    def dataset(self):
+        '''
+        Wait for every worker to describe its shard.
+
+        @return: the training data to give to the train method of the models
+            from self.model
+        '''
+        shards = []
+        for shard in range(self.shards):
+            self._wait("shard.%d.pkl" % shard)
+            shards.append(_load(self._path("shard.%d.pkl" % shard)))
+        dataset = _ShardedDataset(shards)
+        logger.info("%d shards, %d sentences" % (self.shards, len(dataset)))
+        return dataset
+
+    def publishLexikon(self, model, dataset):
+        '''
+        Create the lexikon of a model from the vocabularies of the shards,
+        and publish it to the workers. The words are added shard by shard,
+        so their ids are those of the shards put together.
+
+        @param model: the model, from self.model
+        @param dataset: the training data, from self.dataset
+        @return: the training data
+        '''
+        if model.fLex is None:
+            model.fLex, model.eLex, model.fIndex, model.eIndex = [], [], [], []
+        if model.frequencyOrder:
+            logger.warning("Words are not ordered by frequency in " +
+                           "distributed training")
+        model.compactLexikon(dataset.factors)
+        for shard in dataset.shards:
+            for index in range(dataset.factors):
+                model.fLex[index].extend(shard["fVocab"][index])
+                model.eLex[index].extend(shard["eVocab"][index])
+        _dump((model.fLex, model.eLex), self._path("lexikon.pkl"))
+        logger.info("Lexikon published, fWords size: " +
+                    str([len(lexikon) for lexikon in model.fLex]) +
+                    "; eWords size: " +
+                    str([len(lexikon) for lexikon in model.eLex]))
+        return dataset
+
+    def runPass(self, model, task, arguments=()):
+        '''
+        Have every worker go through its shard with the parameters of a
+        model.
+
+        @param model: the model, from self.model
+        @param task: str, what the workers do, see Worker
+        @param arguments: list, the arguments of the task
+        @return: generator of dicts, the counts of each shard in order, see
+            loadCounts
+        '''
+        number = self.passes
+        self.passes += 1
+        parametersFile = self._path("parameters.%d.pkl" % number)
+        passFile = self._path("pass.%d.json" % number)
+        _dump(_parameters(model), parametersFile)
+        request = {"task": task,
+                   "model": model.__class__.__module__,
+                   "arguments": list(arguments)}
+        _writeFile(passFile, lambda output: json.dump(request, output))
+        logger.info("Pass %d: %s %s" % (number, task, list(arguments)))
+        for shard in range(self.shards):
+            countsFile = "counts.%d.%d.npz" % (number, shard)
+            self._wait(countsFile)
+            counts = loadCounts(self._path(countsFile))
+            os.remove(self._path(countsFile))
+            yield counts
+        os.remove(parametersFile)
+        os.remove(passFile)
+        return
+
+    def stop(self):
+        '''
+        Tell the workers training is over.
+        '''
+        _writeFile(self._path("stop"), lambda output: None)
+        return
+
+    def train(self, model, iterations=5):
+        '''
+        Train a model on the shards of the workers, and stop them.
+
+        @param model: the model, from self.model
+        @param iterations: int, the number of iterations
+        @return: the trained model
+        '''
+        try:
+            model.train(self.dataset(), iterations)
+        finally:
+            self.stop()
+        return model
+
+
+class Worker():
+    def __init__(self, directory, shard, dataset, pollInterval=0.1,
+                 timeout=None):
+        '''
+        @param directory: str, the directory shared with the coordinator
+        @param shard: int, the shard of the worker, counting from 0. The
+            shards are put together in this order.
+        @param dataset: Dataset, or any iterable of sentences, the shard. It
+            is only gone through once.
+        @param pollInterval: float, the time in seconds between two looks for
+            the files of the coordinator
+        @param timeout: float, the time in seconds after which the coordinator
+            not writing the file expected is given up on. None to wait
+            forever.
+        '''
+        self.directory = os.path.expanduser(directory)
+        self.shard = shard
+        self.dataset = dataset
+        self.pollInterval = pollInterval
+        self.timeout = timeout
+        return
+
+    def _path(self, fileName):
+        return os.path.join(self.directory, fileName)
+
+    def _checkCoordinator(self):
+        if os.path.isfile(self._path("stop")):
+            raise _TrainingOver()
+        return
+
+    def _wait(self, fileName):
+        _wait(self._path(fileName), self.pollInterval, self.timeout,
+              self._checkCoordinator)
+        return
+
+    def run(self):
+        '''
+        Describe the shard to the coordinator, then run the passes over it
+        the coordinator asks for until training is over. An error stopping
+        the worker is written to the directory for the coordinator too.
+        '''
+        try:
+            self._run()
+        except _TrainingOver:
+            logger.info("Training over")
+        except Exception:
+            _writeFile(self._path("error.%d.txt" % self.shard),
+                       lambda output: output.write(traceback.format_exc()))
+            raise
+        return
+
+    def _run(self):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Created by another worker meanwhile
+                pass
+        try:
+            factors, dataset = datasetFactors(self.dataset)
+        except (StopIteration, IndexError):
+            raise ValueError("Shard %d has no sentences" % self.shard)
+        corpus = internDataset(dataset, factors)
+        lengths = np.diff(corpus.eOffsets).tolist()
+        _dump({"factors": factors,
+               "sentences": len(corpus),
+               "fVocab": corpus.fVocab,
+               "eVocab": corpus.eVocab,
+               "lengths": sorted(set(lengths)),
+               "lastLengths": _lastLengths(lengths)},
+              self._path("shard.%d.pkl" % self.shard))
+        logger.info("Shard %d: %d sentences" % (self.shard, len(corpus)))
+
+        self._wait("lexikon.pkl")
+        fLex, eLex = _load(self._path("lexikon.pkl"))
+        corpus = corpus.lexicalise(
+            [lexikon.lookup for lexikon in fLex[:factors]],
+            [lexikon.lookup for lexikon in eLex[:factors]],
+            dtype=np.int32)
+
+        number = 0
+        while True:
+            self._wait("pass.%d.json" % number)
+            with open(self._path("pass.%d.json" % number)) as inputFile:
+                request = json.load(inputFile)
+            Model = importlib.import_module(request["model"]).AlignmentModel
+            model = Model()
+            model.fLex, model.eLex = fLex, eLex
+            model.fIndex = [lexikon.index for lexikon in fLex]
+            model.eIndex = [lexikon.index for lexikon in eLex]
+            for name, value in _load(self._path(
+                    "parameters.%d.pkl" % number)).items():
+                setattr(model, name, value)
+            task = getattr(self, "_" + request["task"])
+            saveCounts(task(model, corpus, *request["arguments"]),
+                       self._path("counts.%d.%d.npz" % (number, self.shard)))
+            number += 1
+
+    def _alignTypeCount(self, model, corpus):
+        typeCounts = model.alignTypeCount(corpus)
+        return {"types": np.array([typ for typ, count in typeCounts],
+                                  dtype=str),
+                "typeCounts": np.array([count for typ, count in typeCounts],
+                                       dtype=np.int64)}
+
+    def _sCount(self, model, corpus, index):
+        count, feCount = model.sCount(corpus, index)
+        return {"count": count, "feCount": feCount}
+
+    def _EStep(self, model, corpus, *arguments):
+        logLikelihood = None
+        if "baumWelch" in dir(model):
+            maxE, index, initialise = arguments
+            model.datasetLengths = model.targetLengths(corpus)
+            model.extendParameter(maxE)
+            logLikelihood = model.EStep(corpus, maxE, index, initialise)
+        else:
+            index, = arguments
+            model.initialiseBiwordCount(corpus, index)
+            model.EStep(corpus, index)
+        counts = dict([(name, getattr(model, name))
+                       for name in model.countComponents])
+        if logLikelihood is not None:
+            counts["logLikelihood"] = np.array(logLikelihood)
+        return counts
+
+
+def _runWorker(directory, shard, dataset, pollInterval):
+    if callable(dataset):
+        dataset = dataset()
+    Worker(directory, shard, dataset, pollInterval).run()
+    return
+
+
+def trainLocally(Model, shards, iterations=5, directory=None,
+                 pollInterval=0.05):
+    '''
+    Train a model as distributed training does, each shard going to a worker
+    process of this machine.
+
+    @param Model: class, the AlignmentModel of a module in models
+    @param shards: list of Datasets, or of functions returning them, the
+        shards in order
+    @param iterations: int, the number of iterations
+    @param directory: str, the directory the files are exchanged in. A
+        temporary one, removed afterwards, if None.
+    @param pollInterval: float, see Coordinator and Worker
+    @return: the trained model
+    '''
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix="distributed")
+    try:
+        coordinator = Coordinator(directory, len(shards), pollInterval)
+        workers = [multiprocessing.Process(
+            target=_runWorker, args=(directory, shard, dataset, pollInterval))
+            for shard, dataset in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+        try:
+            model = coordinator.train(coordinator.model(Model), iterations)
+        finally:
+            for worker in workers:
+                worker.join()
+    finally:
+        if temporary:
+            shutil.rmtree(directory)
+    return model
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.dataset = loadDataset(["support/ut_align_no_tag.cn"],
+                                   ["support/ut_align_no_tag.en"],
+                                   linesToLoad=90)
+        self.shards = [self.dataset[:30], self.dataset[30:60],
+                       self.dataset[60:]]
+        self.countsFile = "support/ut_counts.npz"
+        return
+
+    def tearDown(self):
+        if os.path.isfile(self.countsFile):
+            os.remove(self.countsFile)
+        return
+
+    def testCounts(self):
+        counts = {"c": [defaultdict(float, {1: 0.5, 3: 2.0}),
+                        defaultdict(float)],
+                  "c_feh": [defaultdict(float, {2: np.array([1.0, 2.0])})],
+                  "total": np.arange(4.0)}
+        saveCounts(counts, self.countsFile)
+        loaded = loadCounts(self.countsFile)
+        self.assertEqual(loaded["c"], counts["c"])
+        self.assertEqual(loaded["c_feh"][0].keys(), [2])
+        self.assertTrue(np.array_equal(loaded["c_feh"][0][2], [1.0, 2.0]))
+        self.assertTrue(np.array_equal(loaded["total"], counts["total"]))
+
+        addCounts(loaded, {"c": [{3: 1.0}, {0: 1.5}],
+                           "c_feh": [{2: np.ones(2), 4: np.ones(2)}],
+                           "total": np.ones(4)})
+        self.assertEqual(loaded["c"], [{1: 0.5, 3: 3.0}, {0: 1.5}])
+        self.assertTrue(np.array_equal(loaded["c_feh"][0][2], [2.0, 3.0]))
+        self.assertTrue(np.array_equal(loaded["c_feh"][0][4], [1.0, 1.0]))
+        self.assertTrue(np.array_equal(loaded["total"], np.arange(1.0, 5.0)))
+        self.assertRaises(ValueError, addCounts, loaded,
+                          {"total": np.ones(3)})
+        return
+
+    def testLastLengths(self):
+        lengths = [3, 5, 2, 4, 4, 1, 2]
+        a = np.zeros((6, 5, 5))
+        for Len in lengths:
+            a[:Len + 1, :Len, :Len] = 1.0 / Len
+        b = np.zeros((6, 5, 5))
+        for Len in _lastLengths(lengths):
+            b[:Len + 1, :Len, :Len] = 1.0 / Len
+        self.assertEqual(_lastLengths(lengths), [5, 4, 2])
+        self.assertTrue(np.array_equal(a, b))
+        return
+
+    def testIBM1(self):
+        from models.IBM1 import AlignmentModel
+        model = AlignmentModel()
+        model.train(self.dataset, 2)
+        # With one shard, the counts are added up in the same order
+        distributed = trainLocally(AlignmentModel, [self.dataset], 2)
+        self.assertEqual(list(distributed.fLex[0]), list(model.fLex[0]))
+        self.assertEqual(distributed.t, model.t)
+
+        distributed = trainLocally(AlignmentModel, self.shards, 2)
+        self.assertEqual(list(distributed.eLex[0]), list(model.eLex[0]))
+        for row, distributedRow in zip(model.t, distributed.t):
+            self.assertEqual(sorted(row), sorted(distributedRow))
+            for e in row:
+                self.assertAlmostEqual(row[e], distributedRow[e])
+        return
+
+    def testHMM(self):
+        from models.HMM import AlignmentModel
+        model = AlignmentModel()
+        model.train(self.dataset, 2)
+        distributed = trainLocally(AlignmentModel, self.shards, 2)
+        self.assertEqual(distributed.eLengthSet, model.eLengthSet)
+        self.assertTrue(np.allclose(distributed.rawA, model.rawA))
+        self.assertTrue(np.allclose(distributed.pi, model.pi))
+        for row, distributedRow in zip(model.t, distributed.t):
+            self.assertEqual(sorted(row), sorted(distributedRow))
+            for e in row:
+                self.assertAlmostEqual(row[e], distributedRow[e])
+        self.assertSequenceEqual(distributed.decode(self.dataset),
+                                 model.decode(self.dataset))
+        return
+
+    def testWorkerError(self):
+        from models.HMM import AlignmentModel
+        self.assertRaises(RuntimeError, trainLocally, AlignmentModel,
+                          [self.dataset, []], 1)
+        return
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description="""SFU HMM Aligner distributed training %s""" %
+        __version__)
+    ap.add_argument(
+        "role", choices=["coordinator", "worker", "local"],
+        help="coordinator trains the model, with a worker for each shard " +
+             "on the other machines; local starts the workers too, as " +
+             "processes of this machine")
+    ap.add_argument(
+        "--dir", dest="directory",
+        help="Directory shared by the coordinator and the workers, used " +
+             "for one training only. A temporary one for local")
+    ap.add_argument(
+        "--shards", dest="shards", type=int, default=1,
+        help="Number of shards, for coordinator and local, default 1")
+    ap.add_argument(
+        "--shard", dest="shard", default="",
+        help="Shard of the worker, written as K/N with K counting from 0")
+    ap.add_argument(
+        "--split", dest="split", action='store_true',
+        help="Make the worker only read shard K of N of the training " +
+             "data, rather than all of it")
+    ap.add_argument(
+        "-m", "--model", dest="model", default="IBM1",
+        help="model to use, default is IBM1")
+    ap.add_argument(
+        "-i", "--iterations", dest="iterations", type=int, default=5,
+        help="Number of iterations to train, default 5")
+    ap.add_argument(
+        "-s", "--saveModel", dest="saveModel", default="",
+        help="Where to save the model trained")
+    ap.add_argument(
+        "-d", "--datadir", dest="dataDir", default="",
+        help="data directory")
+    ap.add_argument(
+        "--train", dest="trainData", default="",
+        help="prefix of training data file")
+    ap.add_argument(
+        "--train-tag", dest="trainDataTag", default="",
+        help="prefix of training tag file")
+    ap.add_argument(
+        "--source", dest="sourceLanguage", default="",
+        help="suffix of source language")
+    ap.add_argument(
+        "--target", dest="targetLanguage", default="",
+        help="suffix of target language")
+    ap.add_argument(
+        "-a", "--alignment", dest="trainAlignment", default="",
+        help="suffix of alignment file")
+    ap.add_argument(
+        "-n", "--trainSize", dest="trainSize", type=int, default=sys.maxint,
+        help="Number of sentences to use for training")
+    ap.add_argument(
+        "--poll-interval", dest="pollInterval", type=float, default=0.1,
+        help="Seconds between two looks for the files of the other " +
+             "machines, default 0.1")
+    ap.add_argument(
+        "--timeout", dest="timeout", type=float, default=None,
+        help="Seconds after which the other machines are given up on, " +
+             "default never")
+    args = ap.parse_args()
+
+    init_logger('distributed.log')
+    if args.role != "local" and args.directory is None:
+        ap.error("--dir is required for " + args.role)
+    if args.role == "worker" and args.shard == "":
+        ap.error("--shard is required for worker")
+    if args.role != "coordinator" and args.trainData == "":
+        ap.error("--train is required for " + args.role)
+
+    def trainFiles():
+        prefixes = [args.trainData]
+        if args.trainDataTag != "":
+            prefixes.append(args.trainDataTag)
+        sourceFiles, targetFiles = [], []
+        for prefix in prefixes:
+            prefix = os.path.join(args.dataDir, prefix)
+            sourceFiles.append(findFile("%s.%s" % (prefix,
+                                                   args.sourceLanguage)))
+            targetFiles.append(findFile("%s.%s" % (prefix,
+                                                   args.targetLanguage)))
+        alignmentFile = ""
+        if args.trainAlignment != "":
+            alignmentFile = findFile("%s.%s" % (
+                os.path.join(args.dataDir, args.trainData),
+                args.trainAlignment))
+        return sourceFiles, targetFiles, alignmentFile
+
+    def shardLoader(shard, shards):
+        # The sentences of a shard of the training data, read lazily
+        sourceFiles, targetFiles, alignmentFile = trainFiles()
+        start, end = shardRange(min(countLines(sourceFiles[0]),
+                                    args.trainSize), shard, shards)
+        logger.info("Using sentences [%d, %d) of %s" %
+                    (start, end, sourceFiles[0]))
+        return partial(iterDatasetRange, sourceFiles, targetFiles,
+                       alignmentFile, start=start, end=end)
+
+    if args.role == "worker":
+        shard, shards = [int(k) for k in args.shard.split('/')]
+        if args.split:
+            loader = shardLoader(shard, shards)
+        else:
+            loader = shardLoader(0, 1)
+        Worker(args.directory, shard, loader(), args.pollInterval,
+               args.timeout).run()
+        sys.exit(0)
+
+    Model = importlib.import_module("models." + args.model).AlignmentModel
+    if not checkAlignmentModel(Model):
+        raise TypeError("Invalid Model class")
+    if args.role == "coordinator":
+        coordinator = Coordinator(args.directory, args.shards,
+                                  args.pollInterval, args.timeout)
+        model = coordinator.train(coordinator.model(Model), args.iterations)
+    else:
+        model = trainLocally(
+            Model, [shardLoader(shard, args.shards)
+                    for shard in range(args.shards)],
+            args.iterations, args.directory, args.pollInterval)
+    model.saveModel(args.saveModel)
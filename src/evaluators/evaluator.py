@@ -2,6 +2,7 @@ import os
 import sys
 import inspect
 import optparse
+from itertools import izip
 currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
@@ -15,6 +16,16 @@ __version__ = "0.4a"
 
 
 def evaluate(result, reference, showFigure=0):
+    '''
+    Score the result against the reference. Both are read once, sentence by
+    sentence, so they can be generators, such as the sentences decoded by
+    AlignmentModelBase.iterDecode, and are never held in memory as a whole.
+
+    @param result: iterable of SentenceAlignments
+    @param reference: iterable of GoldAlignments, such as a CompactAlignment
+    @param showFigure: int, plot the reference of this many sentences
+    @return: dict, the Precision, Recall, AER and F-score
+    '''
     if showFigure > 0:
         from models.plot import addAlignmentToFigure
     totalAlign = 0
@@ -23,19 +34,20 @@ def evaluate(result, reference, showFigure=0):
     totalCertainAlignment = 0
     totalProbableAlignment = 0
 
-    for i in range(min(len(result), len(reference))):
+    for i, (sentenceAlignment, goldAlignment) in\
+            enumerate(izip(result, reference)):
         testAlign = []
-        for entry in result[i]:
+        for entry in sentenceAlignment:
             f = int(entry[0])
             e = int(entry[1])
             testAlign.append((f, e))
 
         certainAlign = []
-        for entry in reference[i]["certain"]:
+        for entry in goldAlignment["certain"]:
             certainAlign.append((entry[0], entry[1]))
 
         probableAlign = []
-        for entry in reference[i]["probable"]:
+        for entry in goldAlignment["probable"]:
             probableAlign.append((entry[0], entry[1]))
         if i < showFigure:
             addAlignmentToFigure(certainAlign, i, colour='#FFA500')
@@ -77,6 +77,17 @@ class TestEvaluators(unittest.TestCase):
         self.assertEqual(evaluate(cleanAll, original), correctAnswer)
         return
 
+    def testEvaluatorLazy(self):
+        noProb = loadAlignment("../support/ut_align_no_prob.a")
+        noType = loadAlignment("../support/ut_align_no_type.a")
+        certainAlign = [sentence["certain"] for sentence in noProb]
+        from evaluator import evaluate
+        self.assertEqual(
+            evaluate((sentence for sentence in certainAlign),
+                     iter(noType)),
+            evaluate(certainAlign, noType))
+        return
+
 
 if __name__ == '__main__':
     print "Launching unit test on: evaluators"
@@ -2,6 +2,7 @@ import os
 import sys
 import inspect
 import optparse
+from itertools import izip
 currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
@@ -15,6 +16,16 @@ __version__ = "0.4a"
 
 
 def evaluate(result, reference, showFigure=0):
+    '''
+    Score the result against the reference. Both are read once, sentence by
+    sentence, so they can be generators, such as the sentences decoded by
+    AlignmentModelBase.iterDecode, and are never held in memory as a whole.
+
+    @param result: iterable of SentenceAlignments
+    @param reference: iterable of GoldAlignments, such as a CompactAlignment
+    @param showFigure: int, plot the reference of this many sentences
+    @return: dict, the Precision, Recall, AER and F-score
+    '''
     if showFigure > 0:
         from models.plot import addAlignmentToFigure
     totalAlign = 0
@@ -23,9 +34,10 @@ def evaluate(result, reference, showFigure=0):
     totalCertainAlignment = 0
     totalProbableAlignment = 0
 
-    for i in range(min(len(result), len(reference))):
+    for i, (sentenceAlignment, goldAlignment) in\
+            enumerate(izip(result, reference)):
         testAlign = []
-        for entry in result[i]:
+        for entry in sentenceAlignment:
             if (len(entry)) < 3:
                 logger.warning("Result missing element." +
                                " Expectation:(f, e, tag)")
@@ -36,14 +48,14 @@ def evaluate(result, reference, showFigure=0):
             testAlign.append((f, e, tag))
 
         certainAlign = []
-        for entry in reference[i]["certain"]:
+        for entry in goldAlignment["certain"]:
             if (len(entry)) < 3:
                 logger.warning("reference missing element.")
                 entry = entry + ("",)
             certainAlign.append((entry[0], entry[1], entry[2]))
 
         probableAlign = []
-        for entry in reference[i]["probable"]:
+        for entry in goldAlignment["probable"]:
             if (len(entry)) < 3:
                 logger.warning("reference missing element.")
                 entry = entry + ("",)
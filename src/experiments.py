@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+
+#
+# Experiment runner of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the programme that trains and evaluates several models on the same
+# data in one run. The data are given in a config file like the one read by
+# aligner.py (see sample_config_file.ini), with one more section for each
+# experiment:
+#
+#     [Experiment hmm]
+#     Model = HMM
+#     Iterations = 5
+#     SaveModel = hmm.pklz
+#     Output = hmm.wa
+#
+# The training and test data are read and lexicalised only once, and all of
+# the models share the same lexikon. The IBM model 1 that each HMM starts
+# from is trained once for each factor and number of iterations, and the
+# IBM1 experiments with the same number of iterations use it as their model.
+# The experiments can be run by a pool of processes, forked once the data are
+# lexicalised and the IBM models trained, so they inherit all of them. The
+# scores of every experiment are written to one file, as JSON.
+#
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import multiprocessing
+import unittest
+from itertools import chain
+from ConfigParser import SafeConfigParser
+from loggers import logging, init_logger
+from models.modelChecker import checkAlignmentModel
+from corpus import Corpus, datasetFactors, internDataset
+from fileIO import iterDataset, loadCachedCorpus, loadAlignment, findFile,\
+    AlignmentWriter, loadDataset
+__version__ = "0.1a"
+logger = logging.getLogger('EXPERIMENTS')
+
+# The runner whose experiments are run by the worker processes, set before
+# they are forked
+_runner = None
+
+
+def _runExperiment(k):
+    return _runner.runExperiment(_runner.experiments[k])
+
+
+def readConfig(fileName):
+    '''
+    Read the data and the experiments from a config file.
+
+    @param fileName: str, the config file
+    @return: (dict, list of dict), the data, with the keys of the config of
+        aligner.py, and the experiments, each with a name, a model, a number
+        of iterations, and the files to save the model and the alignment to
+    '''
+    cp = SafeConfigParser()
+    if not cp.read(fileName):
+        raise IOError("Unable to read config file: " + fileName)
+    data = {}
+    for section, keys in (
+            ('General', (('DataDirectory', 'dataDir'),
+                         ('SourceLanguageSuffix', 'sourceLanguage'),
+                         ('TargetLanguageSuffix', 'targetLanguage'))),
+            ('TrainData', (('TextFilePrefix', 'trainData'),
+                           ('TagFilePrefix', 'trainDataTag'),
+                           ('AlignmentFileSuffix', 'trainAlignment'))),
+            ('TestData', (('TextFilePrefix', 'testData'),
+                          ('TagFilePrefix', 'testDataTag'),
+                          ('Reference', 'reference')))):
+        for key, name in keys:
+            if cp.has_option(section, key):
+                data[name] = cp.get(section, key)
+            else:
+                data[name] = ''
+
+    experiments = []
+    for section in cp.sections():
+        if not section.startswith("Experiment "):
+            continue
+        experiment = {"name": section[len("Experiment "):].strip(),
+                      "model": cp.get(section, "Model"),
+                      "iterations": 5,
+                      "saveModel": "",
+                      "output": ""}
+        if cp.has_option(section, "Iterations"):
+            experiment["iterations"] = cp.getint(section, "Iterations")
+        if cp.has_option(section, "SaveModel"):
+            experiment["saveModel"] = cp.get(section, "SaveModel")
+        if cp.has_option(section, "Output"):
+            experiment["output"] = cp.get(section, "Output")
+        experiments.append(experiment)
+    if not experiments:
+        raise ValueError("No experiment in config file: " + fileName)
+    return data, experiments
+
+
+def dataFiles(data, name):
+    '''
+    @param data: dict, the data, see readConfig
+    @param name: str, "train" or "test"
+    @return: (list of str, list of str), the source and target language
+        files of the FORMs and, if there are any, of the POS tags
+    '''
+    sourceFiles, targetFiles = [], []
+    for prefix in (data[name + 'Data'], data[name + 'DataTag']):
+        if prefix == '':
+            continue
+        prefix = os.path.join(data['dataDir'], prefix)
+        sourceFiles.append(findFile(os.path.expanduser(
+            "%s.%s" % (prefix, data['sourceLanguage']))))
+        targetFiles.append(findFile(os.path.expanduser(
+            "%s.%s" % (prefix, data['targetLanguage']))))
+    return sourceFiles, targetFiles
+
+
+class ExperimentRunner():
+    def __init__(self, data, experiments, trainSize=sys.maxint,
+                 testSize=sys.maxint, corpusCache=True, ibm1CacheDir=""):
+        '''
+        Loads the models of the experiments, and reads and lexicalises the
+        data.
+
+        @param data: dict, the data, see readConfig
+        @param experiments: list of dict, the experiments, see readConfig
+        @param trainSize: int, the number of training sentences to use
+        @param testSize: int, the number of test sentences to use
+        @param corpusCache: bool, read the data through the corpus cache, see
+            fileIO.loadCachedCorpus
+        @param ibm1CacheDir: str, the directory keeping the IBM models 1 the
+            HMMs start from between runs, see HMMBase.trainIBM1
+        '''
+        self.experiments = experiments
+        self.ibm1CacheDir = ibm1CacheDir
+        self.Models = {}
+        for experiment in experiments:
+            if experiment["model"] in self.Models:
+                continue
+            Model = importlib.import_module(
+                "models." + experiment["model"]).AlignmentModel
+            if not checkAlignmentModel(Model):
+                raise TypeError("Invalid Model class: " + experiment["model"])
+            self.Models[experiment["model"]] = Model
+
+        # The model holding the lexikon all of the others share
+        self.lexikon = self.Models[experiments[0]["model"]]()
+        self.ibm1Models = {}
+
+        if corpusCache:
+            loadData = loadCachedCorpus
+        else:
+            loadData = iterDataset
+        sourceFiles, targetFiles = dataFiles(data, 'train')
+        alignmentFile = ''
+        if data['trainAlignment'] != '':
+            alignmentFile = findFile(os.path.expanduser("%s.%s" % (
+                os.path.join(data['dataDir'], data['trainData']),
+                data['trainAlignment'])))
+        logger.info("Loading training data")
+        self.trainDataset = self.lexikon.initialiseLexikon(
+            self._corpus(loadData(sourceFiles, targetFiles, alignmentFile,
+                                  linesToLoad=trainSize)))
+
+        self.testDataset = None
+        self.reference = None
+        if data['testData'] != '':
+            sourceFiles, targetFiles = dataFiles(data, 'test')
+            logger.info("Loading test data")
+            self.testDataset = self.lexikon.lexiDataset(
+                self._corpus(loadData(sourceFiles, targetFiles,
+                                      linesToLoad=testSize)))
+            if data['reference'] != '':
+                self.reference = loadAlignment(findFile(data['reference']))
+        return
+
+    def _corpus(self, dataset):
+        if not isinstance(dataset, Corpus):
+            factors, dataset = datasetFactors(dataset)
+            dataset = internDataset(dataset, factors)
+        return dataset
+
+    def _newModel(self, experiment):
+        model = self.Models[experiment["model"]]()
+        model.sharedLexikon(self.lexikon)
+        if "ibm1Models" in vars(model):
+            model.ibm1Models = self.ibm1Models
+            model.ibm1CacheDir = self.ibm1CacheDir
+        return model
+
+    def trainIBM1(self):
+        '''
+        Train the IBM models 1 that the HMM experiments start from, once for
+        each factor and number of iterations.
+        '''
+        for experiment in self.experiments:
+            model = self._newModel(experiment)
+            if "ibm1Models" not in vars(model):
+                continue
+            for index in model.ibm1Indices:
+                model.trainIBM1(self.trainDataset, experiment["iterations"],
+                                index)
+        return
+
+    def runExperiment(self, experiment):
+        '''
+        Train, save and evaluate the model of an experiment.
+
+        @param experiment: dict, the experiment, see readConfig
+        @return: dict, the experiment, with the training and decoding times
+            and the scores given by the evaluator of the model
+        '''
+        logger.info("Running experiment " + experiment["name"])
+        result = dict(experiment)
+        startTime = time.time()
+        Model = self.Models[experiment["model"]]
+        key = (Model, 0, experiment["iterations"])
+        if key in self.ibm1Models:
+            # The very IBM model 1 an HMM started from
+            model = self.ibm1Models[key]
+            logger.info("Using the IBM model 1 trained before")
+        else:
+            model = self._newModel(experiment)
+            model.train(self.trainDataset, experiment["iterations"])
+        result["trainingTime"] = time.time() - startTime
+        if experiment["saveModel"] != "":
+            model.saveModel(experiment["saveModel"])
+
+        result["scores"] = None
+        startTime = time.time()
+        evaluate = model.evaluate if self.reference is not None else None
+        if self.testDataset is not None and experiment["output"] != "":
+            with AlignmentWriter(experiment["output"]) as writer:
+                decoded = writer.passThrough(
+                    model.iterDecode(self.testDataset))
+                if evaluate:
+                    result["scores"] = evaluate(decoded, self.reference)
+                for sentenceAlignment in decoded:
+                    pass
+        elif self.testDataset is not None and evaluate:
+            result["scores"] = evaluate(
+                chain.from_iterable(model.iterDecode(self.testDataset)),
+                self.reference)
+        result["decodingTime"] = time.time() - startTime
+        return result
+
+    def run(self, workers=1):
+        '''
+        Run every experiment.
+
+        @param workers: int, the number of experiments run at the same time,
+            each in a process of its own
+        @return: list of dict, the result of each experiment, see
+            runExperiment
+        '''
+        global _runner
+        self.trainIBM1()
+        if workers <= 1:
+            return [self.runExperiment(experiment)
+                    for experiment in self.experiments]
+        _runner = self
+        pool = multiprocessing.Pool(min(workers, len(self.experiments)))
+        try:
+            return pool.map(_runExperiment, range(len(self.experiments)))
+        finally:
+            pool.close()
+            pool.join()
+            _runner = None
+
+
+class TestExperiments(unittest.TestCase):
+    def setUp(self):
+        self.configFile = "support/ut_experiments.ini"
+        self.outputFiles = ["support/ut_experiments_%d.wa" % k
+                            for k in range(3)]
+        with open(self.configFile, "w") as configFile:
+            configFile.write("""[General]
+DataDirectory = support
+SourceLanguageSuffix = cn
+TargetLanguageSuffix = en
+
+[TrainData]
+TextFilePrefix = ut_align_no_tag
+
+[TestData]
+TextFilePrefix = ut_align_no_tag
+Reference = support/ut_align_no_type.a
+
+[Experiment ibm1]
+Model = IBM1
+Iterations = 2
+Output = %s
+
+[Experiment hmm]
+Model = HMM
+Iterations = 2
+Output = %s
+
+[Experiment hmm1]
+Model = HMM
+Iterations = 1
+Output = %s
+""" % tuple(self.outputFiles))
+        return
+
+    def tearDown(self):
+        for fileName in [self.configFile] + self.outputFiles:
+            if os.path.isfile(fileName):
+                os.remove(fileName)
+        return
+
+    def testReadConfig(self):
+        data, experiments = readConfig(self.configFile)
+        self.assertEqual(data["trainData"], "ut_align_no_tag")
+        self.assertEqual(data["trainDataTag"], "")
+        self.assertEqual([(experiment["name"], experiment["iterations"])
+                          for experiment in experiments],
+                         [("ibm1", 2), ("hmm", 2), ("hmm1", 1)])
+        return
+
+    def testRun(self):
+        data, experiments = readConfig(self.configFile)
+        runner = ExperimentRunner(data, experiments, corpusCache=False)
+        results = runner.run(workers=2)
+        self.assertEqual(len(runner.ibm1Models), 2)
+        self.assertEqual([result["name"] for result in results],
+                         ["ibm1", "hmm", "hmm1"])
+        dataset = loadDataset(["support/ut_align_no_tag.cn"],
+                              ["support/ut_align_no_tag.en"])
+        from models.HMM import AlignmentModel
+        for result, outputFile, iterations in zip(
+                results[1:], self.outputFiles[1:], (2, 1)):
+            # The same as when the HMM is trained on its own
+            model = AlignmentModel()
+            model.train(dataset, iterations)
+            expected = model.decode(dataset)
+            self.assertSequenceEqual(
+                [sentence["certain"]
+                 for sentence in loadAlignment(outputFile)], expected)
+            self.assertEqual(result["scores"],
+                             model.evaluate(expected, runner.reference))
+        return
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description="""SFU HMM Aligner experiment runner %s""" % __version__)
+    ap.add_argument(
+        "-c", "--config", dest="config", required=True,
+        help="Config file with the data and the experiments")
+    ap.add_argument(
+        "-n", "--trainSize", dest="trainSize", type=int, default=sys.maxint,
+        help="Number of sentences to use for training")
+    ap.add_argument(
+        "-v", "--testSize", dest="testSize", type=int, default=sys.maxint,
+        help="Number of sentences to use for testing")
+    ap.add_argument(
+        "-w", "--workers", dest="workers", type=int, default=1,
+        help="Number of experiments run at the same time, default 1")
+    ap.add_argument(
+        "-r", "--results", dest="results", default="experiments.json",
+        help="File to write the results of the experiments to, default " +
+             "experiments.json")
+    ap.add_argument(
+        "--ibm1-cache", dest="ibm1Cache", default="",
+        help="Directory keeping the IBM models 1 the HMMs start from, to " +
+             "reuse them in later runs")
+    ap.add_argument(
+        "--no-corpus-cache", dest="noCorpusCache", action='store_true',
+        help="Read the data files directly instead of through the corpus " +
+             "cache")
+    args = ap.parse_args()
+
+    init_logger('experiments.log')
+    data, experiments = readConfig(args.config)
+    runner = ExperimentRunner(data, experiments, args.trainSize,
+                              args.testSize, not args.noCorpusCache,
+                              args.ibm1Cache)
+    results = runner.run(args.workers)
+    with open(args.results, "w") as resultsFile:
+        json.dump(results, resultsFile, indent=4, sort_keys=True)
+    for result in results:
+        if result["scores"] is not None:
+            logger.info(result["name"] + ": " + ", ".join(
+                ["%s = %s" % item
+                 for item in sorted(result["scores"].items())]))
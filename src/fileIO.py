@@ -11,10 +11,150 @@
 # function to read gold alignment files.
 #
 import os
+import re
 import sys
+import bz2
+import time
+import gzip
 import inspect
+import hashlib
 import unittest
+import Queue
+import threading
+import subprocess
+import multiprocessing
+from array import array
+from itertools import izip, islice
+import numpy as np
+from distutils.spawn import find_executable
+from loggers import logging
+from corpus import internDataset, saveCorpus, loadCorpus, mergeCorpora
+try:
+    from backports import lzma
+except ImportError:
+    lzma = None
 __version__ = "0.4a"
+logger = logging.getLogger('FILEIO')
+
+# Number of threads used to compress and decompress files. With more than one
+# thread, the external multithreaded tools below are used when installed.
+compressionThreads = 1
+
+# Multithreaded tools for each compression format, with their thread options
+_compressionTools = {
+    ".gz": [("pigz", ["-p", "%d"])],
+    ".bz2": [("lbzip2", ["-n", "%d"]), ("pbzip2", ["-p%d"])],
+    ".xz": [("xz", ["-T", "%d"])]
+}
+
+
+class _ProcessFile():
+    # A file compressed or decompressed by an external programme
+    def __init__(self, command, fileName, mode):
+        self.reading = "r" in mode
+        if self.reading:
+            self.process = subprocess.Popen(command + ["-dc", fileName],
+                                            stdout=subprocess.PIPE)
+            self.file = self.process.stdout
+        else:
+            output = open(fileName, "wb")
+            self.process = subprocess.Popen(command + ["-c"],
+                                            stdin=subprocess.PIPE,
+                                            stdout=output)
+            output.close()
+            self.file = self.process.stdin
+        return
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readline(self):
+        return self.file.readline()
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        return self.file.writelines(lines)
+
+    def close(self):
+        self.file.close()
+        # A reader stopped early terminates the programme with SIGPIPE
+        if self.process.wait() != 0 and not self.reading:
+            raise IOError("Compression of file failed")
+        return
+
+
+def isCompressed(fileName):
+    '''
+    @param fileName: str, a file name
+    @return: bool, whether the file is compressed, judging by its extension
+    '''
+    return os.path.splitext(fileName)[1] in _compressionTools
+
+
+def findFile(fileName):
+    '''
+    @param fileName: str, a file name
+    @return: str, the file name, or that of a compressed version of the file
+        (with .gz, .bz2 or .xz appended) if only that one exists.
+    '''
+    fileName = os.path.expanduser(fileName)
+    if not os.path.exists(fileName):
+        for extension in sorted(_compressionTools):
+            if os.path.exists(fileName + extension):
+                return fileName + extension
+    return fileName
+
+
+def openFile(fileName, mode="r"):
+    '''
+    This function opens a file, compressing or decompressing it on the fly
+    when its name ends with .gz, .bz2 or .xz. When compressionThreads is more
+    than 1 and pigz, lbzip2/pbzip2 or xz are installed, they do the work in
+    a separate process with that many threads. Otherwise the gzip and bz2
+    modules are used, and the lzma module from backports.lzma (or the xz
+    programme) for .xz files.
+
+    @param fileName: str, the file to open
+    @param mode: str, "r" to read or "w" to write
+    @return: file object
+    '''
+    fileName = os.path.expanduser(fileName)
+    extension = os.path.splitext(fileName)[1]
+    if extension not in _compressionTools:
+        return open(fileName, mode)
+    mode = mode.replace("b", "") + "b"
+
+    tools = [(tool, options) for tool, options in
+             _compressionTools[extension] if find_executable(tool)]
+    if compressionThreads > 1 and tools:
+        tool, options = tools[0]
+        return _ProcessFile(
+            [tool] + [option.replace("%d", str(compressionThreads))
+                      for option in options], fileName, mode)
+    if extension == ".gz":
+        return gzip.open(fileName, mode)
+    if extension == ".bz2":
+        return bz2.BZ2File(fileName, mode)
+    if lzma is not None:
+        return lzma.open(fileName, mode)
+    if tools:
+        tool, options = tools[0]
+        return _ProcessFile(
+            [tool] + [option.replace("%d", "1") for option in options],
+            fileName, mode)
+    raise IOError("Reading and writing .xz files requires backports.lzma " +
+                  "or the xz programme")
 
 
 def exportToFile(result, fileName):
@@ -25,21 +165,164 @@ def exportToFile(result, fileName):
         https://github.com/sfu-natlang/HMM-Aligner/wiki/API-reference:-Alignment-Data-Format-V0.1a#alignment
     @param fileName: str, the file to export to
     '''
-    outputFile = open(fileName, "w")
-    for sentenceAlignment in result:
-        line = ""
-        for item in sentenceAlignment:
-            if len(item) == 2:
-                line += str(item[0]) + "-" + str(item[1]) + " "
-            if len(item) == 3:
-                line += str(item[0]) + "-" + str(item[1]) +\
-                    "(" + str(item[2]) + ") "
-
-        outputFile.write(line + "\n")
+    outputFile = openFile(fileName, "w")
+    outputFile.writelines([formatAlignment(sentenceAlignment)
+                           for sentenceAlignment in result])
     outputFile.close()
     return
 
 
+def formatAlignment(sentenceAlignment):
+    '''
+    This function gives the line of an alignment file for one sentence.
+
+    @param sentenceAlignment: SentenceAlignment, the alignment of a sentence
+    @return: str, the line, including the line break
+    '''
+    items = []
+    for item in sentenceAlignment:
+        if len(item) == 2:
+            items.append("%s-%s " % (item[0], item[1]))
+        if len(item) == 3:
+            items.append("%s-%s(%s) " % (item[0], item[1], item[2]))
+    return "".join(items) + "\n"
+
+
+class AlignmentWriter():
+    def __init__(self, fileName, queueSize=4096):
+        '''
+        Writes the alignment of each sentence to a file, in the format of
+        exportToFile, as soon as it is produced. The alignments are passed
+        through a bounded queue to a writer thread, which formats them and
+        writes whatever has accumulated in one go, so the producer never
+        waits on the disk unless it is more than queueSize sentences ahead.
+
+        @param fileName: str, the file to write to, see openFile
+        @param queueSize: int, the maximum number of sentences waiting to be
+            written
+        '''
+        self.output = openFile(fileName, "w")
+        self.queue = Queue.Queue(queueSize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, sentenceAlignment):
+        '''
+        @param sentenceAlignment: SentenceAlignment, the alignment of the next
+            sentence
+        '''
+        if self.error is not None:
+            raise self.error
+        self.queue.put(sentenceAlignment)
+        return
+
+    def passThrough(self, batches):
+        '''
+        Write the alignment of every sentence in the batches, such as those
+        given by AlignmentModelBase.iterDecode, and pass each sentence on
+        once it is queued, so that it can also be scored as it goes by.
+
+        @param batches: iterable of lists of SentenceAlignments
+        @return: generator of SentenceAlignments
+        '''
+        for batch in batches:
+            for sentenceAlignment in batch:
+                self.write(sentenceAlignment)
+                yield sentenceAlignment
+        return
+
+    def _run(self):
+        finished = False
+        while not finished:
+            lines = []
+            sentenceAlignment = self.queue.get()
+            while sentenceAlignment is not None:
+                lines.append(sentenceAlignment)
+                try:
+                    sentenceAlignment = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            finished = sentenceAlignment is None
+            if self.error is not None:
+                # Keep emptying the queue so that write never blocks
+                continue
+            try:
+                self.output.writelines([formatAlignment(sentenceAlignment)
+                                        for sentenceAlignment in lines])
+            except Exception as e:
+                self.error = e
+        return
+
+    def close(self):
+        '''
+        Wait for every sentence to be written and close the file.
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.output.close()
+        if self.error is not None:
+            raise self.error
+        return
+
+
+class AlignmentBuilder():
+    def __init__(self):
+        '''
+        Collects the alignment of each sentence into growable buffers, in
+        place of a list of lists of tuples. It can be given to the decoders
+        as their output, like AlignmentWriter, and the result taken as a
+        CompactAlignment, which is much smaller to keep or to send to another
+        process.
+        '''
+        self.offsets = array('l', [0])
+        self.f = array('i')
+        self.e = array('i')
+        self.types = array('i')
+        self.typeIndex = {}
+        self.typeList = []
+        return
+
+    def write(self, sentenceAlignment):
+        '''
+        @param sentenceAlignment: SentenceAlignment, the alignment of the next
+            sentence
+        '''
+        for item in sentenceAlignment:
+            self.f.append(int(item[0]))
+            self.e.append(int(item[1]))
+            if len(item) > 2:
+                if item[2] not in self.typeIndex:
+                    self.typeIndex[item[2]] = len(self.typeList)
+                    self.typeList.append(item[2])
+                self.types.append(self.typeIndex[item[2]])
+            else:
+                self.types.append(-1)
+        self.offsets.append(len(self.f))
+        return
+
+    def alignment(self):
+        '''
+        @return: CompactAlignment, with every link certain
+        '''
+        f = np.frombuffer(self.f, dtype=np.int32).copy()
+        return CompactAlignment(
+            np.frombuffer(self.offsets, dtype=np.dtype('l')).astype(np.int64),
+            f,
+            np.frombuffer(self.e, dtype=np.int32).copy(),
+            np.frombuffer(self.types, dtype=np.int32).copy(),
+            np.zeros(len(f), dtype=np.bool_),
+            list(self.typeList))
+
+
 def _loadBitext(file1, file2, linesToLoad=sys.maxint):
     '''
     This function is used to read a bitext from two text files.
@@ -54,7 +337,7 @@ def _loadBitext(file1, file2, linesToLoad=sys.maxint):
     path2 = os.path.expanduser(file2)
     bitext =\
         [[sentence.strip().split() for sentence in pair] for pair in
-            zip(open(path1), open(path2))[:linesToLoad]]
+            zip(openFile(path1), openFile(path2))[:linesToLoad]]
     return bitext
 
 
@@ -74,7 +357,8 @@ def _loadTritext(file1, file2, file3, linesToLoad=sys.maxint):
     path3 = os.path.expanduser(file3)
     tritext =\
         [[sentence.strip().split() for sentence in trio] for trio in
-            zip(open(path1), open(path2), open(path3))[:linesToLoad]]
+            zip(openFile(path1), openFile(path2),
+                openFile(path3))[:linesToLoad]]
     return tritext
 
 
@@ -105,10 +389,134 @@ def processAlignmentEntry(entry, listToAddTo, splitChar='-',
     return
 
 
+def parseStreamLine(line):
+    '''
+    This function is used to read a sentence pair given on a single line, as
+    "source words ||| target words". The factors of a word (FORM, POS, etc.)
+    are separated by "|", as in "word|POS".
+
+    @param line: str, the line
+    @return: sentence of a Dataset, with an empty alignment
+    '''
+    fields = line.split("|||")
+    if len(fields) < 2:
+        raise ValueError("Sentence pair without ||| separator: " +
+                         line.strip())
+    return tuple([[tuple(word.split("|")) for word in field.split()]
+                  for field in fields[:2]] + [[]])
+
+
+def iterStreamBatches(inputFile, batchSize=100, delay=0.1):
+    '''
+    This function is used to read sentence pairs (see parseStreamLine) from
+    a stream such as the standard input, in batches. A batch is complete
+    when it has batchSize sentences, or when delay seconds have passed since
+    its first sentence arrived, so no sentence waits longer than that for
+    more input. The stream is read by a separate thread.
+
+    @param inputFile: file object, the stream to read
+    @param* batchSize: int, the largest number of sentences in a batch
+    @param* delay: float, the longest time in seconds to wait for a batch to
+        fill up
+    @return: generator of Datasets
+    '''
+    lines = Queue.Queue(batchSize * 4)
+
+    def read():
+        # Iterating over a file reads ahead, readline returns every line as
+        # soon as it arrives
+        try:
+            for line in iter(inputFile.readline, ""):
+                lines.put(line)
+        finally:
+            lines.put(None)
+        return
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+
+    while True:
+        line = lines.get()
+        if line is None:
+            return
+        batch = [parseStreamLine(line)]
+        deadline = time.time() + delay
+        while len(batch) < batchSize:
+            try:
+                line = lines.get(timeout=max(deadline - time.time(), 0))
+            except Queue.Empty:
+                break
+            if line is None:
+                yield batch
+                return
+            batch.append(parseStreamLine(line))
+        yield batch
+    return
+
+
+def iterDataset(fFiles, eFiles, alignmentFile="", linesToLoad=sys.maxint,
+                reverse=False):
+    '''
+    This function is used to read a Dataset files lazily. The files are read
+    in lockstep one line at a time, and each sentence is yielded as soon as
+    it is read, so only one sentence is held in memory at a time. Reading
+    stops after linesToLoad sentences or at the end of the shortest of the
+    source and target language files. When the alignment file is shorter,
+    the remaining sentences come with empty alignments.
+
+    @param fFiles: list of str, the file containing source language files,
+        including FORM, POS, etc.,
+    @param eFiles: list of str, the file containing target language files,
+        including FORM, POS, etc.,
+    @param alignmentFile: str, the alignmentFile
+    @param* linesToLoad: int, the lines to read
+    @param* reverse: bool, swap the positions of each alignment entry
+    @return: generator of sentences, see loadDataset
+    '''
+    files = [openFile(fileName) for fileName in list(fFiles) + list(eFiles)]
+    alignmentLines = None
+    if alignmentFile:
+        files.append(openFile(alignmentFile))
+        alignmentLines = files[-1]
+    try:
+        for sentence in _iterSentences(files[:len(fFiles)],
+                                       files[len(fFiles):
+                                             len(fFiles) + len(eFiles)],
+                                       alignmentLines, linesToLoad, reverse):
+            yield sentence
+    finally:
+        for openedFile in files:
+            openedFile.close()
+    return
+
+
+def _iterSentences(fFiles, eFiles, alignmentFile, linesToLoad, reverse):
+    # Same as iterDataset, but on files that are already open
+    fLines = izip(*fFiles)
+    eLines = izip(*eFiles)
+    for fContents, eContents in islice(izip(fLines, eLines), linesToLoad):
+        alignment = []
+        if alignmentFile is not None:
+            for f, e, alignmentType, probable in\
+                    _alignmentLinks(alignmentFile.readline(), reverse):
+                if probable:
+                    continue
+                if alignmentType == "":
+                    alignment.append((f, e))
+                else:
+                    alignment.append((f, e, alignmentType))
+        yield (zip(*[content.strip().split() for content in fContents]),
+               zip(*[content.strip().split() for content in eContents]),
+               alignment)
+    return
+
+
 def loadDataset(fFiles, eFiles, alignmentFile="", linesToLoad=sys.maxint,
                 reverse=False):
     '''
-    This function is used to read a Dataset files.
+    This function is used to read a Dataset files. It reads the files through
+    iterDataset, use that instead to go through the sentences without
+    keeping all of them in memory.
 
     @param fFiles: list of str, the file containing source language files,
         including FORM, POS, etc.,
@@ -119,36 +527,436 @@ def loadDataset(fFiles, eFiles, alignmentFile="", linesToLoad=sys.maxint,
     @return: Dataset, detail of this format:
         https://github.com/sfu-natlang/HMM-Aligner/wiki/API-reference:-Dataset-Data-Format-V0.2a#tritext
     '''
-    fContents =\
-        [zip(*[fContent.strip().split() for fContent in contents])
-         for contents in zip(*[open(os.path.expanduser(fFile))
-                             for fFile in fFiles])[:linesToLoad]]
-    eContents =\
-        [zip(*[eContent.strip().split() for eContent in contents])
-         for contents in zip(*[open(os.path.expanduser(eFile))
-                             for eFile in eFiles])[:linesToLoad]]
+    return list(iterDataset(fFiles, eFiles, alignmentFile, linesToLoad,
+                            reverse))
 
-    if alignmentFile:
-        alignment =\
-            [sentence[0].strip().split() for sentence in
-                zip(open(os.path.expanduser(alignmentFile)))[:linesToLoad]]
 
-        for i in range(len(alignment)):
-            entries = alignment[i]
-            result = []
-            for entry in entries:
-                processAlignmentEntry(entry, result, reverse=reverse)
-            alignment[i] = result
+def lineIndexFile(fileName):
+    '''
+    This function gives the name of the line index of a file, which lives
+    next to it.
+
+    @param fileName: str, the indexed file
+    @return: str, the name of the line index file
+    '''
+    return os.path.expanduser(fileName) + ".lines.npz"
+
+
+def buildLineIndex(fileName):
+    '''
+    This function is used to find the byte offsets where each line of a file
+    starts. The file is read in blocks, and the line breaks of each block are
+    located with NumPy.
+
+    @param fileName: str, the file to index, not compressed
+    @return: numpy array of int64, the offset of each line, followed by the
+        size of the file, so line i spans [index[i], index[i + 1])
+    '''
+    parts = [np.zeros(1, dtype=np.int64)]
+    inputFile = open(os.path.expanduser(fileName), "rb")
+    try:
+        base = 0
+        block = inputFile.read(1 << 22)
+        while block:
+            parts.append(np.flatnonzero(
+                np.frombuffer(block, dtype=np.uint8) == ord("\n")) +
+                base + 1)
+            base += len(block)
+            lastByte = block[-1]
+            block = inputFile.read(1 << 22)
+    finally:
+        inputFile.close()
+    if base > 0 and lastByte != "\n":
+        # The last line of the file has no line break
+        parts.append(np.array([base], dtype=np.int64))
+    return np.concatenate(parts).astype(np.int64)
+
 
-        alignment += [[] for i in range(len(alignment), min(linesToLoad,
-                                                            len(fContents),
-                                                            len(eContents)))]
+def loadLineIndex(fileName, rebuild=False):
+    '''
+    This function is used to get the line index of a file (see
+    buildLineIndex). The index is built once and saved to the file named by
+    lineIndexFile, together with the size and modification time of the
+    indexed file, and built again when those have changed.
 
+    @param fileName: str, the indexed file, not compressed
+    @param* rebuild: bool, build and save the index even if it exists
+    @return: numpy array of int64, see buildLineIndex
+    '''
+    fileName = os.path.expanduser(fileName)
+    if isCompressed(fileName):
+        raise ValueError("Compressed file can't be indexed: " + fileName)
+    stat = os.stat(fileName)
+    indexFile = lineIndexFile(fileName)
+    if not rebuild and os.path.isfile(indexFile):
+        try:
+            data = np.load(indexFile)
+            try:
+                if data["size"] == stat.st_size and\
+                        data["mtime"] == stat.st_mtime:
+                    return data["offsets"]
+            finally:
+                data.close()
+            logger.info("Line index " + indexFile + " is out of date")
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning("Unable to load line index " + indexFile +
+                           ": " + str(e) + ", rebuilding")
+
+    offsets = buildLineIndex(fileName)
+    tmpFileName = indexFile + ".tmp%d" % os.getpid()
+    try:
+        output = open(tmpFileName, "wb")
+        try:
+            np.savez(output, offsets=offsets, size=stat.st_size,
+                     mtime=stat.st_mtime)
+        finally:
+            output.close()
+        os.rename(tmpFileName, indexFile)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to save line index " + indexFile + ": " +
+                       str(e))
+    return offsets
+
+
+def countLines(fileName):
+    '''
+    This function counts the lines of a file, through its line index (see
+    loadLineIndex) unless the file is compressed.
+
+    @param fileName: str, the file
+    @return: int, the number of lines
+    '''
+    if isCompressed(fileName):
+        inputFile = openFile(fileName)
+        try:
+            return sum(1 for line in inputFile)
+        finally:
+            inputFile.close()
+    return len(loadLineIndex(fileName)) - 1
+
+
+def _openRange(fileName, start):
+    # Open a file at the given line, by seeking to it through the line index
+    # or, for compressed files, by skipping the lines before it
+    inputFile = openFile(fileName)
+    if isCompressed(fileName):
+        for line in islice(inputFile, start):
+            pass
     else:
-        alignment = [[] for i in range(min(linesToLoad,
-                                           len(fContents),
-                                           len(eContents)))]
-    return zip(fContents, eContents, alignment)
+        offsets = loadLineIndex(fileName)
+        inputFile.seek(offsets[min(start, len(offsets) - 1)])
+    return inputFile
+
+
+def shardRange(lines, shard, shards):
+    '''
+    This function splits lines into the given number of shards of about the
+    same size.
+
+    @param lines: int, the number of lines
+    @param shard: int, the shard, counting from 0
+    @param shards: int, the number of shards
+    @return: (int, int), the [start, end) range of lines of the shard
+    '''
+    if not 0 <= shard < shards:
+        raise ValueError("Invalid shard %d of %d" % (shard, shards))
+    return (lines * shard // shards, lines * (shard + 1) // shards)
+
+
+def iterDatasetRange(fFiles, eFiles, alignmentFile="", start=0,
+                     end=sys.maxint, reverse=False):
+    '''
+    This function is used to read the sentences [start, end) of a Dataset
+    files lazily. Each file is opened at the first sentence through its line
+    index (see loadLineIndex), so the lines before it are never read.
+    Compressed files can't be indexed, their leading lines are skipped
+    instead.
+
+    @param fFiles: list of str, the file containing source language files,
+        including FORM, POS, etc.,
+    @param eFiles: list of str, the file containing target language files,
+        including FORM, POS, etc.,
+    @param alignmentFile: str, the alignmentFile
+    @param* start: int, the first sentence to read, counting from 0
+    @param* end: int, the sentence to stop before
+    @param* reverse: bool, swap the positions of each alignment entry
+    @return: generator of sentences, see loadDataset
+    '''
+    files = []
+    try:
+        for fileName in list(fFiles) + list(eFiles):
+            files.append(_openRange(fileName, start))
+        alignmentLines = None
+        if alignmentFile:
+            files.append(_openRange(alignmentFile, start))
+            alignmentLines = files[-1]
+        for sentence in _iterSentences(files[:len(fFiles)],
+                                       files[len(fFiles):
+                                             len(fFiles) + len(eFiles)],
+                                       alignmentLines, max(end - start, 0),
+                                       reverse):
+            yield sentence
+    finally:
+        for openedFile in files:
+            openedFile.close()
+    return
+
+
+def _chunkOffsets(fileName, chunks):
+    # Split a file into about the given number of byte ranges, each of which
+    # starts at the beginning of a line. Returns the start offsets of the
+    # ranges, followed by the size of the file.
+    size = os.path.getsize(fileName)
+    offsets = [0]
+    inputFile = open(fileName, "rb")
+    try:
+        for k in range(1, chunks):
+            inputFile.seek(max(size * k // chunks - 1, offsets[-1]))
+            inputFile.readline()
+            offset = inputFile.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    finally:
+        inputFile.close()
+    offsets.append(size)
+    return offsets
+
+
+def _countLines(task):
+    fileName, start, end = task
+    inputFile = open(fileName, "rb")
+    try:
+        inputFile.seek(start)
+        count = 0
+        position = start
+        while position < end:
+            block = inputFile.read(min(1 << 20, end - position))
+            if not block:
+                break
+            count += block.count("\n")
+            position += len(block)
+            lastByte = block[-1]
+        if position > start and lastByte != "\n":
+            # The last line of the file has no line break
+            count += 1
+    finally:
+        inputFile.close()
+    return count
+
+
+def _lineOffsets(task):
+    # Find the byte offsets where the given lines (counting from 0) of a file
+    # start. Lines past the end of the file start at the end of the file.
+    fileName, lineNumbers = task
+    result = []
+    inputFile = open(fileName, "rb")
+    try:
+        line = base = 0
+        k = 0
+        while k < len(lineNumbers):
+            block = inputFile.read(1 << 20)
+            if not block:
+                break
+            newLines = block.count("\n")
+            seen, start = line, 0
+            while k < len(lineNumbers) and lineNumbers[k] <= line + newLines:
+                while seen < lineNumbers[k]:
+                    start = block.index("\n", start) + 1
+                    seen += 1
+                result.append(base + start)
+                k += 1
+            line += newLines
+            base += len(block)
+        result += [base] * (len(lineNumbers) - k)
+    finally:
+        inputFile.close()
+    return result
+
+
+def _fileChunks(fileName, pool, chunks, linesToLoad=sys.maxint):
+    # Returns the (byte offset, first line, number of lines) of each chunk,
+    # covering the first linesToLoad lines of the file.
+    offsets = _chunkOffsets(fileName, chunks)
+    counts = pool.map(_countLines, [(fileName, offsets[i], offsets[i + 1])
+                                    for i in range(len(offsets) - 1)])
+    result = []
+    line = 0
+    for offset, count in zip(offsets, counts):
+        if line >= linesToLoad:
+            break
+        count = min(count, linesToLoad - line)
+        result.append((offset, line, count))
+        line += count
+    return result
+
+
+def _parallelPool(processes):
+    # Pool workers are daemonic and can't have a pool of their own, the
+    # loaders fall back to reading files sequentially there.
+    if processes <= 1:
+        return None
+    if multiprocessing.current_process().daemon:
+        logger.warning("Unable to start parsing processes from a worker " +
+                       "process, reading files sequentially")
+        return None
+    return multiprocessing.Pool(processes)
+
+
+def _loadCorpusChunk(task):
+    fFiles, eFiles, alignmentFile, lines, reverse = task
+    files = []
+    for fileName, offset in fFiles + eFiles + [alignmentFile]:
+        if fileName:
+            files.append(open(fileName))
+            files[-1].seek(offset)
+    try:
+        return internDataset(
+            _iterSentences(files[:len(fFiles)],
+                           files[len(fFiles):len(fFiles) + len(eFiles)],
+                           files[-1] if alignmentFile[0] else None,
+                           lines, reverse),
+            len(fFiles))
+    finally:
+        for openedFile in files:
+            openedFile.close()
+
+
+def parallelLoadCorpus(fFiles, eFiles, alignmentFile="",
+                       linesToLoad=sys.maxint, reverse=False, processes=None):
+    '''
+    This function is used to read a Dataset files with a pool of processes.
+    The first source language file is split into byte ranges on line
+    boundaries, the same lines are located in the other files, and each
+    range is parsed and interned into a Corpus by a worker. The Corpora are
+    then merged in order, giving the same result as interning the output of
+    iterDataset (see corpus.internDataset). Compressed files can't be split
+    and are read sequentially.
+
+    @param fFiles: list of str, the file containing source language files,
+        including FORM, POS, etc.,
+    @param eFiles: list of str, the file containing target language files,
+        including FORM, POS, etc.,
+    @param alignmentFile: str, the alignmentFile
+    @param* linesToLoad: int, the lines to read
+    @param* reverse: bool, swap the positions of each alignment entry
+    @param* processes: int, the number of processes to use, all of the CPUs
+        by default
+    @return: Corpus
+    '''
+    fFiles = [os.path.expanduser(fileName) for fileName in fFiles]
+    eFiles = [os.path.expanduser(fileName) for fileName in eFiles]
+    alignmentFile = os.path.expanduser(alignmentFile) if alignmentFile else ""
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if any([isCompressed(fileName) for fileName in fFiles + eFiles]) or\
+            isCompressed(alignmentFile):
+        # Compressed files can't be split, see openFile for multithreading
+        processes = 1
+    pool = _parallelPool(processes)
+    if pool is None:
+        return internDataset(iterDataset(fFiles, eFiles, alignmentFile,
+                                         linesToLoad, reverse),
+                             len(fFiles))
+    try:
+        chunks = _fileChunks(fFiles[0], pool, processes * 4,
+                             linesToLoad)
+        lineNumbers = [line for offset, line, count in chunks]
+        otherFiles = fFiles[1:] + eFiles + ([alignmentFile] if alignmentFile
+                                            else [])
+        otherOffsets = pool.map(_lineOffsets, [(fileName, lineNumbers)
+                                               for fileName in otherFiles])
+        tasks = []
+        for k in range(len(chunks)):
+            offsets = [chunks[k][0]] + [offsets[k] for offsets in
+                                        otherOffsets]
+            tasks.append((
+                zip(fFiles, offsets[:len(fFiles)]),
+                zip(eFiles, offsets[len(fFiles):len(fFiles) + len(eFiles)]),
+                (alignmentFile, offsets[-1] if alignmentFile else 0),
+                chunks[k][2],
+                reverse))
+        corpora = pool.map(_loadCorpusChunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    if len(corpora) == 0:
+        return internDataset([], len(fFiles))
+    return mergeCorpora(corpora)
+
+
+def corpusCacheFile(fFiles, eFiles, alignmentFile="",
+                    linesToLoad=sys.maxint, reverse=False):
+    '''
+    This function gives the name of the corpus cache of a Dataset. The cache
+    lives next to the first source language file, and its name contains a
+    fingerprint of the paths, sizes and modification times of all of the
+    files, linesToLoad and reverse, so any change to them gives a new name.
+
+    @param fFiles: list of str, the file containing source language files,
+        including FORM, POS, etc.,
+    @param eFiles: list of str, the file containing target language files,
+        including FORM, POS, etc.,
+    @param alignmentFile: str, the alignmentFile
+    @param* linesToLoad: int, the lines to read
+    @param* reverse: bool, swap the positions of each alignment entry
+    @return: str, the name of the cache file
+    '''
+    key = [__version__, linesToLoad, reverse]
+    for fileName in list(fFiles) + [None] + list(eFiles) + [alignmentFile]:
+        if fileName:
+            path = os.path.abspath(os.path.expanduser(fileName))
+            stat = os.stat(path)
+            key += [path, stat.st_size, stat.st_mtime]
+        else:
+            key.append(fileName)
+    fingerprint = hashlib.sha1(repr(key)).hexdigest()[:16]
+    return os.path.expanduser(fFiles[0]) + "." + fingerprint + ".corpus.npz"
+
+
+def loadCachedCorpus(fFiles, eFiles, alignmentFile="", linesToLoad=sys.maxint,
+                     reverse=False, rebuild=False, processes=1):
+    '''
+    This function is used to read a Dataset files through the corpus cache.
+    The first time a Dataset is read, it is parsed with iterDataset and
+    interned into a Corpus (see corpus.internDataset), which is then saved
+    to the file named by corpusCacheFile. Later calls with the same
+    unchanged files load the Corpus from there instead of parsing the text.
+    The Corpus keeps its own vocabularies, so it can be lexicalised with any
+    model's lexikon afterwards. With more than one process, the files are
+    parsed by parallelLoadCorpus.
+
+    @param fFiles: list of str, the file containing source language files,
+        including FORM, POS, etc.,
+    @param eFiles: list of str, the file containing target language files,
+        including FORM, POS, etc.,
+    @param alignmentFile: str, the alignmentFile
+    @param* linesToLoad: int, the lines to read
+    @param* reverse: bool, swap the positions of each alignment entry
+    @param* rebuild: bool, parse the files and rewrite the cache even if it
+        exists
+    @param* processes: int, the number of processes parsing the files
+    @return: Corpus
+    '''
+    cacheFile = corpusCacheFile(fFiles, eFiles, alignmentFile, linesToLoad,
+                                reverse)
+    if not rebuild and os.path.isfile(cacheFile):
+        try:
+            corpus = loadCorpus(cacheFile)
+            logger.info("Corpus loaded from cache " + cacheFile)
+            return corpus
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning("Unable to load corpus cache " + cacheFile +
+                           ": " + str(e) + ", rebuilding")
+
+    corpus = parallelLoadCorpus(fFiles, eFiles, alignmentFile, linesToLoad,
+                                reverse, processes)
+    try:
+        saveCorpus(corpus, cacheFile)
+        logger.info("Corpus cache saved to " + cacheFile)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to save corpus cache " + cacheFile +
+                       ": " + str(e))
+    return corpus
 
 
 def infoDataset(dataset):
@@ -208,45 +1016,377 @@ def loadAlignment(fileName, linesToLoad=sys.maxint,
     '''
     This function is used to read the GoldAlignment or Alignment from files.
 
+    Each line is parsed in a single scan, and the result is kept in flat
+    arrays, see CompactAlignment.
+
     @param fileName: str, the Alignment file to read
     @param* linesToLoad: int, the lines to read
-    @return: GoldAlignment, detail of this format:
+    @return: CompactAlignment, behaving as GoldAlignment, detail of this
+        format:
         https://github.com/sfu-natlang/HMM-Aligner/wiki/API-reference:-Alignment-Data-Format-V0.1a#goldalignment
     '''
+    inputFile = openFile(fileName)
+    try:
+        result = _parseAlignment(islice(inputFile, linesToLoad), reverse,
+                                 loadType)
+    finally:
+        inputFile.close()
+    result.fromZero()
+    return result
+
+
+def iterAlignment(fileName, blockSize=100000, reverse=False, loadType=True):
+    '''
+    This function is used to read a GoldAlignment or Alignment file a block
+    of lines at a time, so that files of any size can be processed. The
+    positions are kept as they are in the file, without shifting zero-based
+    ones (see CompactAlignment.fromZero).
+
+    @param fileName: str, the Alignment file to read
+    @param* blockSize: int, the number of lines in each block
+    @return: generator of CompactAlignment, one per block
+    '''
+    inputFile = openFile(fileName)
+    try:
+        while True:
+            block = _parseAlignmentBlock(islice(inputFile, blockSize),
+                                         reverse, loadType)
+            if len(block) == 0:
+                break
+            yield block
+    finally:
+        inputFile.close()
+    return
+
+
+def _loadAlignmentChunk(task):
+    fileName, offset, lines, reverse, loadType = task
+    inputFile = open(fileName)
+    try:
+        inputFile.seek(offset)
+        return _parseAlignment(islice(inputFile, lines), reverse, loadType)
+    finally:
+        inputFile.close()
+
+
+def parallelLoadAlignment(fileName, linesToLoad=sys.maxint,
+                          reverse=False, loadType=True, processes=None):
+    '''
+    This function is used to read the GoldAlignment or Alignment from files
+    with a pool of processes. The file is split into byte ranges on line
+    boundaries, which are parsed by the workers and put back together in
+    order. The result is the same as that of loadAlignment. Compressed files
+    can't be split and are read sequentially.
+
+    @param fileName: str, the Alignment file to read
+    @param* linesToLoad: int, the lines to read
+    @param* processes: int, the number of processes to use, all of the CPUs
+        by default
+    @return: GoldAlignment, see loadAlignment
+    '''
     fileName = os.path.expanduser(fileName)
-    content =\
-        [line.strip().split() for line in open(fileName)][:linesToLoad]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if isCompressed(fileName):
+        processes = 1
+    pool = _parallelPool(processes)
+    if pool is None:
+        return loadAlignment(fileName, linesToLoad, reverse, loadType)
+    try:
+        chunks = _fileChunks(fileName, pool, processes * 4,
+                             linesToLoad)
+        parts = pool.map(_loadAlignmentChunk,
+                         [(fileName, offset, count, reverse, loadType)
+                          for offset, line, count in chunks])
+    finally:
+        pool.close()
+        pool.join()
+    result = _mergeAlignments(parts)
+    result.fromZero()
+    return result
 
-    result = []
 
-    for sentence in content:
+def loadAlignmentRange(fileName, start=0, end=sys.maxint,
+                       reverse=False, loadType=True):
+    '''
+    This function is used to read the lines [start, end) of a GoldAlignment
+    or Alignment file, opened at the first line through its line index (see
+    iterDatasetRange). Zero-based positions are detected within the range.
+
+    @param fileName: str, the Alignment file to read
+    @param* start: int, the first line to read, counting from 0
+    @param* end: int, the line to stop before
+    @return: GoldAlignment, see loadAlignment
+    '''
+    inputFile = _openRange(os.path.expanduser(fileName), start)
+    try:
+        result = _parseAlignment(islice(inputFile, max(end - start, 0)),
+                                 reverse, loadType)
+    finally:
+        inputFile.close()
+    result.fromZero()
+    return result
+
+
+# Alignment entries of the forms i-j, i-j,k, i?j and i-j(TYPE). Anything else
+# (such as types containing separators) is left to processAlignmentEntry.
+_alignmentEntryPattern = re.compile(
+    r"(\d+)([-?])(\d+(?:,\d+)*)(?:\(((?!\d*\))[^-?,()\[\]\s]*)\))?")
+_alignmentLinePattern = re.compile(
+    r"^\s*(?:\d+[-?]\d+(?:,\d+)*(?:\((?!\d*\))[^-?,()\[\]\s]*\))?" +
+    r"(?:\s+|$))*$")
+
+
+def _alignmentLinks(line, reverse=False, loadType=True):
+    # Parse one line of an alignment file into a list of links, each of which
+    # is a tuple (f, e, alignmentType, probable). alignmentType is "" for
+    # untyped links.
+    links = []
+    if _alignmentLinePattern.match(line):
+        for f, splitChar, eList, alignmentType in\
+                _alignmentEntryPattern.findall(line):
+            probable = splitChar == "?"
+            if not loadType:
+                alignmentType = ""
+            f = int(f)
+            # Same order as processAlignmentEntry, which walks backwards
+            for e in reversed(eList.split(",")):
+                if reverse:
+                    links.append((int(e), f, alignmentType, probable))
+                else:
+                    links.append((f, int(e), alignmentType, probable))
+        return links
+
+    for entry in line.split():
+        if entry.find('-') != -1:
+            splitChar = '-'
+        elif entry.find('?') != -1:
+            splitChar = '?'
+        else:
+            continue
+        items = []
+        processAlignmentEntry(entry, items, splitChar=splitChar,
+                              reverse=reverse, loadType=loadType)
+        for item in items:
+            alignmentType = item[2] if len(item) > 2 else ""
+            links.append((item[0], item[1], alignmentType, splitChar == '?'))
+    return links
+
+
+class CompactAlignment():
+    def __init__(self, offsets, f, e, types, probable, typeList):
+        '''
+        The GoldAlignment of a whole file kept in flat arrays, one entry per
+        link. Indexing it gives the alignment of a sentence in the usual
+        format, {"certain": [...], "probable": [...]}, so it can be used in
+        place of the list returned by loadAlignment in older versions.
+
+        @param offsets: np.ndarray, the links of sentence i are
+            offsets[i]:offsets[i + 1]
+        @param f: np.ndarray, the source language position of each link
+        @param e: np.ndarray, the target language position of each link
+        @param types: np.ndarray, the alignment type of each link as an index
+            of typeList, -1 for links without type
+        @param probable: np.ndarray of bool, whether each link is probable
+        @param typeList: list of str, the alignment types
+        '''
+        self.offsets = offsets
+        self.f = f
+        self.e = e
+        self.types = types
+        self.probable = probable
+        self.typeList = typeList
+        return
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("CompactAlignment index out of range")
+        start, end = self.offsets[i], self.offsets[i + 1]
+        typeList = self.typeList
         certainAlign = []
         probableAlign = []
-        for entry in sentence:
-            if entry.find('-') != -1:
-                processAlignmentEntry(entry, certainAlign, splitChar='-',
-                                      reverse=reverse, loadType=loadType)
-
-            elif entry.find('?') != -1:
-                processAlignmentEntry(entry, probableAlign, splitChar='?',
-                                      reverse=reverse, loadType=loadType)
-
-        sentenceAlignment = {"certain": certainAlign,
-                             "probable": probableAlign}
-        result.append(sentenceAlignment)
-
-    x = [min([item[0] for item in sentence["certain"]] + [1])
-         for sentence in result]
-    if min(x) == 0:
-        for sentence in result:
-            for i in range(len(sentence["certain"])):
-                sentence["certain"][i] = (sentence["certain"][i][0] + 1,
-                                          sentence["certain"][i][1] + 1)
-            for i in range(len(sentence["probable"])):
-                sentence["probable"][i] = (sentence["probable"][i][0] + 1,
-                                           sentence["probable"][i][1] + 1)
+        for f, e, alignmentType, probable in zip(
+                self.f[start:end].tolist(), self.e[start:end].tolist(),
+                self.types[start:end].tolist(),
+                self.probable[start:end].tolist()):
+            if alignmentType < 0:
+                link = (f, e)
+            else:
+                link = (f, e, typeList[alignmentType])
+            if probable:
+                probableAlign.append(link)
+            else:
+                certainAlign.append(link)
+        return {"certain": certainAlign, "probable": probableAlign}
 
-    return result
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def links(self, i):
+        '''
+        @param i: int, a sentence
+        @return: (f, e, types, probable), views of the arrays of the links of
+            the sentence.
+        '''
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return (self.f[start:end], self.e[start:end],
+                self.types[start:end], self.probable[start:end])
+
+    def reversed(self):
+        '''
+        @return: CompactAlignment, with the source and target language
+            positions of every link swapped. The arrays are shared.
+        '''
+        return CompactAlignment(self.offsets, self.e, self.f, self.types,
+                                self.probable, self.typeList)
+
+    def fromZero(self):
+        '''
+        Alignment files counting positions from 0 are shifted to count from 1.
+        Like older versions, a file is taken as counting from 0 when a certain
+        link has source language position 0.
+        '''
+        if (self.f[~self.probable] == 0).any():
+            self.f += 1
+            self.e += 1
+        return
+
+    def nbytes(self):
+        '''
+        @return: int, memory used by the arrays in bytes.
+        '''
+        return (self.offsets.nbytes + self.f.nbytes + self.e.nbytes +
+                self.types.nbytes + self.probable.nbytes)
+
+
+def _parseAlignment(lines, reverse, loadType, blockSize=100000):
+    lines = iter(lines)
+    parts = []
+    while True:
+        part = _parseAlignmentBlock(islice(lines, blockSize), reverse,
+                                    loadType)
+        parts.append(part)
+        if len(part) < blockSize:
+            break
+    if len(parts) == 1:
+        return parts[0]
+    return _mergeAlignments(parts)
+
+
+# Patterns used by _parseAlignmentBlock on lines of the forms above
+_entryTypePattern = re.compile(r"\d+[-?]\d+(?:,\d+)*(?:\(([^()\s]*)\))?")
+_typePattern = re.compile(r"\([^()\s]*\)")
+_separatorsToSpaces = "".join(
+    [" " if chr(i) in "-?," else chr(i) for i in range(256)])
+
+
+def _parseAlignmentBlock(lines, reverse, loadType):
+    # The lines are first brought to the form "i-j,k i?j(TYPE) ...", after
+    # which the whole block is scanned at once: the positions are read by
+    # np.fromstring, and the character before each of them tells whether it
+    # starts a new entry (source language position), or belongs to the
+    # last one (target language positions, certain after "-", probable after
+    # "?", and more of the same after ",").
+    lines = list(lines)
+    for i in range(len(lines)):
+        if not _alignmentLinePattern.match(lines[i]):
+            lines[i] = " ".join(
+                ["%d%s%d%s" % (f, "?" if probable else "-", e,
+                               "(" + alignmentType + ")"
+                               if alignmentType else "")
+                 for f, e, alignmentType, probable in
+                 _alignmentLinks(lines[i], loadType=loadType)]) + "\n"
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    text = "".join(lines)
+
+    entryTypes = None
+    if "(" in text:
+        if loadType:
+            entryTypes = np.array(_entryTypePattern.findall(text))
+        text = _typePattern.sub("", text)
+
+    buf = np.frombuffer(text, dtype=np.uint8)
+    isDigit = (buf >= ord("0")) & (buf <= ord("9"))
+    starts = np.flatnonzero(isDigit & ~np.concatenate(([False],
+                                                       isDigit[:-1])))
+    previous = np.concatenate(([ord(" ")], buf))[starts]
+    if len(starts) > 0:
+        positions = np.fromstring(text.translate(_separatorsToSpaces),
+                                  dtype=np.int32, sep=" ")
+    else:
+        positions = np.zeros(0, dtype=np.int32)
+
+    isF = (previous != ord("-")) & (previous != ord("?")) &\
+        (previous != ord(","))
+    entry = np.cumsum(isF) - 1
+    linkEntry = entry[~isF]
+    f = positions[isF][linkEntry]
+    e = positions[~isF]
+    isFirst = previous[~isF] != ord(",")
+    entryProbable = np.zeros(np.count_nonzero(isF), dtype=np.bool_)
+    entryProbable[linkEntry[isFirst]] = previous[~isF][isFirst] == ord("?")
+    probable = entryProbable[linkEntry]
+    lineOfLink = np.cumsum(buf == ord("\n"))[starts[~isF]]
+
+    typeList = []
+    types = np.zeros(len(e), dtype=np.int32) - 1
+    if entryTypes is not None and (entryTypes != "").any():
+        names, first, inverse = np.unique(entryTypes, return_index=True,
+                                          return_inverse=True)
+        # Types are numbered in order of first occurrence
+        mapping = np.zeros(len(names), dtype=np.int32) - 1
+        for k in np.argsort(first, kind="mergesort").tolist():
+            if names[k] != "":
+                mapping[k] = len(typeList)
+                typeList.append(str(names[k]))
+        types = mapping[inverse][linkEntry]
+
+    # Same order as processAlignmentEntry, which walks each entry backwards
+    order = np.lexsort((-np.arange(len(e)), linkEntry))
+    f, e, probable, types = f[order], e[order], probable[order], types[order]
+    if reverse:
+        f, e = e, f
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(lineOfLink, minlength=len(lines)),
+              out=offsets[1:])
+    return CompactAlignment(offsets, f, e, types, probable, typeList)
+
+
+def _mergeAlignments(parts):
+    # Concatenate CompactAlignments, merging their lists of types
+    typeIndex = {}
+    offsets = [np.zeros(1, dtype=np.int64)]
+    types = []
+    start = 0
+    for part in parts:
+        mapping = np.array([typeIndex.setdefault(alignmentType,
+                                                 len(typeIndex))
+                            for alignmentType in part.typeList] + [-1],
+                           dtype=np.int32)
+        # -1, no type, is mapped to the last element of mapping
+        types.append(mapping[part.types])
+        offsets.append(part.offsets[1:] + start)
+        start += len(part.f)
+    typeList = [None] * len(typeIndex)
+    for alignmentType in typeIndex:
+        typeList[typeIndex[alignmentType]] = alignmentType
+    return CompactAlignment(
+        np.concatenate(offsets),
+        np.concatenate([part.f for part in parts] + [np.zeros(0, np.int32)]),
+        np.concatenate([part.e for part in parts] + [np.zeros(0, np.int32)]),
+        np.concatenate(types + [np.zeros(0, np.int32)]),
+        np.concatenate([part.probable for part in parts] +
+                       [np.zeros(0, np.bool_)]),
+        typeList)
 
 
 class TestFileIO(unittest.TestCase):
@@ -283,6 +1423,67 @@ class TestFileIO(unittest.TestCase):
             self.assertItemsEqual(s1, s2)
         return
 
+    def testAlignmentWriter(self):
+        alignment = loadAlignment("support/ut_align_no_type.a")
+        certainAlign = [sentence["certain"] for sentence in alignment]
+        certainAlign[3] = [(1, 2, "SEM"), (2, 2)]
+        exportToFile(certainAlign, "support/ut_align_no_type.exported.wa")
+        writer = AlignmentWriter("support/ut_align_no_type.written.wa", 3)
+        for sentenceAlignment in certainAlign:
+            writer.write(sentenceAlignment)
+        writer.close()
+        self.assertEqual(open("support/ut_align_no_type.written.wa").read(),
+                         open("support/ut_align_no_type.exported.wa").read())
+        self.assertSequenceEqual(
+            [sentence["certain"] for sentence in
+             loadAlignment("support/ut_align_no_type.written.wa")],
+            certainAlign)
+        self.assertEqual(formatAlignment([(1, 2), (3, 4, "FUN")]),
+                         "1-2 3-4(FUN) \n")
+        return
+
+    def testAlignmentBuilder(self):
+        alignment = [[(1, 2), (3, 1)], [], [(2, 2, "SEM"), (1, 1, "FUN")],
+                     [(4, 4, "SEM")]]
+        builder = AlignmentBuilder()
+        for sentenceAlignment in alignment:
+            builder.write(sentenceAlignment)
+        result = builder.alignment()
+        self.assertEqual(len(result), len(alignment))
+        self.assertSequenceEqual([sentence["certain"] for sentence in result],
+                                 alignment)
+        self.assertSequenceEqual(result.typeList, ["SEM", "FUN"])
+        return
+
+    def testCompactAlignment(self):
+        fileName = "support/ut_align_typed.a"
+        output = open(fileName, "w")
+        output.write("0-0 1-2,3(SEM) 2?1(FUN)\n\n1-1(FUN) 2-2(GIS-x) 3-4()\n")
+        output.close()
+        try:
+            alignment = loadAlignment(fileName)
+            self.assertEqual(len(alignment), 3)
+            self.assertEqual(alignment.typeList, ["SEM", "FUN", "GIS"])
+            self.assertSequenceEqual(alignment[0]["certain"],
+                                     [(1, 1), (2, 4, "SEM"), (2, 3, "SEM")])
+            self.assertSequenceEqual(alignment[0]["probable"],
+                                     [(3, 2, "FUN")])
+            self.assertSequenceEqual(alignment[1]["certain"], [])
+            self.assertSequenceEqual(alignment[-1]["certain"],
+                                     [(2, 2, "FUN"), (3, 3, "GIS"), (4, 5)])
+            f, e, types, probable = alignment.links(0)
+            self.assertSequenceEqual(f.tolist(), [1, 2, 2, 3])
+            self.assertSequenceEqual(probable.tolist(),
+                                     [False, False, False, True])
+            alignment = loadAlignment(fileName, 1, reverse=True,
+                                      loadType=False)
+            self.assertSequenceEqual(alignment[0]["certain"],
+                                     [(1, 1), (4, 2), (3, 2)])
+            self.assertSequenceEqual(alignment[0]["probable"], [(2, 3)])
+        finally:
+            os.remove(fileName)
+        return
+
     def testLoadAlignmentWithoutType(self):
         alignment = loadAlignment("support/ut_align_no_type.a")
         certainAlign = [sentence["certain"] for sentence in alignment]
@@ -328,6 +1529,185 @@ class TestFileIO(unittest.TestCase):
             for e1, e2 in e:
                 self.assertItemsEqual(e1, e2)
 
+    def testIterDataset(self):
+        f = "support/ut_source.txt"
+        e = "support/ut_target.txt"
+        alignFile = "support/ut_align_no_type.a"
+        bitext = _loadBitext(f, e)
+        alignment = loadAlignment(alignFile)
+        dataset = iterDataset((f, ), (e, ), alignFile, linesToLoad=3)
+        self.assertFalse(isinstance(dataset, list))
+        dataset = list(dataset)
+        self.assertEqual(len(dataset), 3)
+        for (fWords, eWords, align), (f1, e1), gold in\
+                zip(dataset, bitext, alignment):
+            self.assertSequenceEqual([word[0] for word in fWords], f1)
+            self.assertSequenceEqual([word[0] for word in eWords], e1)
+            self.assertItemsEqual(align, gold["certain"])
+        self.assertSequenceEqual(dataset,
+                                 loadDataset((f, ), (e, ), alignFile, 3))
+        return
+
+    def testStreamBatches(self):
+        import StringIO
+        self.assertSequenceEqual(
+            parseStreamLine("a|X b|Y ||| c|Z\n"),
+            ([("a", "X"), ("b", "Y")], [("c", "Z")], []))
+        self.assertSequenceEqual(parseStreamLine(" ||| c"), ([], [("c", )],
+                                                              []))
+        self.assertRaises(ValueError, parseStreamLine, "a b c\n")
+        stream = StringIO.StringIO("".join(["w%d ||| v%d\n" % (i, i)
+                                            for i in range(7)]))
+        batches = list(iterStreamBatches(stream, 3))
+        self.assertSequenceEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertSequenceEqual(batches[2], [([("w6", )], [("v6", )], [])])
+        return
+
+    def testLineOffsets(self):
+        fileName = "support/ut_source.txt"
+        lines = open(fileName).readlines()
+        starts = [sum([len(line) for line in lines[:i]])
+                  for i in range(len(lines) + 1)]
+        self.assertSequenceEqual(
+            _lineOffsets((fileName, [0, 1, 5, 300, len(lines) + 3])),
+            [0, starts[1], starts[5], starts[300], starts[-1]])
+        offsets = _chunkOffsets(fileName, 7)
+        self.assertEqual(offsets[-1], starts[-1])
+        self.assertTrue(set(offsets).issubset(set(starts)))
+        self.assertEqual(sum([_countLines((fileName, offsets[i],
+                                           offsets[i + 1]))
+                              for i in range(len(offsets) - 1)]), len(lines))
+        return
+
+    def testLineIndex(self):
+        f = ("support/ut_source.txt", )
+        e = ("support/ut_target.txt", )
+        alignFile = "support/ut_align_no_type.a"
+        lines = open(f[0]).readlines()
+        starts = [0]
+        for line in lines:
+            starts.append(starts[-1] + len(line))
+        indexFiles = [lineIndexFile(fileName) for fileName in
+                      f + e + (alignFile, )]
+        try:
+            self.assertSequenceEqual(loadLineIndex(f[0]).tolist(), starts)
+            self.assertTrue(os.path.isfile(indexFiles[0]))
+            self.assertSequenceEqual(loadLineIndex(f[0]).tolist(), starts)
+            self.assertEqual(countLines(f[0]), len(lines))
+            dataset = loadDataset(f, e, alignFile)
+            alignment = list(loadAlignment(alignFile))
+            for start, end in ((0, 10), (17, 40), (len(dataset) - 3,
+                                                   len(dataset) + 5)):
+                self.assertSequenceEqual(
+                    list(iterDatasetRange(f, e, alignFile, start, end)),
+                    dataset[start:end])
+                self.assertSequenceEqual(
+                    list(loadAlignmentRange(alignFile, start, end)),
+                    alignment[start:end])
+            self.assertSequenceEqual(
+                [shardRange(10, shard, 3) for shard in range(3)],
+                [(0, 3), (3, 6), (6, 10)])
+        finally:
+            for indexFile in indexFiles:
+                if os.path.isfile(indexFile):
+                    os.remove(indexFile)
+        return
+
+    def testParallelLoad(self):
+        f = ("support/ut_source.txt", "support/ut_target.txt")
+        e = ("support/ut_target.txt", "support/ut_source.txt")
+        alignFile = "support/ut_align_no_type.a"
+        for linesToLoad in (sys.maxint, 100):
+            corpus = parallelLoadCorpus(f, e, alignFile, linesToLoad,
+                                        processes=3)
+            expected = internDataset(
+                iterDataset(f, e, alignFile, linesToLoad), 2)
+            self.assertEqual(len(corpus), len(expected))
+            self.assertSequenceEqual(corpus.fVocab, expected.fVocab)
+            self.assertSequenceEqual(corpus.eVocab, expected.eVocab)
+            self.assertSequenceEqual(corpus.fWords.tolist(),
+                                     expected.fWords.tolist())
+            self.assertSequenceEqual(corpus.eOffsets.tolist(),
+                                     expected.eOffsets.tolist())
+            self.assertSequenceEqual(corpus.alignment, expected.alignment)
+
+        for fileName in ("support/ut_align_no_tag.a", alignFile):
+            self.assertSequenceEqual(
+                list(parallelLoadAlignment(fileName, processes=3)),
+                list(loadAlignment(fileName)))
+        self.assertSequenceEqual(
+            list(parallelLoadAlignment(alignFile, 10, True, processes=3)),
+            list(loadAlignment(alignFile, 10, True)))
+        return
+
+    def testCompressedFiles(self):
+        global compressionThreads
+        f = "support/ut_source.txt"
+        e = "support/ut_target.txt"
+        alignFile = "support/ut_align_no_type.a"
+        expected = loadDataset((f, ), (e, ), alignFile)
+        alignment = [sentence["certain"] for sentence in
+                     loadAlignment(alignFile)]
+        extensions = [".gz", ".bz2"]
+        if lzma is not None or find_executable("xz"):
+            extensions.append(".xz")
+        for threads in (1, 4):
+            compressionThreads = threads
+            for extension in extensions:
+                names = [name + extension for name in (f, e, alignFile)]
+                try:
+                    for name, compressedName in zip((f, e, alignFile), names):
+                        output = openFile(compressedName, "w")
+                        output.write(open(name).read())
+                        output.close()
+                    self.assertSequenceEqual(
+                        loadDataset((names[0], ), (names[1], ), names[2]),
+                        expected)
+                    self.assertEqual(len(parallelLoadCorpus(
+                        (names[0], ), (names[1], ), names[2], processes=2)),
+                        len(expected))
+                    exportToFile(alignment, names[2])
+                    self.assertSequenceEqual(
+                        [sentence["certain"] for sentence in
+                         loadAlignment(names[2], 10)],
+                        alignment[:10])
+                finally:
+                    for name in names:
+                        if os.path.isfile(name):
+                            os.remove(name)
+        compressionThreads = 1
+        return
+
+    def testLoadCachedCorpus(self):
+        f = "support/ut_source.txt"
+        e = "support/ut_target.txt"
+        alignFile = "support/ut_align_no_type.a"
+        cacheFile = corpusCacheFile((f, ), (e, ), alignFile, 5)
+        self.assertNotEqual(cacheFile,
+                            corpusCacheFile((f, ), (e, ), alignFile, 5, True))
+        self.assertNotEqual(cacheFile,
+                            corpusCacheFile((f, ), (e, ), alignFile, 6))
+        try:
+            corpus = loadCachedCorpus((f, ), (e, ), alignFile, 5)
+            self.assertTrue(os.path.isfile(cacheFile))
+            cached = loadCachedCorpus((f, ), (e, ), alignFile, 5)
+            dataset = loadDataset((f, ), (e, ), alignFile, 5)
+            for corpus in (corpus, cached):
+                self.assertEqual(len(corpus), 5)
+                for (fIds, eIds, align), (fWords, eWords, gold) in\
+                        zip(corpus, dataset):
+                    self.assertSequenceEqual(
+                        [corpus.fVocab[0][i] for i in fIds[:, 0]],
+                        [word[0] for word in fWords])
+                    self.assertSequenceEqual(
+                        [corpus.eVocab[0][i] for i in eIds[:, 0]],
+                        [word[0] for word in eWords])
+                    self.assertSequenceEqual(align, gold)
+        finally:
+            if os.path.isfile(cacheFile):
+                os.remove(cacheFile)
+        return
+
 
 if __name__ == '__main__':
     unittest.main()
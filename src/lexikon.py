@@ -0,0 +1,578 @@
+# -*- coding: utf-8 -*-
+
+#
+# Lexikon of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the compact lexikon used by the models. All words are kept encoded
+# in UTF-8 in a single byte buffer, with an offset array marking where each
+# word starts; the position of a word in the buffer is its id. Lookups go
+# through a sorted array of 64-bit hashes of the words, which allows many
+# words to be looked up in one vectorised search. The words themselves are
+# compared after a hash match, so the lexikon is lossless even if hashes
+# collide.
+#
+# A Lexikon behaves like the list of words (fLex/eLex) it replaces, and its
+# index attribute behaves like the dict from words to ids (fIndex/eIndex).
+#
+# A HashedLexikon instead maps words into a fixed number of buckets by their
+# hashes, without storing the words at all, so that its size and the size of
+# all tables indexed by it do not grow with the vocabulary.
+#
+# The arrays of a Lexikon are written in the .npy format, either to a file of
+# their own (Lexikon.save) or within a model file (see saveModel of the
+# models), and can be memory-mapped from either when read back, so that
+# loading a large vocabulary costs next to nothing until it is used.
+#
+import os
+import zlib
+import json
+import unittest
+import numpy as np
+__version__ = "0.1a"
+
+_MAGIC = "HMM-ALIGNER-LEXIKON 0.1a\n"
+_HASHED_MAGIC = "HMM-ALIGNER-HASHED-LEXIKON 0.1a\n"
+
+
+def wordHash(word):
+    '''
+    Stable 64-bit hash of a word, built from its CRC32 and Adler-32 checksums.
+
+    @param word: str, UTF-8 encoded word
+    @return: int
+    '''
+    return ((zlib.crc32(word) & 0xffffffff) << 32) |\
+        (zlib.adler32(word) & 0xffffffff)
+
+
+def _encode(word):
+    if isinstance(word, unicode):
+        return word.encode('utf-8')
+    return word
+
+
+class Lexikon():
+    def __init__(self, words=()):
+        '''
+        @param words: list of str, the initial words, in the order of their
+            ids. Words must be distinct.
+        '''
+        self.buffer = np.zeros(0, dtype=np.uint8)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.hashIds = np.zeros(0, dtype=np.int64)
+        self.index = LexikonIndex(self)
+        if len(words) > 0:
+            self._append([_encode(word) for word in words])
+        return
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Lexikon index out of range")
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tostring()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        return {"buffer": np.asarray(self.buffer),
+                "offsets": np.asarray(self.offsets),
+                "hashes": np.asarray(self.hashes),
+                "hashIds": np.asarray(self.hashIds)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = LexikonIndex(self)
+        return
+
+    def lookup(self, words, default=-1):
+        '''
+        Look up the ids of many words at once. Each word is found with one
+        vectorised search of its hash, then checked against the word with
+        that hash, by length and then byte by byte, all with array
+        operations. Only words whose hash is shared by several words of the
+        lexikon are looked for one by one.
+
+        @param words: list of str, the words
+        @param default: int, the id given to words not in the lexikon
+        @return: np.ndarray of int64, the ids
+        '''
+        words = [_encode(word) for word in words]
+        ids = np.full(len(words), default, dtype=np.int64)
+        if len(words) == 0 or len(self) == 0:
+            return ids
+        hashes, hashIds, offsets = self.hashes, self.hashIds, self.offsets
+        queries = np.array([wordHash(word) for word in words],
+                           dtype=np.uint64)
+        positions = np.minimum(np.searchsorted(hashes, queries),
+                               len(hashes) - 1)
+        hit = hashes[positions] == queries
+        candidates = hashIds[positions]
+        lengths = np.array([len(word) for word in words], dtype=np.int64)
+        match = hit & (offsets[candidates + 1] - offsets[candidates] ==
+                       lengths)
+
+        # Compare the bytes of the candidates of the same length
+        compared = np.nonzero(match & (lengths > 0))[0]
+        if len(compared) > 0:
+            comparedLengths = lengths[compared]
+            ends = np.cumsum(comparedLengths)
+            begins = ends - comparedLengths
+            gather = np.arange(ends[-1]) + np.repeat(
+                offsets[candidates[compared]] - begins, comparedLengths)
+            queryBytes = np.frombuffer(
+                "".join([words[k] for k in compared.tolist()]),
+                dtype=np.uint8)
+            differences = np.add.reduceat(
+                (self.buffer[gather] != queryBytes).astype(np.int64), begins)
+            match[compared[differences > 0]] = False
+        ids[match] = candidates[match]
+
+        # The word may still be further on when its hash is shared
+        shared = hit & ~match
+        shared[shared] = (positions[shared] + 1 < len(hashes)) &\
+            (hashes[np.minimum(positions[shared] + 1, len(hashes) - 1)] ==
+             queries[shared])
+        for k in np.nonzero(shared)[0].tolist():
+            ids[k] = self._scan(words[k], int(queries[k]),
+                                int(positions[k]) + 1, default)
+        return ids
+
+    def lookupWord(self, word, default=-1):
+        '''
+        Look up the id of a single word, faster than lookup for one word.
+
+        @param word: str, the word
+        @param default: int, the id given if the word is not in the lexikon
+        @return: int, the id
+        '''
+        word = _encode(word)
+        query = wordHash(word)
+        position = int(self.hashes.searchsorted(np.uint64(query)))
+        return self._scan(word, query, position, default)
+
+    def _scan(self, word, query, position, default):
+        # Check the words of the hashes equal to query from position on
+        hashes, hashIds, offsets = self.hashes, self.hashIds, self.offsets
+        while position < len(hashes) and int(hashes[position]) == query:
+            i = int(hashIds[position])
+            if self.buffer[offsets[i]:offsets[i + 1]].tostring() == word:
+                return i
+            position += 1
+        return default
+
+    def extend(self, words):
+        '''
+        Look up the ids of many words at once, adding the ones not yet in the
+        lexikon. New words are given ids in the order they first appear.
+
+        @param words: list of str, the words
+        @return: np.ndarray of int64, the ids
+        '''
+        words = [_encode(word) for word in words]
+        ids = self.lookup(words)
+        newIds = {}
+        newWords = []
+        for k in np.nonzero(ids < 0)[0].tolist():
+            if words[k] not in newIds:
+                newIds[words[k]] = len(self) + len(newWords)
+                newWords.append(words[k])
+            ids[k] = newIds[words[k]]
+        self._append(newWords)
+        return ids
+
+    def append(self, word):
+        '''
+        Add a single word to the lexikon. Prefer extend for many words, as the
+        hash index is rebuilt on every call.
+
+        @param word: str, the word, which must not be in the lexikon yet
+        '''
+        self._append([_encode(word)])
+        return
+
+    def _append(self, words):
+        if len(words) == 0:
+            return
+        first = len(self)
+        lengths = np.array([len(word) for word in words], dtype=np.int64)
+        newBuffer = np.frombuffer("".join(words), dtype=np.uint8)
+        self.buffer = np.concatenate((self.buffer, newBuffer))
+        self.offsets = np.concatenate(
+            (self.offsets, self.offsets[-1] + np.cumsum(lengths)))
+        hashes = np.concatenate(
+            (self.hashes,
+             np.array([wordHash(word) for word in words], dtype=np.uint64)))
+        hashIds = np.concatenate(
+            (self.hashIds, np.arange(first, first + len(words))))
+        order = np.argsort(hashes, kind='mergesort')
+        self.hashes = hashes[order]
+        self.hashIds = hashIds[order]
+        return
+
+    def nbytes(self):
+        '''
+        @return: int, memory used by the lexikon in bytes.
+        '''
+        return (self.buffer.nbytes + self.offsets.nbytes +
+                self.hashes.nbytes + self.hashIds.nbytes)
+
+    def save(self, fileName):
+        '''
+        Save the lexikon to a file that can be memory-mapped by loadLexikon.
+
+        @param fileName: str, the file to write to
+        '''
+        output = open(os.path.expanduser(fileName), 'wb')
+        output.write(_MAGIC)
+        self.writeArrays(output)
+        output.close()
+        return
+
+    def writeArrays(self, output):
+        '''
+        Write the arrays of the lexikon at the current position of a file,
+        to be read back by readLexikon.
+
+        @param output: file, or file-like object, opened for writing
+        '''
+        for component in (self.buffer, self.offsets,
+                          self.hashes, self.hashIds):
+            np.lib.format.write_array(output, np.ascontiguousarray(component))
+        return
+
+
+class HashedLexikon(Lexikon):
+    def __init__(self, buckets):
+        '''
+        @param buckets: int, the number of buckets, which is also the number of
+            ids of this lexikon.
+        '''
+        self.buckets = buckets
+        self.used = np.zeros(buckets, dtype=np.bool_)
+        self.statistics = {}
+        self.index = LexikonIndex(self)
+        return
+
+    def __len__(self):
+        return self.buckets
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Lexikon index out of range")
+        return "#" + str(i)
+
+    def __getstate__(self):
+        return {"buckets": self.buckets,
+                "used": np.asarray(self.used),
+                "statistics": self.statistics}
+
+    def lookupWord(self, word, default=-1):
+        '''
+        Every word has a bucket, so default is never used.
+
+        @param word: str, the word
+        @param default: int, not used
+        @return: int, the id
+        '''
+        return int(wordHash(_encode(word)) % self.buckets)
+
+    def lookup(self, words, default=-1):
+        '''
+        Every word has a bucket, so default is never used.
+
+        @param words: list of str, the words
+        @param default: int, not used
+        @return: np.ndarray of int64, the ids
+        '''
+        hashes = np.array([wordHash(_encode(word)) for word in words],
+                          dtype=np.uint64)
+        return (hashes % np.uint64(self.buckets)).astype(np.int64)
+
+    def extend(self, words):
+        '''
+        Look up the ids of many words at once, collecting collision statistics
+        of the distinct words given, see collisionStatistics.
+
+        @param words: list of str, the words
+        @return: np.ndarray of int64, the ids
+        '''
+        ids = self.lookup(words)
+        distinct = np.unique(np.array([wordHash(_encode(word))
+                                       for word in set(words)],
+                                      dtype=np.uint64))
+        wordsPerBucket = np.bincount(
+            (distinct % np.uint64(self.buckets)).astype(np.int64),
+            minlength=self.buckets)
+        self.used[wordsPerBucket > 0] = True
+        self.statistics = {
+            "words": len(distinct),
+            "buckets": self.buckets,
+            "bucketsUsed": int(np.count_nonzero(wordsPerBucket)),
+            "collidingWords": int(wordsPerBucket[wordsPerBucket > 1].sum()),
+            "maxWordsPerBucket": int(wordsPerBucket.max())
+            if len(wordsPerBucket) > 0 else 0,
+            "totalBucketsUsed": int(np.count_nonzero(self.used))
+        }
+        return ids
+
+    def append(self, word):
+        return
+
+    def collisionStatistics(self):
+        '''
+        Describe how the distinct words given to the last call of extend were
+        spread over the buckets.
+
+        @return: str
+        '''
+        if not self.statistics:
+            return "no words hashed yet"
+        stats = self.statistics
+        return ("%d distinct words in %d of %d buckets, %d words (%.2f%%) "
+                "share a bucket, at most %d words per bucket, %d buckets "
+                "used in total" %
+                (stats["words"], stats["bucketsUsed"], stats["buckets"],
+                 stats["collidingWords"],
+                 100. * stats["collidingWords"] / max(stats["words"], 1),
+                 stats["maxWordsPerBucket"], stats["totalBucketsUsed"]))
+
+    def nbytes(self):
+        return self.used.nbytes
+
+    def save(self, fileName):
+        '''
+        Save the lexikon to a file that can be loaded by loadLexikon. The
+        buckets used are always read, not memory-mapped, as extend updates
+        them.
+
+        @param fileName: str, the file to write to
+        '''
+        output = open(os.path.expanduser(fileName), 'wb')
+        output.write(_HASHED_MAGIC)
+        output.write(json.dumps(self.statistics) + "\n")
+        np.lib.format.write_array(output, np.ascontiguousarray(self.used))
+        output.close()
+        return
+
+
+class LexikonIndex():
+    def __init__(self, lexikon):
+        '''
+        The dict-like side of a Lexikon, mapping words to their ids. It holds
+        no data of its own and is not saved with the lexikon; see
+        AlignmentModelBase.loadModel for how it is linked back after loading.
+
+        @param lexikon: Lexikon
+        '''
+        self.lexikon = lexikon
+        return
+
+    def __len__(self):
+        return len(self.lexikon)
+
+    def __contains__(self, word):
+        return self.lexikon.lookupWord(word) >= 0
+
+    def __getitem__(self, word):
+        i = self.lexikon.lookupWord(word)
+        if i < 0:
+            raise KeyError(word)
+        return i
+
+    def get(self, word, default=None):
+        i = self.lexikon.lookupWord(word)
+        if i < 0:
+            return default
+        return i
+
+    def __getstate__(self):
+        return {}
+
+
+def readLexikon(lexikonFile, fileName=None):
+    '''
+    Read a lexikon written by Lexikon.writeArrays, from the current position
+    of a file, leaving the file just after it.
+
+    @param lexikonFile: file, or file-like object such as a GzipFile
+    @param fileName: str, the name of lexikonFile, to memory-map the arrays
+        from it instead of reading them. lexikonFile must then be a plain
+        file, whose current position is its position on disk.
+    @return: Lexikon
+    '''
+    components = []
+    for i in range(4):
+        if fileName is None:
+            components.append(np.lib.format.read_array(lexikonFile))
+            continue
+        version = np.lib.format.read_magic(lexikonFile)
+        if version == (1, 0):
+            shape, fortran, dtype = \
+                np.lib.format.read_array_header_1_0(lexikonFile)
+        else:
+            shape, fortran, dtype = \
+                np.lib.format.read_array_header_2_0(lexikonFile)
+        offset = lexikonFile.tell()
+        size = int(np.prod(shape)) * dtype.itemsize
+        if size == 0:
+            components.append(np.zeros(shape, dtype=dtype))
+        else:
+            components.append(np.memmap(fileName, dtype=dtype, mode='r',
+                                        offset=offset, shape=shape))
+        lexikonFile.seek(offset + size)
+    lexikon = Lexikon()
+    lexikon.buffer, lexikon.offsets, lexikon.hashes, lexikon.hashIds =\
+        components
+    return lexikon
+
+
+def loadLexikon(fileName, mmap=True):
+    '''
+    Load a lexikon saved with Lexikon.save or HashedLexikon.save.
+
+    @param fileName: str, the file to read
+    @param mmap: bool, memory-map the arrays instead of reading them
+    @return: Lexikon or HashedLexikon
+    '''
+    fileName = os.path.expanduser(fileName)
+    lexikonFile = open(fileName, 'rb')
+    magic = lexikonFile.readline()
+    if magic == _MAGIC:
+        lexikon = readLexikon(lexikonFile, fileName if mmap else None)
+    elif magic == _HASHED_MAGIC:
+        statistics = json.loads(lexikonFile.readline())
+        used = np.lib.format.read_array(lexikonFile)
+        lexikon = HashedLexikon(len(used))
+        lexikon.used = used
+        lexikon.statistics = statistics
+    else:
+        lexikonFile.close()
+        raise RuntimeError("Incorrect lexikon file format")
+    lexikonFile.close()
+    return lexikon
+
+
+class TestLexikon(unittest.TestCase):
+    words = ["the", "cat", "pan-green", "支持", "", "cats"]
+
+    def testListAndIndex(self):
+        lexikon = Lexikon(self.words)
+        self.assertEqual(len(lexikon), len(self.words))
+        self.assertSequenceEqual(list(lexikon), self.words)
+        self.assertEqual(lexikon[-1], "cats")
+        for i, word in enumerate(self.words):
+            self.assertIn(word, lexikon.index)
+            self.assertEqual(lexikon.index[word], i)
+        self.assertNotIn("dog", lexikon.index)
+        self.assertEqual(lexikon.index.get("dog", 42), 42)
+        self.assertRaises(KeyError, lambda: lexikon.index["dog"])
+        return
+
+    def testExtend(self):
+        lexikon = Lexikon(self.words[:2])
+        ids = lexikon.extend(["dog", "the", "dog", "cat", "bird"])
+        self.assertSequenceEqual(ids.tolist(), [2, 0, 2, 1, 3])
+        self.assertSequenceEqual(list(lexikon), ["the", "cat", "dog", "bird"])
+        self.assertSequenceEqual(
+            lexikon.lookup(["bird", "fish", "the"]).tolist(), [3, -1, 0])
+        return
+
+    def testHashCollision(self):
+        lexikon = Lexikon(self.words)
+        # Force every word into the same hash bucket
+        lexikon.hashes[:] = 0
+        global wordHash
+        originalHash = wordHash
+        wordHash = lambda word: 0
+        try:
+            self.assertSequenceEqual(
+                lexikon.lookup(self.words + ["dog"]).tolist(),
+                range(len(self.words)) + [-1])
+        finally:
+            wordHash = originalHash
+        return
+
+    def testLookupMatchesDict(self):
+        global wordHash
+        words = self.words + ["ca", "tac", "act", "a" * 300, "cat\x00"]
+        queries = words + ["dog", "ct", "tca", "a" * 299, "cat\x01", ""]
+        originalHash = wordHash
+        # Real hashes, then hashes shared by all the words of each length
+        for hashFunction in (originalHash, lambda word: len(word) % 3):
+            wordHash = hashFunction
+            try:
+                lexikon = Lexikon(words)
+                expected = [words.index(word) if word in words else -7
+                            for word in queries]
+                self.assertSequenceEqual(
+                    lexikon.lookup(queries, -7).tolist(), expected)
+                self.assertSequenceEqual(
+                    [lexikon.lookupWord(word, -7) for word in queries],
+                    expected)
+            finally:
+                wordHash = originalHash
+        return
+
+    def testHashedLexikon(self):
+        lexikon = HashedLexikon(4)
+        self.assertEqual(len(lexikon), 4)
+        ids = lexikon.extend(self.words + ["the"])
+        self.assertTrue((ids >= 0).all() and (ids < 4).all())
+        self.assertEqual(ids[0], ids[-1])
+        self.assertEqual(lexikon.statistics["words"], len(self.words))
+        self.assertGreater(lexikon.statistics["collidingWords"], 0)
+        self.assertEqual(lexikon.index["unseen"],
+                         lexikon.lookup(["unseen"])[0])
+        self.assertIn("unseen", lexikon.index)
+
+        import cPickle as pickle
+        loaded = pickle.loads(pickle.dumps(lexikon, 2))
+        self.assertIsInstance(loaded, HashedLexikon)
+        self.assertSequenceEqual(loaded.lookup(self.words).tolist(),
+                                 ids[:-1].tolist())
+
+        fileName = "support/ut_lexikon.lex"
+        lexikon.save(fileName)
+        loaded = loadLexikon(fileName)
+        os.remove(fileName)
+        self.assertIsInstance(loaded, HashedLexikon)
+        self.assertEqual(len(loaded), 4)
+        self.assertSequenceEqual(loaded.used.tolist(), lexikon.used.tolist())
+        self.assertEqual(loaded.collisionStatistics(),
+                         lexikon.collisionStatistics())
+        self.assertSequenceEqual(loaded.extend(self.words).tolist(),
+                                 ids[:-1].tolist())
+        return
+
+    def testPickleAndSave(self):
+        import cPickle as pickle
+        lexikon = Lexikon(self.words)
+        loaded = pickle.loads(pickle.dumps(lexikon, 2))
+        self.assertSequenceEqual(list(loaded), self.words)
+        self.assertEqual(loaded.index["cats"], 5)
+
+        fileName = "support/ut_lexikon.lex"
+        lexikon.save(fileName)
+        for mmap in (True, False):
+            loaded = loadLexikon(fileName, mmap)
+            self.assertSequenceEqual(list(loaded), self.words)
+            self.assertEqual(loaded.index["支持"], 3)
+            loaded.extend(["dog"])
+            self.assertEqual(loaded.index["dog"], 6)
+        os.remove(fileName)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,6 @@
 import numpy as np
 from collections import defaultdict
 from loggers import logging
-from models.IBM1 import AlignmentModel as AlignerIBM1
 from models.HMMBase import AlignmentModelBase as Base
 from evaluators.evaluator import evaluate
 __version__ = "0.5a"
@@ -20,7 +19,7 @@ __version__ = "0.5a"
 class AlignmentModel(Base):
     def __init__(self):
         self.modelName = "HMM"
-        self.version = "0.4b"
+        self.version = "0.5a"
         self.logger = logging.getLogger('HMM')
         self.p0H = 0.3
         self.nullEmissionProb = 0.000005
@@ -28,7 +27,7 @@ class AlignmentModel(Base):
         self.evaluate = evaluate
         self.fLex = self.eLex = self.fIndex = self.eIndex = None
 
-        self.modelComponents = ["t", "pi", "a", "eLengthSet",
+        self.modelComponents = ["t", "pi", "rawA", "eLengthSet",
                                 "fLex", "eLex", "fIndex", "eIndex"]
         Base.__init__(self)
         return
@@ -44,11 +43,12 @@ class AlignmentModel(Base):
     def EStepGamma(self, f, e, gamma, index):
         fLen = len(f)
         eLen = len(e)
-        fWords = np.array([f[i][index] for i in range(fLen)])
-        eWords = np.array([e[j][index] for j in range(eLen)])
+        fWords = f[:, index].tolist()
+        eWords = e[:, index]
+        eIds = eWords.tolist()
         for i in range(fLen):
             for j in range(eLen):
-                self.gammaBiword[fWords[i]][eWords[j]] += gamma[i][j]
+                self.gammaBiword[fWords[i]][eIds[j]] += gamma[i][j]
         self.gammaSum_0[:eLen] += gamma[0]
 
         eDupli = (eWords[:, np.newaxis] == eWords).sum(axis=0)
@@ -57,7 +57,7 @@ class AlignmentModel(Base):
 
     def MStepDelta(self, maxE, index):
         # Update a
-        for Len in self.eLengthSet:
+        for Len in self.datasetLengths:
             deltaSum = np.sum(self.delta[Len], axis=1) + 1e-37
             for prev_j in range(Len):
                 self.a[Len][prev_j][:Len] =\
@@ -74,29 +74,26 @@ class AlignmentModel(Base):
         return
 
     def endOfBaumWelch(self, index):
-        # Smoothing for target sentences of unencountered length
-        for targetLen in self.eLengthSet:
-            a = self.a[targetLen]
-            for prev_j in range(targetLen):
-                for j in range(targetLen):
-                    a[prev_j][j] *= 1 - self.p0H
-        for targetLen in self.eLengthSet:
-            a = self.a[targetLen]
-            for prev_j in range(targetLen):
-                for j in range(targetLen):
-                    a[prev_j][prev_j + targetLen] = self.p0H
-                    a[prev_j + targetLen][prev_j + targetLen] = self.p0H
-                    a[prev_j + targetLen][j] = a[prev_j][j]
+        # The raw estimates are kept, the NULL smoothing goes to a copy
+        self.rawA = self.a
+        self.smoothTransition()
         return
 
     def train(self, dataset, iterations):
         dataset = self.initialiseLexikon(dataset)
         self.logger.info("Training IBM model 1")
-        alignerIBM1 = AlignerIBM1()
-        alignerIBM1.sharedLexikon(self)
-        alignerIBM1.initialiseBiwordCount(dataset)
-        alignerIBM1.EM(dataset, iterations)
-        self.t = alignerIBM1.t
+        self.t = self.initialT(dataset, iterations)
         self.logger.info("IBM model Trained")
         self.baumWelch(dataset, iterations=iterations)
         return
+
+    def continueTraining(self, dataset, iterations=5):
+        '''
+        Continue training a loaded model on new data. The lexikon and the
+        translation probabilities are extended with the new words, and
+        Baum-Welch starts from the probabilities trained before.
+        '''
+        dataset = self.extendLexikon(dataset)
+        self.initialiseBiwordCount(dataset)
+        self.baumWelch(dataset, iterations=iterations, extend=True)
+        return
@@ -15,8 +15,8 @@ from collections import defaultdict
 from copy import deepcopy
 
 from loggers import logging
-from models.IBM1 import AlignmentModel as AlignerIBM1
 from models.HMM import AlignmentModel as HMM
+from models.modelBase import wordColumn
 from evaluators.evaluator import evaluate
 __version__ = "0.5a"
 
@@ -25,7 +25,7 @@ class AlignmentModel(HMM):
     def __init__(self):
         HMM.__init__(self)
         self.modelName = "HMMWithAlignmentType"
-        self.version = "0.4b"
+        self.version = "0.5a"
 
         self.s = []
         self.sTag = []
@@ -33,6 +33,8 @@ class AlignmentModel(HMM):
         self.typeList = []
         self.typeIndex = {}
         self.typeDist = []
+        # The IBM model 1 is trained on POS tags, then on FORM
+        self.ibm1Indices = [1, 0]
         self.lambd = 1 - 1e-20
         self.lambda1 = 0.9999999999
         self.lambda2 = 9.999900827395436E-11
@@ -43,10 +45,12 @@ class AlignmentModel(HMM):
                              "GIF": .031, "COI": .008, "TIN": .003,
                              "NTR": .086, "MTA": .002}
 
-        self.modelComponents = ["t", "pi", "a", "eLengthSet", "s", "sTag",
+        self.modelComponents = ["t", "pi", "rawA", "eLengthSet", "s", "sTag",
                                 "typeList", "typeIndex", "typeDist",
                                 "fLex", "eLex", "fIndex", "eIndex",
                                 "lambd", "lambda1", "lambda2", "lambda3"]
+        self.countComponents = ["gammaEWord", "gammaBiword", "gammaSum_0",
+                                "delta", "c_feh"]
         return
 
     def _beginningOfIteration(self, dataset, maxE, index):
@@ -58,9 +62,11 @@ class AlignmentModel(HMM):
     def EStepGamma(self, f, e, gamma, index):
         HMM.EStepGamma(self, f, e, gamma, index)
         score = self.sProbability(f, e, index) * gamma[:, :, None]
+        fWords = f[:, index].tolist()
+        eWords = e[:, index].tolist()
         for i in range(len(f)):
             for j in range(len(e)):
-                self.c_feh[f[i][index]][e[j][index]] += score[i][j]
+                self.c_feh[fWords[i]][eWords[j]] += score[i][j]
         return
 
     def MStepGamma(self, maxE, index):
@@ -77,18 +83,23 @@ class AlignmentModel(HMM):
 
     def sProbability(self, f, e, index=0):
         sTag = np.tile((1 - self.lambd) * self.typeDist, (len(f), len(e), 1))
+        fTags = wordColumn(f, 1)
+        eTags = wordColumn(e, 1)
         for j in range(len(e)):
             for i in range(len(f)):
-                if f[i][1] < len(self.sTag) and e[j][1] in self.sTag[f[i][1]]:
-                    sTag[i][j] += self.lambd * self.sTag[f[i][1]][e[j][1]]
+                if fTags[i] < len(self.sTag) and \
+                        eTags[j] in self.sTag[fTags[i]]:
+                    sTag[i][j] += self.lambd * self.sTag[fTags[i]][eTags[j]]
         if index == 1:
             return sTag
 
         s = np.tile((1 - self.lambd) * self.typeDist, (len(f), len(e), 1))
+        fWords = wordColumn(f, 0)
+        eWords = wordColumn(e, 0)
         for j in range(len(e)):
             for i in range(len(f)):
-                if f[i][0] < len(self.s) and e[j][0] in self.s[f[i][0]]:
-                    s[i][j] += self.lambd * self.s[f[i][0]][e[j][0]]
+                if fWords[i] < len(self.s) and eWords[j] in self.s[fWords[i]]:
+                    s[i][j] += self.lambd * self.s[fWords[i]][eWords[j]]
 
         return (self.lambda1 * s +
                 self.lambda2 * sTag +
@@ -96,10 +107,7 @@ class AlignmentModel(HMM):
 
     def trainWithIndex(self, dataset, iterations, index):
         self.index = index
-        alignerIBM1 = AlignerIBM1()
-        alignerIBM1.sharedLexikon(self)
-        alignerIBM1.initialiseBiwordCount(dataset, index)
-        alignerIBM1.EM(dataset, iterations, index)
+        t = self.initialT(dataset, iterations, index)
         self.logger.info("IBM model Trained")
 
         self.logger.info("Initialising HMM")
@@ -108,7 +116,7 @@ class AlignmentModel(HMM):
             self.sTag = self.calculateS(dataset, index)
         else:
             self.s = self.calculateS(dataset, index)
-        self.t = alignerIBM1.t
+        self.t = t
         self.logger.info("HMM Initialised, start training")
         self.baumWelch(dataset, iterations=iterations, index=index)
         return
@@ -128,13 +136,31 @@ class AlignmentModel(HMM):
         self.logger.info("Training Complete")
         return
 
+    def continueTraining(self, dataset, iterations=5):
+        '''
+        Continue training a loaded model on new data, on FORM as in stage 2.
+        The lexikon and the tables are extended with the new words, and the
+        alignment types stay those of the model. Baum-Welch starts from the
+        probabilities trained before, and the word pairs absent from the new
+        data keep theirs.
+        '''
+        dataset = self.extendLexikon(dataset)
+        self.logger.info("Extending model with the new data")
+        self.index = 0
+        self.initialiseBiwordCount(dataset, 0)
+        self.sTag = self.calculateS(dataset, 1, self.sTag)
+        s = self.s = self.calculateS(dataset, 0, self.s)
+        self.baumWelch(dataset, iterations=iterations, index=0, extend=True)
+        self.s = self.updateTable(s, self.s)
+        return
+
     def logViterbi(self, f, e):
-        e = deepcopy(e)
         with np.errstate(invalid='ignore', divide='ignore'):
             a = np.log(self.aProbability(f, e))
         fLen, eLen = len(f), len(e)
-        for i in range(eLen):
-            e.append((424242424243, 424242424243))
+        # e could be a view of a Corpus, so NULL words go to a new array
+        e = np.asarray(e)
+        e = np.concatenate((e, np.full(e.shape, 424242424243, dtype=np.int64)))
         score = np.zeros((fLen, eLen * 2))
         prev_j = np.zeros((fLen, eLen * 2))
         s = self.sProbability(f, e)
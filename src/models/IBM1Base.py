@@ -12,6 +12,7 @@ import numpy as np
 from copy import deepcopy
 from loggers import logging
 from models.modelBase import AlignmentModelBase as Base
+from models.modelBase import wordColumn
 __version__ = "0.5a"
 
 
@@ -22,18 +23,22 @@ class AlignmentModelBase(Base):
             self.logger = logging.getLogger('IBM1BASE')
         if "modelComponents" not in vars(self):
             self.modelComponents = ["t", "fLex", "eLex", "fIndex", "eIndex"]
+        if "countComponents" not in vars(self):
+            self.countComponents = ["c", "total"]
         Base.__init__(self)
         return
 
     def tProbability(self, f, e, index=0):
         t = np.zeros((len(f), len(e)))
+        fWords = wordColumn(f, index)
+        eWords = wordColumn(e, index)
         for j in range(len(e)):
-            if e[j][index] >= len(self.eLex[index]):
+            if eWords[j] >= len(self.eLex[index]):
                 continue
             for i in range(len(f)):
-                if f[i][index] < len(self.t) and \
-                        e[j][index] in self.t[f[i][index]]:
-                    t[i][j] = self.t[f[i][index]][e[j][index]]
+                if fWords[i] < len(self.t) and \
+                        eWords[j] in self.t[fWords[i]]:
+                    t[i][j] = self.t[fWords[i]][eWords[j]]
         t[t == 0] = 0.000006123586217
         return t
 
@@ -43,15 +48,8 @@ class AlignmentModelBase(Base):
         start_time = time.time()
 
         for iteration in range(iterations):
-            self._beginningOfIteration(index)
             self.logger.info("Starting Iteration " + str(iteration))
-            counter = 0
-
-            for item in dataset:
-                f, e = item[0:2]
-                counter += 1
-                self._updateCount(f, e, index)
-
+            self.EStep(dataset, index)
             self._updateEndOfIteration(index)
 
         end_time = time.time()
@@ -60,6 +58,22 @@ class AlignmentModelBase(Base):
         self.endOfEM()
         return
 
+    def EStep(self, dataset, index=0):
+        '''
+        Collect the counts of an iteration of EM over a dataset, from scratch.
+        They are kept in the attributes named in self.countComponents, for
+        _updateEndOfIteration to estimate the new parameters from.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @return: Nothing
+        '''
+        self._beginningOfIteration(index)
+        for item in dataset:
+            f, e = item[0:2]
+            self._updateCount(f, e, index)
+        return
+
     def decodeSentence(self, sentence):
         # This is the standard sentence decoder for IBM model 1
         # What happens there is that for every source f word, we find the
@@ -8,18 +8,48 @@
 # This is the base model for HMM
 #
 import cython
+import os
 import sys
+import inspect
 import time
+import hashlib
+import unittest
 import numpy as np
 from math import log
 from collections import defaultdict
 from copy import deepcopy
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
 
 from loggers import logging
 from models.cModelBase import AlignmentModelBase as Base
+from models.cModelBase import wordColumn, saveTranslationTable,\
+    loadTranslationTable
+from lexikon import HashedLexikon
+from models.cIBM1 import AlignmentModel as AlignerIBM1
 from evaluators.evaluator import evaluate
 __version__ = "0.5a"
 
+# Versions of the HMM models whose files keep the transition
+# probabilities with the NULL smoothing applied, see endOfLoading
+_smoothedVersions = ("0.4b", )
+
+
+def _lexikonMap(source, target):
+    # The id in the target Lexikon of each word of the source one, -1 for
+    # the words it doesn't have. The words of HashedLexikons are not kept,
+    # their ids are only the same with the same number of buckets.
+    if isinstance(source, HashedLexikon) or isinstance(target, HashedLexikon):
+        if isinstance(source, HashedLexikon) and\
+                isinstance(target, HashedLexikon) and\
+                len(source) == len(target):
+            return np.arange(len(source))
+        raise ValueError("Lexikons using hashes only match lexikons with " +
+                         "as many buckets")
+    return target.lookup(list(source), -1)
+
 
 @cython.boundscheck(False)
 class AlignmentModelBase(Base):
@@ -33,17 +63,154 @@ class AlignmentModelBase(Base):
             self.eLengthSet = {}
         if "a" not in vars(self):
             self.a = [[[]]]
+        if "rawA" not in vars(self):
+            self.rawA = [[[]]]
+        if "p0H" not in vars(self):
+            self.p0H = 0.3
+        # The p0H that self.a is smoothed with, see smoothTransition
+        if "smoothedP0H" not in vars(self):
+            self.smoothedP0H = None
         if "pi" not in vars(self):
             self.pi = []
+        if "ibm1Models" not in vars(self):
+            self.ibm1Models = None
+        if "ibm1Indices" not in vars(self):
+            self.ibm1Indices = [0]
+        if "ibm1CacheDir" not in vars(self):
+            self.ibm1CacheDir = ""
+        if "ibm1File" not in vars(self):
+            self.ibm1File = ""
 
         if "logger" not in vars(self):
             self.logger = logging.getLogger('HMMBASE')
         if "modelComponents" not in vars(self):
-            self.modelComponents = ["t", "pi", "a", "eLengthSet",
+            self.modelComponents = ["t", "pi", "rawA", "eLengthSet",
                                     "fLex", "eLex", "fIndex", "eIndex"]
+        if "countComponents" not in vars(self):
+            self.countComponents = ["gammaEWord", "gammaBiword", "gammaSum_0",
+                                    "delta"]
         Base.__init__(self)
         return
 
+    def trainIBM1(self, dataset, iterations, index=0):
+        '''
+        Train the IBM model 1 the HMM starts from, on a factor of the dataset.
+        When self.ibm1Models is a dict, shared by models using the same
+        lexikon, an IBM model 1 trained before on the same factor for as many
+        iterations is taken from it instead, and a new one is put in it.
+        With self.ibm1File set, the FORM translation probabilities are taken
+        from the IBM model 1 saved in that file rather than trained. Otherwise,
+        with self.ibm1CacheDir set, they are read from the cache file of the
+        dataset in that directory (see ibm1CacheFile) if there is one, and
+        saved there once trained if not.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param iterations: int. The number of iterations of EM
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @return: the IBM1 AlignmentModel
+        '''
+        key = (AlignerIBM1, index, iterations)
+        if self.ibm1Models is not None and key in self.ibm1Models:
+            self.logger.info("Using the IBM model 1 trained before")
+            return self.ibm1Models[key]
+        alignerIBM1 = AlignerIBM1()
+        alignerIBM1.sharedLexikon(self)
+        if index == 0 and self.ibm1File != "":
+            alignerIBM1.initialiseBiwordCount(dataset, index)
+            self._loadIBM1(alignerIBM1, self.ibm1File)
+        else:
+            cacheFile = t = None
+            if self.ibm1CacheDir != "":
+                cacheFile = self.ibm1CacheFile(dataset, iterations, index)
+            if cacheFile is not None and os.path.isfile(cacheFile):
+                try:
+                    t = loadTranslationTable(cacheFile)
+                    self.logger.info("IBM model 1 loaded from cache " +
+                                     cacheFile)
+                except (IOError, ValueError, KeyError) as e:
+                    self.logger.warning("Unable to load IBM model 1 cache " +
+                                        cacheFile + ": " + str(e) +
+                                        ", training it again")
+            if t is not None:
+                alignerIBM1.t = t
+            else:
+                alignerIBM1.initialiseBiwordCount(dataset, index)
+                alignerIBM1.EM(dataset, iterations, index)
+            if t is None and cacheFile is not None:
+                try:
+                    if not os.path.isdir(self.ibm1CacheDir):
+                        os.makedirs(self.ibm1CacheDir)
+                    saveTranslationTable(alignerIBM1.t, cacheFile)
+                    self.logger.info("IBM model 1 cache saved to " +
+                                     cacheFile)
+                except (IOError, OSError) as e:
+                    self.logger.warning("Unable to save IBM model 1 cache " +
+                                        cacheFile + ": " + str(e))
+        if self.ibm1Models is not None:
+            self.ibm1Models[key] = alignerIBM1
+        return alignerIBM1
+
+    def ibm1CacheFile(self, dataset, iterations, index=0):
+        '''
+        The name of the file in self.ibm1CacheDir keeping the translation
+        probabilities of the IBM model 1 trained by trainIBM1. They only
+        depend on the ids of the factor in the dataset, the sizes of the
+        lexikons and the number of iterations, so the name contains a
+        fingerprint of these, and of the version of the IBM model 1.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param iterations: int. The number of iterations of EM
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @return: str, the name of the cache file
+        '''
+        alignerIBM1 = AlignerIBM1()
+        fingerprint = hashlib.sha1(repr([
+            alignerIBM1.modelName, alignerIBM1.version, index, iterations,
+            len(self.fLex[index]), len(self.eLex[index])]))
+        for words, offsets in ((dataset.fWords, dataset.fOffsets),
+                               (dataset.eWords, dataset.eOffsets)):
+            fingerprint.update(
+                np.ascontiguousarray(words[index], dtype=np.int64).tostring())
+            fingerprint.update(
+                np.ascontiguousarray(offsets, dtype=np.int64).tostring())
+        return os.path.join(os.path.expanduser(self.ibm1CacheDir),
+                            "ibm1." + fingerprint.hexdigest()[:16] + ".npz")
+
+    def _loadIBM1(self, alignerIBM1, fileName):
+        # The saved model has a lexikon of its own, its ids are mapped to
+        # those of this model through the words. The word pairs of the
+        # dataset it doesn't know keep the values of initialiseBiwordCount.
+        self.logger.info("Loading IBM model 1 from " + fileName)
+        saved = AlignerIBM1()
+        saved.loadModel(fileName)
+        saved.compactLexikon(1)
+        fIds = _lexikonMap(saved.fLex[0], self.fLex[0]).tolist()
+        eIds = _lexikonMap(saved.eLex[0], self.eLex[0]).tolist()
+        t = alignerIBM1.t
+        pairs = 0
+        for f, row in enumerate(saved.t):
+            if f >= len(fIds) or fIds[f] < 0:
+                continue
+            tRow = t[fIds[f]]
+            for e, probability in row.iteritems():
+                if e < len(eIds) and eIds[e] in tRow:
+                    tRow[eIds[e]] = probability
+                    pairs += 1
+        self.logger.info("IBM model 1 loaded, " + str(pairs) +
+                         " word pairs found")
+        return
+
+    def initialT(self, dataset, iterations, index=0):
+        '''
+        @return: the translation probability table of the IBM model 1 given by
+            trainIBM1. Training the HMM updates it in place, so it is a copy
+            when the IBM model 1 is shared.
+        '''
+        t = self.trainIBM1(dataset, iterations, index).t
+        if self.ibm1Models is not None:
+            t = [defaultdict(float, row) for row in t]
+        return t
+
     def initialValues(self, Len):
         self.a[:Len + 1, :Len, :Len].fill(1.0 / Len)
         self.pi[:Len].fill(1.0 / 2 / Len)
@@ -55,6 +222,68 @@ class AlignmentModelBase(Base):
         self.delta = np.zeros((maxE + 1, maxE, maxE))
         return
 
+    def extendParameter(self, maxE):
+        '''
+        Like initialiseParameter, but keeping the raw transition and the
+        initial probabilities trained before, to continue training on new
+        data. The target sentence lengths of self.datasetLengths new to the
+        model start with uniform transitions, and the new positions with the
+        initial probability initialValues would give them.
+        '''
+        rawA = np.asarray(self.rawA)
+        pi = np.asarray(self.pi)
+        size = max([maxE, len(rawA) - 1] + list(self.eLengthSet))
+        self.initialiseParameter(size)
+        self.a[:rawA.shape[0], :rawA.shape[1], :rawA.shape[2]] = rawA
+        self.pi[:len(pi)] = pi
+        self.pi[len(pi):size].fill(1.0 / 2 / size)
+        for Len in self.datasetLengths:
+            if Len not in self.eLengthSet:
+                self.a[Len][:Len, :Len].fill(1.0 / Len)
+        return
+
+    def smoothTransition(self):
+        '''
+        Give the NULL states their share p0H of the transition probabilities.
+        Training keeps its raw estimates in self.rawA, and self.a, used in
+        decoding, is derived from them here. Decoding with another p0H only
+        takes setting self.p0H, self.a is smoothed again before the next
+        sentence is decoded.
+        '''
+        rawA = np.asarray(self.rawA)
+        maxE = max([len(rawA) - 1] + list(self.eLengthSet))
+        a = np.zeros((maxE + 1, maxE * 2, maxE * 2))
+        a[:rawA.shape[0], :rawA.shape[1], :rawA.shape[2]] = rawA
+        for Len in self.eLengthSet:
+            aLen = a[Len]
+            aLen[:Len, :Len] *= 1 - self.p0H
+            # The NULL state j + Len stays at position j, and leaves it as
+            # state j does
+            nulls = np.arange(Len, Len * 2)
+            aLen[nulls - Len, nulls] = self.p0H
+            aLen[nulls, nulls] = self.p0H
+            aLen[Len:Len * 2, :Len] = aLen[:Len, :Len]
+        self.a = a
+        self.smoothedP0H = self.p0H
+        return
+
+    def endOfLoading(self, version):
+        if version not in _smoothedVersions:
+            self.smoothTransition()
+            return
+        # The file has the smoothed probabilities. The p0H they were smoothed
+        # with is the probability of staying in a NULL state, the raw
+        # estimates are given back by undoing the smoothing.
+        self.a = np.asarray(self.rawA)
+        self.rawA = self.a.copy()
+        self.smoothedP0H = self.p0H
+        for Len in self.eLengthSet:
+            self.smoothedP0H = self.a[Len][Len][Len]
+            self.rawA[Len][:Len, :Len] /= 1 - self.smoothedP0H
+        self.logger.info("Model file of version " + version + ", smoothed " +
+                         "with p0H = " + str(self.smoothedP0H))
+        return
+
     def forwardBackward(self, f, e, tSmall, a):
         cdef int fLen = len(f)
         cdef int eLen = len(e)
@@ -76,47 +305,35 @@ class AlignmentModelBase(Base):
                 alphaScale[i]
         return alpha, alphaScale, beta
 
-    def baumWelch(self, dataset, iterations=5, index=0):
+    def baumWelch(self, dataset, iterations=5, index=0, extend=False):
+        '''
+        Train the model with the Baum-Welch algorithm.
+        @param dataset: Corpus. A lexicalised dataset
+        @param iterations: int. The number of iterations
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @param extend: bool. Start from the probabilities trained before (see
+                       extendParameter) instead of uniform ones
+        @return: Nothing
+        '''
         self.logger.info("Starting BaumWelch Training Process, size: " +
                          str(len(dataset)))
         startTime = time.time()
 
-        cdef int maxE = max([len(e) for (f, e, alignment) in dataset])
-        cdef int fLen, eLen
-        cdef logLikelihood
-        cdef counter
-        for (f, e, alignment) in dataset:
-            self.eLengthSet[len(e)] = 1
-        self.initialiseParameter(maxE)
+        cdef int maxE
+        # The target sentence lengths whose transitions are estimated
+        self.datasetLengths = self.targetLengths(dataset)
+        maxE = max(self.datasetLengths)
+        if extend:
+            self.extendParameter(maxE)
+        else:
+            self.initialiseParameter(maxE)
+        self.eLengthSet.update(self.datasetLengths)
         self.logger.info("Maximum Target sentence length: " + str(maxE))
 
         for iteration in range(iterations):
             self.logger.info("BaumWelch Iteration " + str(iteration))
-            logLikelihood = 0
-            counter = 0
-            self._beginningOfIteration(dataset, maxE, index)
-
-            for (f, e, alignment) in dataset:
-                fLen = len(f)
-                eLen = len(e)
-                counter += 1
-                if iteration == 0:
-                    self.initialValues(eLen)
-
-                a = self.aProbability(f, e)[:fLen, :eLen, :eLen]
-                tSmall = self.tProbability(f, e, index)
-
-                alpha, alphaScale, beta = self.forwardBackward(f, e, tSmall, a)
-                gamma = ((alpha * beta).T / alphaScale).T
-                xi = np.zeros((fLen, eLen, eLen))
-                xi[1:] = alpha[:-1][..., None] * a[1:] *\
-                    (beta * tSmall)[1:][:, None, :]
-
-                self.EStepGamma(f, e, gamma, index)
-                self.EStepDelta(f, e, xi)
-
-                logLikelihood -= np.sum(np.log(alphaScale))
-
+            logLikelihood = self.EStep(dataset, maxE, index,
+                                       iteration == 0 and not extend)
             self.logger.info("likelihood " + str(logLikelihood))
             # M-Step
             self.logger.info("End of iteration, M steps")
@@ -130,6 +347,56 @@ class AlignmentModelBase(Base):
                          (endTime - startTime,))
         return
 
+    def targetLengths(self, dataset):
+        '''
+        @param dataset: Corpus. A lexicalised dataset
+        @return: dict, with the length of every target sentence as key
+        '''
+        lengths = {}
+        for (f, e, alignment) in dataset:
+            lengths[len(e)] = 1
+        return lengths
+
+    def EStep(self, dataset, maxE, index=0, initialise=False):
+        '''
+        Collect the counts of an iteration of Baum-Welch over a dataset, from
+        scratch except for self.delta, which adds up over the iterations. They
+        are kept in the attributes named in self.countComponents, for
+        MStepDelta and MStepGamma to estimate the new parameters from.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param maxE: int. The maximum target sentence length
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @param initialise: bool. Give the transitions and initial
+                           probabilities of every sentence their initial
+                           values first, see initialValues
+        @return: float, the log likelihood of the dataset
+        '''
+        cdef int fLen, eLen
+        cdef logLikelihood
+        self._beginningOfIteration(dataset, maxE, index)
+        logLikelihood = 0
+        for (f, e, alignment) in dataset:
+            fLen = len(f)
+            eLen = len(e)
+            if initialise:
+                self.initialValues(eLen)
+
+            a = self.aProbability(f, e)[:fLen, :eLen, :eLen]
+            tSmall = self.tProbability(f, e, index)
+
+            alpha, alphaScale, beta = self.forwardBackward(f, e, tSmall, a)
+            gamma = ((alpha * beta).T / alphaScale).T
+            xi = np.zeros((fLen, eLen, eLen))
+            xi[1:] = alpha[:-1][..., None] * a[1:] *\
+                (beta * tSmall)[1:][:, None, :]
+
+            self.EStepGamma(f, e, gamma, index)
+            self.EStepDelta(f, e, xi)
+
+            logLikelihood -= np.sum(np.log(alphaScale))
+        return logLikelihood
+
     def _beginningOfIteration(self, dataset, maxE, index):
         raise NotImplementedError
 
@@ -158,16 +425,18 @@ class AlignmentModelBase(Base):
 
     def tProbability(self, f, e, index=0):
         t = np.zeros((len(f), len(e)))
+        fWords = wordColumn(f, index)
+        eWords = wordColumn(e, index)
         for j in range(len(e)):
-            if e[j][index] == 424242424243:
+            if eWords[j] == 424242424243:
                 t[:, j].fill(self.nullEmissionProb)
                 continue
-            if e[j][index] >= len(self.eLex[index]):
+            if eWords[j] >= len(self.eLex[index]):
                 continue
             for i in range(len(f)):
-                if f[i][index] < len(self.t) and \
-                        e[j][index] in self.t[f[i][index]]:
-                    t[i][j] = self.t[f[i][index]][e[j][index]]
+                if fWords[i] < len(self.t) and \
+                        eWords[j] in self.t[fWords[i]]:
+                    t[i][j] = self.t[fWords[i]][eWords[j]]
         t[t == 0] = 0.000006123586217
         return t
 
@@ -181,12 +450,12 @@ class AlignmentModelBase(Base):
         return np.tile(a, (fLen, 1, 1))
 
     def logViterbi(self, f, e):
-        e = deepcopy(e)
         with np.errstate(invalid='ignore', divide='ignore'):
             a = np.log(self.aProbability(f, e))
         fLen, eLen = len(f), len(e)
-        for i in range(eLen):
-            e.append((424242424243, 424242424243))
+        # e could be a view of a Corpus, so NULL words go to a new array
+        e = np.asarray(e)
+        e = np.concatenate((e, np.full(e.shape, 424242424243, dtype=np.int64)))
         score = np.zeros((fLen, eLen * 2))
         prev_j = np.zeros((fLen, eLen * 2))
 
@@ -225,6 +494,8 @@ class AlignmentModelBase(Base):
         return trace, score[:, :eLen + 1]
 
     def decodeSentence(self, sentence):
+        if self.smoothedP0H != self.p0H:
+            self.smoothTransition()
         f, e, alignment = self.lexiSentence(sentence)
         sentenceAlignment = []
         bestAlign, score = self.logViterbi(f, e)
@@ -239,3 +510,117 @@ class AlignmentModelBase(Base):
                 else:
                     sentenceAlignment.append((i + 1, bestAlign[i][0]))
         return sentenceAlignment, score
+
+    def decodeCost(self, fLength, eLength):
+        # The Viterbi search goes through every pair of target language
+        # positions (including the empty word ones) for each source word
+        return fLength * eLength * eLength
+
+
+class TestHMMBase(unittest.TestCase):
+    def setUp(self):
+        from fileIO import loadDataset
+        self.dataset = loadDataset(["support/ut_align_no_tag.cn"],
+                                   ["support/ut_align_no_tag.en"],
+                                   linesToLoad=100)
+        self.cacheDir = "support/ut_ibm1_cache"
+        self.modelFile = "support/ut_ibm1.pkl"
+        return
+
+    def tearDown(self):
+        if os.path.isdir(self.cacheDir):
+            for fileName in os.listdir(self.cacheDir):
+                os.remove(os.path.join(self.cacheDir, fileName))
+            os.rmdir(self.cacheDir)
+        if os.path.isfile(self.modelFile):
+            os.remove(self.modelFile)
+        return
+
+    def testIBM1Cache(self):
+        from models.HMM import AlignmentModel
+        model = AlignmentModel()
+        model.ibm1CacheDir = self.cacheDir
+        corpus = model.initialiseLexikon(self.dataset)
+        trained = model.trainIBM1(corpus, 2)
+        cacheFile = model.ibm1CacheFile(corpus, 2)
+        self.assertTrue(os.path.isfile(cacheFile))
+        self.assertNotEqual(model.ibm1CacheFile(corpus, 1), cacheFile)
+        self.assertNotEqual(model.ibm1CacheFile(corpus[:50], 2), cacheFile)
+        self.assertEqual(model.trainIBM1(corpus, 2).t, trained.t)
+        return
+
+    def testLoadIBM1(self):
+        from models.HMM import AlignmentModel
+        alignerIBM1 = AlignerIBM1()
+        alignerIBM1.train(self.dataset, 2)
+        alignerIBM1.saveModel(self.modelFile)
+        model = AlignmentModel()
+        model.ibm1File = self.modelFile
+        # Words come in another order, so the ids differ
+        corpus = model.initialiseLexikon(self.dataset[::-1])
+        t = model.trainIBM1(corpus, 5).t
+        for f in range(len(model.fLex[0])):
+            fId = alignerIBM1.fIndex[0][model.fLex[0][f]]
+            for e in t[f]:
+                eId = alignerIBM1.eIndex[0][model.eLex[0][e]]
+                self.assertEqual(t[f][e], alignerIBM1.t[fId][eId])
+        return
+
+    def testSmoothTransition(self):
+        from models.HMM import AlignmentModel
+        model = AlignmentModel()
+        model.train(self.dataset, 1)
+        expected = model.decode(self.dataset)
+        model.p0H = 0.1
+        other = AlignmentModel()
+        other.p0H = 0.1
+        other.train(self.dataset, 1)
+        self.assertSequenceEqual(model.decode(self.dataset),
+                                 other.decode(self.dataset))
+        self.assertTrue(np.array_equal(model.a, other.a))
+
+        # Files of older versions keep the smoothed probabilities
+        other.version = "0.4b"
+        other.rawA = other.a
+        other.saveModel(self.modelFile)
+        loaded = AlignmentModel()
+        loaded.loadModel(self.modelFile)
+        self.assertAlmostEqual(loaded.smoothedP0H, 0.1)
+        for Len in model.eLengthSet:
+            self.assertTrue(np.allclose(loaded.rawA[Len][:Len, :Len],
+                                        model.rawA[Len][:Len, :Len]))
+        loaded.p0H = 0.3
+        self.assertSequenceEqual(loaded.decode(self.dataset), expected)
+        return
+
+    def testContinueTraining(self):
+        from models.HMM import AlignmentModel
+        model = AlignmentModel()
+        model.train(self.dataset[:50], 1)
+        model.saveModel(self.modelFile)
+        model = AlignmentModel()
+        model.loadModel(self.modelFile)
+        lengths = set(model.eLengthSet)
+        rawA = np.array(model.rawA)
+        fWords = len(model.fLex[0])
+        model.continueTraining(self.dataset[50:], 1)
+        self.assertTrue(len(model.fLex[0]) > fWords)
+        self.assertEqual(len(model.t), len(model.fLex[0]))
+        newLengths = set([len(e) for f, e, a in self.dataset[50:]])
+        self.assertEqual(set(model.eLengthSet), lengths | newLengths)
+        self.assertTrue(lengths - newLengths)
+        for Len in lengths - newLengths:
+            self.assertTrue(np.array_equal(model.rawA[Len][:Len, :Len],
+                                           rawA[Len][:Len, :Len]))
+
+        # The model is saved and loaded as before
+        model.saveModel(self.modelFile)
+        loaded = AlignmentModel()
+        loaded.loadModel(self.modelFile)
+        self.assertSequenceEqual(loaded.decode(self.dataset[40:60]),
+                                 model.decode(self.dataset[40:60]))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,6 +34,15 @@ class AlignmentModel(IBM1Base):
         self.EM(dataset, iterations)
         return
 
+    def continueTraining(self, dataset, iterations=5):
+        '''
+        Continue training a loaded model on new data. Training extends the
+        lexikon and the translation probabilities already, the word pairs
+        seen before start from the probabilities trained.
+        '''
+        self.train(dataset, iterations)
+        return
+
     def _beginningOfIteration(self, index=0):
         self.c = [defaultdict(float) for i in range(len(self.fLex[index]))]
         self.total = np.zeros(len(self.eLex[index]))
@@ -42,14 +51,15 @@ class AlignmentModel(IBM1Base):
     def _updateCount(self, f, e, index):
         cdef int fLen = len(f)
         cdef int eLen = len(e)
-        fWords = np.array([f[i][index] for i in range(fLen)])
-        eWords = np.array([e[j][index] for j in range(eLen)])
+        fWords = f[:, index].tolist()
+        eWords = e[:, index]
+        eIds = eWords.tolist()
         tSmall = self.tProbability(f, e, index)
         tSmall = tSmall / tSmall.sum(axis=1)[:, None]
         for i in range(fLen):
             tmp = tSmall[i]
             for j in range(eLen):
-                self.c[fWords[i]][eWords[j]] += tmp[j]
+                self.c[fWords[i]][eIds[j]] += tmp[j]
         eDupli = (eWords[:, np.newaxis] == eWords).sum(axis=0)
         tSmall = (tSmall * eDupli).sum(axis=0)
         self.total[eWords] += tSmall
@@ -58,8 +68,8 @@ class AlignmentModel(IBM1Base):
     def _updateEndOfIteration(self, index):
         self.logger.info("End of iteration")
         # Update t
-        for i in range(len(self.t)):
+        for i in range(len(self.fLex[index])):
             tTmp = self.t[i]
-            for j in tTmp:
+            for j in self.c[i]:
                 tTmp[j] = self.c[i][j] / self.total[j]
         return
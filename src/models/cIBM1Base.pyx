@@ -13,6 +13,7 @@ import cython
 from copy import deepcopy
 from loggers import logging
 from models.cModelBase import AlignmentModelBase as Base
+from models.cModelBase import wordColumn
 __version__ = "0.5a"
 
 
@@ -24,6 +25,8 @@ class AlignmentModelBase(Base):
             self.logger = logging.getLogger('IBM1BASE')
         if "modelComponents" not in vars(self):
             self.modelComponents = ["t", "fLex", "eLex", "fIndex", "eIndex"]
+        if "countComponents" not in vars(self):
+            self.countComponents = ["c", "total"]
         Base.__init__(self)
         return
 
@@ -31,13 +34,15 @@ class AlignmentModelBase(Base):
         cdef int fLen = len(f)
         cdef int eLen = len(e)
         cdef double[:,:] t = np.full((fLen, eLen), 0.000006123586217)
+        fWords = wordColumn(f, index)
+        eWords = wordColumn(e, index)
         for i in range(fLen):
-            if f[i][index] > len(self.t):
+            if fWords[i] > len(self.t):
                 continue
-            tTmp = self.t[f[i][index]]
+            tTmp = self.t[fWords[i]]
             for j in range(eLen):
-                if e[j][index] in tTmp:
-                    t[i][j] = tTmp[e[j][index]]
+                if eWords[j] in tTmp:
+                    t[i][j] = tTmp[eWords[j]]
         return np.array(t)
 
     def EM(self, dataset, iterations, index=0):
@@ -46,13 +51,8 @@ class AlignmentModelBase(Base):
         start_time = time.time()
 
         for iteration in range(iterations):
-            self._beginningOfIteration(index)
             self.logger.info("Starting Iteration " + str(iteration))
-
-            for item in dataset:
-
-                self._updateCount(item[0], item[1], index)
-
+            self.EStep(dataset, index)
             self._updateEndOfIteration(index)
 
         end_time = time.time()
@@ -61,6 +61,21 @@ class AlignmentModelBase(Base):
         self.endOfEM()
         return
 
+    def EStep(self, dataset, index=0):
+        '''
+        Collect the counts of an iteration of EM over a dataset, from scratch.
+        They are kept in the attributes named in self.countComponents, for
+        _updateEndOfIteration to estimate the new parameters from.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param index: int. The factor to train on, 0 for FORM and 1 for POS
+        @return: Nothing
+        '''
+        self._beginningOfIteration(index)
+        for item in dataset:
+            self._updateCount(item[0], item[1], index)
+        return
+
     def decodeSentence(self, sentence):
         # This is the standard sentence decoder for IBM model 1
         # What happens there is that for every source f word, we find the
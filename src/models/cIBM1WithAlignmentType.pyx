@@ -12,6 +12,7 @@ import numpy as np
 from collections import defaultdict
 from loggers import logging
 from models.cIBM1Base import AlignmentModelBase as IBM1Base
+from models.cModelBase import wordColumn
 from evaluators.evaluator import evaluate
 __version__ = "0.5a"
 
@@ -45,6 +46,7 @@ class AlignmentModel(IBM1Base):
                                 "fLex", "eLex", "fIndex", "eIndex",
                                 "typeList", "typeIndex", "typeDist",
                                 "lambd", "lambda1", "lambda2", "lambda3"]
+        self.countComponents = ["c", "total", "c_feh"]
         IBM1Base.__init__(self)
         return
 
@@ -58,8 +60,9 @@ class AlignmentModel(IBM1Base):
     def _updateCount(self, f, e, index):
         cdef int fLen = len(f)
         cdef int eLen = len(e)
-        fWords = np.array([f[i][index] for i in range(fLen)])
-        eWords = np.array([e[j][index] for j in range(eLen)])
+        fWords = f[:, index].tolist()
+        eWords = e[:, index]
+        eIds = eWords.tolist()
         tSmall = self.tProbability(f, e, index)
         tSmall = tSmall / tSmall.sum(axis=1)[:, None]
         score = self.sProbability(f, e, index) * tSmall[:, :, None]
@@ -67,8 +70,8 @@ class AlignmentModel(IBM1Base):
             tmp = tSmall[i]
             tmps = score[i]
             for j in range(eLen):
-                self.c[fWords[i]][eWords[j]] += tmp[j]
-                self.c_feh[fWords[i]][eWords[j]] += tmps[j]
+                self.c[fWords[i]][eIds[j]] += tmp[j]
+                self.c_feh[fWords[i]][eIds[j]] += tmps[j]
         eDupli = (eWords[:, np.newaxis] == eWords).sum(axis=0)
         tSmall = (tSmall * eDupli).sum(axis=0)
         self.total[eWords] += tSmall
@@ -95,18 +98,23 @@ class AlignmentModel(IBM1Base):
 
     def sProbability(self, f, e, index=0):
         sTag = np.tile((1 - self.lambd) * self.typeDist, (len(f), len(e), 1))
+        fTags = wordColumn(f, 1)
+        eTags = wordColumn(e, 1)
         for j in range(len(e)):
             for i in range(len(f)):
-                if f[i][1] < len(self.sTag) and e[j][1] in self.sTag[f[i][1]]:
-                    sTag[i][j] += self.lambd * self.sTag[f[i][1]][e[j][1]]
+                if fTags[i] < len(self.sTag) and \
+                        eTags[j] in self.sTag[fTags[i]]:
+                    sTag[i][j] += self.lambd * self.sTag[fTags[i]][eTags[j]]
         if index == 1:
             return sTag
 
         s = np.tile((1 - self.lambd) * self.typeDist, (len(f), len(e), 1))
+        fWords = wordColumn(f, 0)
+        eWords = wordColumn(e, 0)
         for j in range(len(e)):
             for i in range(len(f)):
-                if f[i][0] < len(self.s) and e[j][0] in self.s[f[i][0]]:
-                    s[i][j] += self.lambd * self.s[f[i][0]][e[j][0]]
+                if fWords[i] < len(self.s) and eWords[j] in self.s[fWords[i]]:
+                    s[i][j] += self.lambd * self.s[fWords[i]][eWords[j]]
 
         return (self.lambda1 * s +
                 self.lambda2 * sTag +
@@ -153,3 +161,19 @@ class AlignmentModel(IBM1Base):
         self.trainStage1(dataset, iterations)
         self.trainStage2(dataset, iterations)
         return
+
+    def continueTraining(self, dataset, iterations=5):
+        '''
+        Continue training a loaded model on new data, on FORM as in stage 2.
+        The lexikon and the tables are extended with the new words, and the
+        alignment types stay those of the model. The word pairs absent from
+        the new data keep their probabilities.
+        '''
+        dataset = self.extendLexikon(dataset)
+        self.logger.info("Extending model with the new data")
+        self.initialiseBiwordCount(dataset, 0)
+        self.sTag = self.calculateS(dataset, 1, self.sTag)
+        s = self.s = self.calculateS(dataset, 0, self.s)
+        self.EM(dataset, iterations, 0)
+        self.s = self.updateTable(s, self.s)
+        return
@@ -9,29 +9,122 @@
 # AlignmentModelBase as the parent class of their own model. The base model
 # here provides the function to export and load existing models.
 #
+import io
 import os
 import sys
 import inspect
 import gzip
 import time
+import heapq
 import unittest
+import multiprocessing
 import numpy as np
 import cPickle as pickle
-from copy import deepcopy
 from collections import defaultdict
+from itertools import islice, chain
 currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 from loggers import logging
+from corpus import Corpus, internDataset, datasetFactors, iterChunks
+from lexikon import Lexikon, HashedLexikon, LexikonIndex, readLexikon
 __version__ = "0.5a"
 
 
+# The model and lexicalised sentences decoded by a worker process of
+# AlignmentModelBase.decode. They are set in the worker only, by
+# _initDecodeWorker, so concurrent decodes each keep their own.
+_decodeState = None
+
+
+def _initDecodeWorker(model, corpus):
+    # Runs in each worker as it starts. The arguments are handed over by
+    # forking, so the workers inherit them instead of receiving copies.
+    global _decodeState
+    _decodeState = (model, corpus)
+    return
+
+
+def _decodeShard(indices):
+    model, corpus = _decodeState
+    result = []
+    for i in indices:
+        sentenceAlignment = model.decodeSentence(corpus[i])
+        if len(sentenceAlignment) > 1 and\
+                isinstance(sentenceAlignment[1], np.ndarray):
+            sentenceAlignment = sentenceAlignment[0]
+        result.append(sentenceAlignment)
+    return result
+
+
+def saveTranslationTable(t, fileName):
+    '''
+    Save a translation probability table, a list with a dict from target
+    language word ids to probabilities for each source language word id, in
+    the NumPy .npz format. The file is written under a temporary name first
+    and renamed once complete, so a crashed run never leaves a truncated file
+    behind.
+
+    @param t: list of dict, the table
+    @param fileName: str, the file to save to
+    '''
+    sizes = np.array([len(row) for row in t], dtype=np.int64)
+    total = int(sizes.sum())
+    e = np.fromiter(chain.from_iterable([row.iterkeys() for row in t]),
+                    dtype=np.int64, count=total)
+    probabilities = np.fromiter(
+        chain.from_iterable([row.itervalues() for row in t]),
+        dtype=np.float64, count=total)
+    tmpFileName = fileName + ".tmp%d" % os.getpid()
+    output = open(tmpFileName, "wb")
+    try:
+        np.savez(output, sizes=sizes, e=e, probabilities=probabilities)
+    finally:
+        output.close()
+    os.rename(tmpFileName, fileName)
+    return
+
+
+def loadTranslationTable(fileName):
+    '''
+    Load a translation probability table saved by saveTranslationTable.
+
+    @param fileName: str, the file to load
+    @return: list of defaultdict(float), the table
+    '''
+    data = np.load(fileName)
+    try:
+        sizes = data["sizes"].tolist()
+        e = data["e"].tolist()
+        probabilities = data["probabilities"].tolist()
+    finally:
+        data.close()
+    t = []
+    start = 0
+    for size in sizes:
+        t.append(defaultdict(float, zip(e[start:start + size],
+                                        probabilities[start:start + size])))
+        start += size
+    return t
+
+
 def isLambda(f):
     lamb = (lambda: 0)
     return isinstance(f, type(lamb)) and f.__name__ == lamb.__name__
 
 
+def wordColumn(sentence, index):
+    '''
+    Return the ids of the specified factor of every word in a lexicalised
+    sentence. The sentence can either be a view taken from a Corpus, or a list
+    of tuples.
+    '''
+    if isinstance(sentence, np.ndarray):
+        return sentence[:, index].tolist()
+    return [word[index] for word in sentence]
+
+
 class AlignmentModelBase():
     def __init__(self):
         '''
@@ -49,6 +142,28 @@ class AlignmentModelBase():
 
         Optionally, when there is a self.supportedVersion list and self.version
         str, the loader will only load the files with supported versions.
+
+        Models trained with EM also list in self.countComponents the names of
+        the variables their E-step collects counts in, from which the
+        parameters are estimated. They are what training on several machines
+        exchanges, see distributed.py.
+
+        self.hashBuckets is a list with the number of buckets of each factor
+        (FORM, POS, etc.). When set before training, the lexikons of factors
+        with a positive number of buckets are HashedLexikons, and their size
+        does not depend on the vocabulary of the training data.
+
+        self.frequencyOrder, when set, makes extendLexikon give new words their
+        ids by descending frequency in the dataset, and store the lexicalised
+        dataset in the narrowest integer type that fits the ids. The ids are
+        kept in the lexikon itself, so saved models need nothing extra.
+
+        self.decodeChunkSize is the number of sentences decode lexicalises at
+        a time.
+
+        self.decodeWorkers is the number of processes decode uses. With more
+        than one, each chunk of sentences is split between processes forked
+        from the current one, which share the model with it.
         '''
         if "modelName" not in vars(self):
             self.modelName = "BaseModel"
@@ -68,6 +183,14 @@ class AlignmentModelBase():
             self.fIndex = []
         if "eIndex" not in vars(self):
             self.eIndex = []
+        if "hashBuckets" not in vars(self):
+            self.hashBuckets = []
+        if "frequencyOrder" not in vars(self):
+            self.frequencyOrder = False
+        if "decodeChunkSize" not in vars(self):
+            self.decodeChunkSize = 10000
+        if "decodeWorkers" not in vars(self):
+            self.decodeWorkers = 1
         return
 
     def loadModel(self, fileName=None, force=False):
@@ -90,9 +213,14 @@ class AlignmentModelBase():
         self.logger.info("Loading model from " + fileName)
         fileName = os.path.expanduser(fileName)
         if fileName.endswith("pklz"):
-            pklFile = gzip.open(fileName, 'rb')
+            # Unpickling reads a few bytes at a time, which GzipFile alone
+            # handles very slowly
+            pklFile = io.BufferedReader(gzip.open(fileName, 'rb'), 1 << 20)
+            mmapFileName = None
         else:
             pklFile = open(fileName, 'rb')
+            # The Lexikons are memory-mapped from uncompressed model files
+            mmapFileName = fileName
 
         modelName = self.__loadObjectFromFile(pklFile)
         modelVersion = self.__loadObjectFromFile(pklFile)
@@ -134,12 +262,25 @@ class AlignmentModelBase():
             if componentName not in entity:
                 raise RuntimeError("object " + componentName +
                                    " doesn't exist in this class")
-            entity[componentName] = self.__loadObjectFromFile(pklFile)
+            entity[componentName] = self.__loadObjectFromFile(pklFile,
+                                                              mmapFileName)
 
         pklFile.close()
+        self._linkLexikon()
+        self.endOfLoading(modelVersion)
         self.logger.info("Model loaded")
         return
 
+    def endOfLoading(self, version):
+        '''
+        This method is called once the components of a model file are loaded,
+        for models to derive what they don't save, or to convert the
+        components of files of older versions.
+        @param version: str. The version of the model file
+        @return: Nothing
+        '''
+        return
+
     def saveModel(self, fileName=""):
         '''
         This method saves model to specified file. Only components listed in a
@@ -152,14 +293,17 @@ class AlignmentModelBase():
                                 " be saved")
             return
         entity = vars(self)
-        if fileName.endswith("pklz"):
-            output = gzip.open(fileName, 'wb')
-        elif fileName.endswith("pkl"):
-            output = open(fileName, 'wb')
-        else:
+        if not fileName.endswith("pklz") and not fileName.endswith("pkl"):
             fileName = fileName + ".pkl"
-            output = open(fileName, 'wb')
         self.logger.info("Saving model to " + fileName)
+        # The model is written next to the file and renamed once complete, so
+        # that a model file memory-mapped by loadModel is never overwritten
+        # in place
+        tmpFileName = fileName + ".tmp"
+        if fileName.endswith("pklz"):
+            output = gzip.open(tmpFileName, 'wb')
+        else:
+            output = open(tmpFileName, 'wb')
 
         # dump model name and version
         if "modelName" in vars(self):
@@ -178,18 +322,28 @@ class AlignmentModelBase():
             self.__saveObjectToFile(entity[componentName], output)
 
         output.close()
+        os.rename(tmpFileName, fileName)
         self.logger.info("Model saved")
         return
 
-    def __loadObjectFromFile(self, pklFile):
+    def __loadObjectFromFile(self, pklFile, mmapFileName=None):
         '''
         This method saves model component to specified file. Why does it exist?
         Well, sometimes a trained model might contain redundant information
         that doesn't need to be saved, and that's where this method comes in.
         @param pklFile: str. Name of the model file.
+        @param mmapFileName: str. Name of the model file when it can be
+                             memory-mapped, None otherwise.
         @return: loaded component
         '''
         a = pickle.load(pklFile)
+        if isinstance(a, list):
+            # The arrays of the Lexikons follow the list, see
+            # __saveObjectToFile
+            for i in range(len(a)):
+                if isinstance(a[i], str) and a[i] == "§§LEXIKON§§":
+                    a[i] = readLexikon(pklFile, mmapFileName)
+            return a
         if isinstance(a, dict) and "§§NUMPY§§" in a and a["§§NUMPY§§"] == 0.0:
             self.logger.info("Loading Numpy array, size: " + str(len(a)))
             del a["§§NUMPY§§"]
@@ -224,7 +378,7 @@ class AlignmentModelBase():
             for coordinate in zip(*a.nonzero()):
                 aDict[coordinate] = a[coordinate]
             a = aDict
-            pickle.dump(a, output)
+            pickle.dump(a, output, pickle.HIGHEST_PROTOCOL)
             return
         if isinstance(a, defaultdict):
             # Remove zero valued entries from defaultdict
@@ -237,7 +391,7 @@ class AlignmentModelBase():
                 "Dumping defaultdict, size after trim: " + str(len(a)))
             if isLambda(a.default_factory):
                 a.default_factory = float
-            pickle.dump(a, output)
+            pickle.dump(a, output, pickle.HIGHEST_PROTOCOL)
             return
         if isinstance(a, list):
             # Remove lambda defaults from defaultdicts in the list
@@ -247,9 +401,21 @@ class AlignmentModelBase():
                 if isinstance(item, defaultdict) and\
                         isLambda(item.default_factory):
                     item.default_factory = float
-            pickle.dump(a, output)
+            # Lexikons are written as arrays after the list, so that they
+            # can be memory-mapped when loaded
+            lexikons = []
+            items = []
+            for item in a:
+                if isinstance(item, Lexikon) and\
+                        not isinstance(item, HashedLexikon):
+                    lexikons.append(item)
+                    item = "§§LEXIKON§§"
+                items.append(item)
+            pickle.dump(items, output, pickle.HIGHEST_PROTOCOL)
+            for lexikon in lexikons:
+                lexikon.writeArrays(output)
             return
-        pickle.dump(a, output)
+        pickle.dump(a, output, pickle.HIGHEST_PROTOCOL)
         return
 
     def initialiseBiwordCount(self, dataset, index=0):
@@ -259,7 +425,7 @@ class AlignmentModelBase():
         an existing translation probability table. Note that no matter what,
         the translation probability table involved here is self.t.
 
-        @param dataset: Dataset. A dataset
+        @param dataset: Corpus. A lexicalised dataset
         @param index: int. Index indicates which part of the word to work on,
                       by default it's 0 for FORM and 1 for POS Tags.
         @return: Nothing
@@ -274,10 +440,12 @@ class AlignmentModelBase():
 
         for item in dataset:
             f, e = item[0:2]
-            for f_i in f:
-                for e_j in e:
-                    if e_j[index] not in self.t[f_i[index]]:
-                        self.t[f_i[index]][e_j[index]] = initialValue
+            eWords = e[:, index].tolist()
+            for f_i in f[:, index].tolist():
+                tTmp = self.t[f_i]
+                for e_j in eWords:
+                    if e_j not in tTmp:
+                        tTmp[e_j] = initialValue
         self.logger.info("Biword table initialised")
         return
 
@@ -295,11 +463,9 @@ class AlignmentModelBase():
         """
         typeDist = defaultdict(float)
         typeTotalCount = 0
-        for (f, e, alignment) in dataset:
-            # Initialise total_f_e_type count
-            for (f_i, e_i, typ) in alignment:
-                typeDist[typ] += 1
-                typeTotalCount += 1
+        for typ, count in self.alignTypeCount(dataset):
+            typeDist[typ] += count
+            typeTotalCount += count
 
         # Calculate alignment type distribution
         for typ in typeDist:
@@ -319,34 +485,70 @@ class AlignmentModelBase():
             self.typeDist[h] = typeDist[self.typeList[h]]
         return
 
-    def calculateS(self, dataset, index=0, oldS=None):
+    def alignTypeCount(self, dataset):
         """
-        This is where translation probability with alignment types (S table) is
-        initialised. The initialised probability table will be returned. One
-        can also extend an existing table with the option oldS.
+        Count the alignment types annotated in a dataset.
 
         @param dataset: Dataset. A dataset
+        @return: list of (str, int). Every alignment type, in the order they
+                 first appear, with its count
+        """
+        typeCount = {}
+        typeList = []
+        for (f, e, alignment) in dataset:
+            for (f_i, e_i, typ) in alignment:
+                if typ not in typeCount:
+                    typeCount[typ] = 0
+                    typeList.append(typ)
+                typeCount[typ] += 1
+        return [(typ, typeCount[typ]) for typ in typeList]
+
+    def sCount(self, dataset, index=0):
+        """
+        Count the alignment types of the word pairs annotated in a dataset,
+        and how often each word pair appears in the same sentence pair.
+
+        @param dataset: Corpus. A lexicalised dataset
         @param index: int. Index indicates which part of the word to work on,
                       by default it's 0 for FORM and 1 for POS Tags.
-        @param oldS: probability table. If oldS is not None, it will be
-                     extended and returned.
 
-        @return: The (extended) S table
+        @return: (count, feCount). For each source word id, a dict from
+                 target word ids to the counts of each alignment type, and one
+                 to the count of the word pair
         """
-        self.logger.info("Initialising S")
         count = [defaultdict(lambda: np.zeros(len(self.typeIndex)))
                  for i in range(len(self.fLex[index]))]
         feCount = [defaultdict(float) for i in range(len(self.fLex[index]))]
 
         for (f, e, alignment) in dataset:
-            for f_i in f:
-                for e_j in e:
-                    feCount[f_i[index]][e_j[index]] += 1
+            fWords = f[:, index].tolist()
+            eWords = e[:, index].tolist()
+            for f_i in fWords:
+                for e_j in eWords:
+                    feCount[f_i][e_j] += 1
             # Initialise total_f_e_type count
             for (f_i, e_i, typ) in alignment:
-                fWord = f[f_i - 1]
-                eWord = e[e_i - 1]
-                count[fWord[index]][eWord[index]][self.typeIndex[typ]] += 1
+                fWord = fWords[f_i - 1]
+                eWord = eWords[e_i - 1]
+                count[fWord][eWord][self.typeIndex[typ]] += 1
+        return count, feCount
+
+    def calculateS(self, dataset, index=0, oldS=None):
+        """
+        This is where translation probability with alignment types (S table) is
+        initialised. The initialised probability table will be returned. One
+        can also extend an existing table with the option oldS.
+
+        @param dataset: Corpus. A lexicalised dataset
+        @param index: int. Index indicates which part of the word to work on,
+                      by default it's 0 for FORM and 1 for POS Tags.
+        @param oldS: probability table. If oldS is not None, it will be
+                     extended and returned.
+
+        @return: The (extended) S table
+        """
+        self.logger.info("Initialising S")
+        count, feCount = self.sCount(dataset, index)
 
         self.logger.info("Writing S")
         if oldS:
@@ -365,6 +567,21 @@ class AlignmentModelBase():
                 count[i][j] /= feCount[i][j]
         return count
 
+    def updateTable(self, table, newTable):
+        """
+        Update a probability table, such as the S table, with one estimated
+        on new data only. The entries of newTable replace those of table, and
+        the others are kept. The table is modified in place.
+
+        @param table: probability table. The table trained before
+        @param newTable: probability table. The table estimated on new data
+        @return: The updated table
+        """
+        table += newTable[len(table):]
+        for i in range(len(newTable)):
+            table[i].update(newTable[i])
+        return table
+
     def keyDiv(self, x, y):
         """
         This method is no longer used in the actual programme.
@@ -379,46 +596,162 @@ class AlignmentModelBase():
                 x[i] /= y[i]
         return x
 
-    def decode(self, dataset, showFigure=0):
+    def decode(self, dataset, showFigure=0, output=None):
         """
         This is the decoder. It decodes all sentences in the dataset by calling
         decodeSentence method, which is defined in each models(or modelBases).
+        The dataset is lexicalised by lexiDataset self.decodeChunkSize
+        sentences at a time, so it can also be a generator such as the one
+        returned by fileIO.iterDataset, which is then read lazily.
         Optionally, it displays scores of alignment by drawing a graph.
 
-        @param dataset: Dataset. A dataset
+        @param dataset: Dataset, Corpus or iterable of sentences. A dataset
         @param showFigure: int. Plot the scores of the first specified number
                            of sentences.
+        @param output: fileIO.AlignmentWriter, or any object with a write
+                       method. When given, the alignment of each sentence is
+                       written to it as soon as it is decoded instead of being
+                       kept in memory.
 
         @return: alignment. See API reference for more detail on this structure
+                 Nothing is returned when output is given.
         """
+        words = []
         if showFigure > 0:
             from models.plot import plotAlignmentWithScore
-        self.logger.info("Start decoding")
-        self.logger.info("Testing size: " + str(len(dataset)))
+            if not isinstance(dataset, Corpus):
+                # The words of the plotted sentences are taken before the
+                # dataset is lexicalised
+                if isinstance(dataset, (list, tuple)):
+                    head = dataset[:showFigure]
+                else:
+                    dataset = iter(dataset)
+                    head = list(islice(dataset, showFigure))
+                    dataset = chain(head, dataset)
+                words = [(sentence[0], sentence[1]) for sentence in head]
         result = []
         count = 0
+        for batch in self.iterDecode(dataset, scores=showFigure > 0):
+            for sentenceAlignment in batch:
+                if showFigure > 0:
+                    sentenceAlignment, score = sentenceAlignment
+                    if count < showFigure:
+                        f = e = None
+                        if count < len(words):
+                            f, e = words[count]
+                        plotAlignmentWithScore(score,
+                                               sentenceAlignment,
+                                               f=f,
+                                               e=e,
+                                               # output=str(count))
+                                               output=None)
+                        count += 1
+
+                if output is not None:
+                    output.write(sentenceAlignment)
+                else:
+                    result.append(sentenceAlignment)
+        if output is not None:
+            return None
+        return result
+
+    def iterDecode(self, dataset, batchSize=None, scores=False):
+        '''
+        Decode the dataset lazily, one batch of sentences at a time. Only the
+        current batch is lexicalised and kept in memory, so when the dataset
+        is a generator, such as the one returned by fileIO.iterDataset, the
+        memory used stays the same whatever the size of the corpus, as long
+        as each batch is consumed before the next one is asked for.
+
+        @param dataset: Dataset, Corpus or iterable of sentences
+        @param* batchSize: int, the number of sentences in each batch, by
+            default self.decodeChunkSize
+        @param* scores: bool, whether to give the score matrix of each
+            sentence along with its alignment. Scores are only computed in
+            this process, decodeWorkers is ignored.
+        @return: generator of lists of SentenceAlignments, or of
+            (SentenceAlignment, np.ndarray) tuples when scores is True
+        '''
+        if batchSize is None:
+            batchSize = self.decodeChunkSize
+        self.logger.info("Start decoding")
+        if isinstance(dataset, (list, tuple, Corpus)):
+            self.logger.info("Testing size: " + str(len(dataset)))
+        total = 0
 
         startTime = time.time()
-        for sentence in dataset:
-            sentenceAlignment = self.decodeSentence(sentence)
-            if len(sentenceAlignment) > 1 and\
-                    isinstance(sentenceAlignment[1], np.ndarray):
-                sentenceAlignment, score = sentenceAlignment
-                if count < showFigure:
-                    plotAlignmentWithScore(score,
-                                           sentenceAlignment,
-                                           f=sentence[0],
-                                           e=sentence[1],
-                                           # output=str(count))
-                                           output=None)
-                    count += 1
-
-            result.append(sentenceAlignment)
+        workers = self.decodeWorkers
+        if workers > 1 and scores:
+            self.logger.info("Decoding in a single process to keep scores")
+            workers = 1
+        if workers > 1 and multiprocessing.current_process().daemon:
+            self.logger.warning("Unable to start decoding processes from a " +
+                                "worker process, decoding sequentially")
+            workers = 1
+        if isinstance(dataset, Corpus):
+            # A Corpus is compact already, its vocabulary is looked up once
+            dataset = self.lexiDataset(dataset)
+        for chunk in iterChunks(dataset, batchSize):
+            corpus = self.lexiDataset(chunk)
+            if workers > 1:
+                batch = self._parallelDecode(corpus, workers)
+            else:
+                batch = []
+                for sentence in corpus:
+                    sentenceAlignment = self.decodeSentence(sentence)
+                    score = None
+                    if len(sentenceAlignment) > 1 and\
+                            isinstance(sentenceAlignment[1], np.ndarray):
+                        sentenceAlignment, score = sentenceAlignment
+                    if scores:
+                        batch.append((sentenceAlignment, score))
+                    else:
+                        batch.append(sentenceAlignment)
+            total += len(batch)
+            yield batch
         endTime = time.time()
         self.logger.info("Decoding Complete, total time: " +
                          str(endTime - startTime) + ", average " +
-                         str(len(dataset) / (endTime - startTime)) +
+                         str(total / (endTime - startTime)) +
                          " sentences per second")
+        return
+
+    def decodeCost(self, fLength, eLength):
+        '''
+        The relative time decodeSentence takes on a sentence pair, used to
+        give each decoding process about the same amount of work.
+
+        @param fLength: int, the length of the source language sentence
+        @param eLength: int, the length of the target language sentence
+        @return: number
+        '''
+        return fLength * eLength
+
+    def _parallelDecode(self, corpus, workers):
+        # Decode a lexicalised chunk with forked processes, each given a set
+        # of sentences of about the same total cost (the longest ones first,
+        # each to the least loaded process), and put the results back in
+        # order.
+        costs = [self.decodeCost(len(f), len(e)) for f, e, alignment in corpus]
+        loads = [(0, k) for k in range(workers)]
+        shards = [[] for k in range(workers)]
+        for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+            load, k = heapq.heappop(loads)
+            shards[k].append(i)
+            heapq.heappush(loads, (load + costs[i], k))
+        shards = [sorted(shard) for shard in shards if shard]
+
+        pool = multiprocessing.Pool(len(shards), _initDecodeWorker,
+                                    (self, corpus))
+        try:
+            parts = pool.map(_decodeShard, shards)
+        finally:
+            pool.close()
+            pool.join()
+        result = [None] * len(costs)
+        for shard, part in zip(shards, parts):
+            for i, sentenceAlignment in zip(shard, part):
+                result[i] = sentenceAlignment
         return result
 
     def initialiseLexikon(self, dataset, newDataset=False):
@@ -426,95 +759,172 @@ class AlignmentModelBase():
         Create the dictionary. It actually just calls extendLexikon.
 
         @param dataset: Dataset. A dataset
-        @param newDataset: bool. Whether to return a new dataset or just modify
-                           the one referenced here.
+        @param newDataset: bool. Kept for compatibility, see extendLexikon.
 
-        @return: A lexicalised dataset.
+        @return: Corpus. A lexicalised dataset.
         """
         self.logger.info("Creating lexikon")
-        self.extendLexikon(dataset, newDataset)
-        return dataset
+        return self.extendLexikon(dataset, newDataset)
 
     def extendLexikon(self, dataset, newDataset=False):
         """
         Extend the existing dictionary. If there is no dictionary, create one.
-        It also lexicalises the dataset. Note that the dataset lexicalised here
-        naturally don't contain unknown words, as they are all included in the
-        dictionary.
+        It also lexicalises the dataset into a Corpus, which keeps the ids of
+        every factor in flat int32 arrays. Note that the dataset lexicalised
+        here naturally don't contain unknown words, as they are all included
+        in the dictionary. A Corpus given here is taken as already lexicalised
+        with the dictionary of this model and returned as it is.
+        With self.frequencyOrder set, the new words are added to the
+        dictionary by descending frequency and the Corpus uses the narrowest
+        integer type holding its ids instead of int32.
 
-        @param dataset: Dataset. A dataset
-        @param newDataset: bool. Whether to return a new dataset or just modify
-                           the one referenced here.
+        @param dataset: Dataset, Corpus or iterable of sentences. A dataset
+        @param newDataset: bool. Kept for compatibility, the dataset given is
+                           never modified as a new Corpus is always created.
 
-        @return: A lexicalised dataset.
+        @return: Corpus. A lexicalised dataset.
         """
+        if isinstance(dataset, Corpus) and dataset.fVocab is None:
+            return dataset
         if "fLex" not in vars(self) or self.fLex is None:
             self.fLex, self.eLex, self.fIndex, self.eIndex = [], [], [], []
 
-        indices = len(dataset[0][0][0])
-        self.fLex += [[] for i in range(len(self.fLex), indices)]
-        self.eLex += [[] for i in range(len(self.eLex), indices)]
-        self.fIndex += [{} for i in range(len(self.fIndex), indices)]
-        self.eIndex += [{} for i in range(len(self.eIndex), indices)]
-
-        extFIndex = [{} for i in range(indices)]
-        extEIndex = [{} for i in range(indices)]
-
-        for f, e, alignment in dataset:
-            for index in range(min(indices, len(f[0]))):
-                for fWord in f:
-                    if fWord[index] not in self.fIndex[index]:
-                        extFIndex[index][fWord[index]] = 1
-                for eWord in e:
-                    if eWord[index] not in self.eIndex[index]:
-                        extEIndex[index][eWord[index]] = 1
-        if newDataset:
-            dataset = deepcopy(dataset)
+        indices, dataset = datasetFactors(dataset)
+        if not isinstance(dataset, Corpus):
+            self.logger.info("Interning dataset")
+            dataset = internDataset(dataset, indices)
+        if self.frequencyOrder:
+            dataset = dataset.sortVocab()
+        self.compactLexikon(indices)
+        fSizes = [len(self.fLex[index]) for index in range(indices)]
+        eSizes = [len(self.eLex[index]) for index in range(indices)]
+
+        self.logger.info("Lexicalising dataset")
+        corpus = dataset.lexicalise(
+            [lexikon.extend for lexikon in self.fLex[:indices]],
+            [lexikon.extend for lexikon in self.eLex[:indices]],
+            dtype=np.int32)
+        if self.frequencyOrder:
+            corpus = corpus.narrow()
         self.logger.info("New fWords size: " +
-                         str([len(f_i) for f_i in extFIndex]) +
+                         str([len(self.fLex[index]) - fSizes[index]
+                              for index in range(indices)]) +
                          "; eWords size: " +
-                         str([len(e_i) for e_i in extEIndex]))
-        for index in range(indices):
-            c = len(self.fLex[index])
-            for key in extFIndex[index]:
-                self.fIndex[index][key] = c
-                self.fLex[index].append(key)
-                c += 1
-            c = len(self.eLex[index])
-            for key in extEIndex[index]:
-                self.eIndex[index][key] = c
-                self.eLex[index].append(key)
-                c += 1
-        self.logger.info("Rewriting dataset")
-        for f, e, alignment in dataset:
-            for i in range(len(f)):
-                f[i] = tuple(
-                    [self.fIndex[indx][f[i][indx]] for indx in range(indices)])
-            for i in range(len(e)):
-                e[i] = tuple(
-                    [self.eIndex[indx][e[i][indx]] for indx in range(indices)])
-        self.logger.info("lexikon extended")
-        return dataset
+                         str([len(self.eLex[index]) - eSizes[index]
+                              for index in range(indices)]))
+        for lexikon in self.fLex[:indices] + self.eLex[:indices]:
+            if isinstance(lexikon, HashedLexikon):
+                self.logger.info("Hashed lexikon: " +
+                                 lexikon.collisionStatistics())
+        self.logger.info("lexikon extended, lexikon size: " +
+                         str(sum([lexikon.nbytes() for lexikon in
+                                  self.fLex + self.eLex])) +
+                         " bytes, corpus size: " +
+                         str(corpus.nbytes()) + " bytes, " +
+                         str(corpus.fWords.dtype) + " ids")
+        return corpus
+
+    def compactLexikon(self, indices=0):
+        """
+        Turn the lexikons into compact Lexikon objects, and make sure there is
+        one for each of the first specified number of factors. New lexikons
+        are HashedLexikons for the factors given buckets in self.hashBuckets.
+        Models saved by
+        older versions keep their lexikons as lists of words (fLex, eLex) and
+        dicts from words to ids (fIndex, eIndex), which are converted here.
+        The lists are modified in place so shared lexikons stay shared.
+
+        @param indices: int. The number of factors needed.
+        @return: Nothing
+        """
+        for lexikons, indexes in ((self.fLex, self.fIndex),
+                                  (self.eLex, self.eIndex)):
+            for index in range(len(lexikons)):
+                if not isinstance(lexikons[index], Lexikon):
+                    lexikons[index] = Lexikon(lexikons[index])
+            lexikons += [self._newLexikon(index)
+                         for index in range(len(lexikons), indices)]
+            indexes[:] = [lexikon.index for lexikon in lexikons]
+        return
+
+    def _newLexikon(self, index):
+        if index < len(self.hashBuckets) and self.hashBuckets[index] > 0:
+            return HashedLexikon(self.hashBuckets[index])
+        return Lexikon()
+
+    def _linkLexikon(self):
+        """
+        The word to id side of a Lexikon is not saved in model files, so it is
+        linked back to the loaded Lexikon objects here.
+        """
+        entity = vars(self)
+        for lexikons, indexes in (("fLex", "fIndex"), ("eLex", "eIndex")):
+            if entity.get(lexikons) is None or entity.get(indexes) is None:
+                continue
+            lexikons, indexes = entity[lexikons], entity[indexes]
+            for index in range(min(len(lexikons), len(indexes))):
+                if isinstance(lexikons[index], Lexikon):
+                    indexes[index] = lexikons[index].index
+        return
 
     def lexiSentence(self, sentence):
         """
         Lexicalise a sentence. Handling of unknown words is defined in lexiWord
+        and lexiWords, the words of each factor are looked up in one go.
 
-        @param sentence: Sentence. A sentence.
+        @param sentence: Sentence. A sentence. Sentences taken from a Corpus
+                         are already lexicalised and returned as they are.
         @return: A lexicalised sentence.
         """
-        f, e, alignment = deepcopy(sentence)
+        if isinstance(sentence[0], np.ndarray):
+            return sentence
+        f, e, alignment = sentence
         indices = len(self.fIndex)
-        for i in range(len(f)):
-            f[i] =\
-                tuple([self.lexiWord(self.fIndex[index], f[i][index])
-                       for index in range(indices)])
-        for i in range(len(e)):
-            e[i] =\
-                tuple([self.lexiWord(self.eIndex[index], e[i][index])
-                      for index in range(indices)])
+        f = zip(*[np.asarray(self.lexiWords(
+            self.fIndex[index], [fWord[index] for fWord in f])).tolist()
+            for index in range(indices)])
+        e = zip(*[np.asarray(self.lexiWords(
+            self.eIndex[index], [eWord[index] for eWord in e])).tolist()
+            for index in range(indices)])
         return f, e, alignment
 
+    def lexiDataset(self, dataset):
+        """
+        Lexicalise a whole dataset at once. Every distinct word of the dataset
+        is looked up in the lexikon only once, through lexiWord, so unknown
+        words are handled the same way as in lexiSentence. The result is a
+        Corpus with int64 word arrays, wide enough for the ids of unknown
+        words. The dataset given is not modified.
+
+        @param dataset: Dataset or Corpus. A dataset
+        @return: Corpus. A lexicalised dataset.
+        """
+        if isinstance(dataset, Corpus) and dataset.fVocab is None:
+            return dataset
+        if not isinstance(dataset, Corpus):
+            dataset = internDataset(dataset, len(self.fIndex))
+        fLookup = [lambda words, lex=lexikon: self.lexiWords(lex, words)
+                   for lexikon in self.fIndex]
+        eLookup = [lambda words, lex=lexikon: self.lexiWords(lex, words)
+                   for lexikon in self.eIndex]
+        return dataset.lexicalise(fLookup, eLookup)
+
+    def lexiWords(self, lexikon, words):
+        """
+        Look up many words at once. The ids are those given by lexiWord, but
+        the compact Lexikon looks all of the words up in one go, so if one
+        changes the handling of unknown words in lexiWord, this method needs
+        to be overridden as well.
+
+        @param lexikon: LexikonIndex or dict. The words to ids side of a
+                        lexikon.
+        @param words: list of str. The words.
+        @return: list of int. The indices of the words.
+        """
+        if isinstance(lexikon, LexikonIndex):
+            return lexikon.lexikon.lookup(words, 424242424242)
+        return [self.lexiWord(lexikon, word) for word in words]
+
     def lexiWord(self, lexikon, word):
         """
         Handling unknown words should occur here. If the word is in the lexikon
@@ -579,6 +989,220 @@ class TestModelBase(unittest.TestCase):
         self.assertSequenceEqual(model.lexiSentence(sentence), correct)
         return
 
+    def testlexiDataset(self):
+        model = AlignmentModelBase()
+        model.fIndex = [{"a": 0, "b": 1}, {"d": 3, "e": 4}]
+        model.eIndex = [{"A": 0, "B": 1}, {"D": 3, "E": 4}]
+        dataset = [
+            ([("a", "d"), ("b", "e"), ("g", "h")], [("A", "D")], [(1, 1)]),
+            ([("b", "d")], [("G", "H"), ("B", "E")], [])
+        ]
+        corpus = model.lexiDataset(dataset)
+        self.assertEqual(len(corpus), len(dataset))
+        for sentence, lexicalised in zip(dataset, corpus):
+            correct = model.lexiSentence(sentence)
+            self.assertSequenceEqual(lexicalised[0].tolist(),
+                                     [list(w) for w in correct[0]])
+            self.assertSequenceEqual(lexicalised[1].tolist(),
+                                     [list(w) for w in correct[1]])
+            self.assertSequenceEqual(lexicalised[2], correct[2])
+        self.assertIs(model.lexiDataset(corpus), corpus)
+        return
+
+    def testExtendLexikon(self):
+        model = AlignmentModelBase()
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], []),
+            ([("b", "X")], [("B", "Y"), ("A", "Y")], [])
+        ]
+        corpus = model.extendLexikon(dataset)
+        self.assertIsInstance(model.fLex[0], Lexikon)
+        self.assertSequenceEqual(list(model.fLex[0]), ["a", "b"])
+        self.assertSequenceEqual(list(model.eLex[1]), ["X", "Y"])
+        self.assertEqual(model.eIndex[0]["B"], 1)
+        self.assertEqual(corpus.fWords.dtype, np.int32)
+        self.assertSequenceEqual(corpus[1][1].tolist(), [[1, 1], [0, 1]])
+
+        # Old lists and dicts are converted when extending
+        model = AlignmentModelBase()
+        model.fLex, model.eLex = [["b", "c"], ["Y"]], [["A"], ["X"]]
+        model.fIndex = [{"b": 0, "c": 1}, {"Y": 0}]
+        model.eIndex = [{"A": 0}, {"X": 0}]
+        corpus = model.extendLexikon(dataset)
+        self.assertSequenceEqual(list(model.fLex[0]), ["b", "c", "a"])
+        self.assertIs(model.fIndex[0].lexikon, model.fLex[0])
+        self.assertSequenceEqual(corpus[0][0].tolist(), [[2, 1], [0, 0]])
+        return
+
+    def testHashedLexikon(self):
+        model = AlignmentModelBase()
+        model.hashBuckets = [16, 0]
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], []),
+            ([("b", "X")], [("B", "Y"), ("A", "Y")], [])
+        ]
+        corpus = model.extendLexikon(dataset)
+        self.assertIsInstance(model.fLex[0], HashedLexikon)
+        self.assertNotIsInstance(model.fLex[1], HashedLexikon)
+        self.assertEqual(len(model.fLex[0]), 16)
+        self.assertEqual(len(model.eLex[1]), 2)
+        self.assertEqual(corpus[0][0][1][0], model.fIndex[0]["b"])
+        # Unseen words have buckets as well
+        f, e, alignment = model.lexiDataset(
+            [([("c", "X")], [("C", "Z")], [])])[0]
+        self.assertEqual(f[0][0], model.fIndex[0]["c"])
+        self.assertEqual(e[0][1], 424242424242)
+        return
+
+    def testFrequencyOrder(self):
+        model = AlignmentModelBase()
+        model.frequencyOrder = True
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], []),
+            ([("b", "X")], [("B", "Y"), ("B", "Y")], [])
+        ]
+        corpus = model.extendLexikon(dataset)
+        self.assertSequenceEqual(list(model.fLex[0]), ["b", "a"])
+        self.assertSequenceEqual(list(model.eLex[0]), ["B", "A"])
+        self.assertEqual(corpus.fWords.dtype, np.int8)
+        self.assertSequenceEqual(corpus[0][0].tolist(), [[1, 0], [0, 1]])
+        # Words already in the lexikon keep their ids
+        corpus = model.extendLexikon(
+            [([("c", "Z"), ("c", "Z"), ("a", "X")], [("A", "X")], [])])
+        self.assertSequenceEqual(list(model.fLex[0]), ["b", "a", "c"])
+        self.assertSequenceEqual(corpus[0][0].tolist(),
+                                 [[2, 2], [2, 2], [1, 0]])
+        return
+
+    def testUpdateTable(self):
+        model = AlignmentModelBase()
+        table = [{0: 0.5, 1: 0.5}, {1: 1.0}]
+        newTable = [{1: 0.2}, {0: 0.3}, {2: 0.4}]
+        self.assertIs(model.updateTable(table, newTable), table)
+        self.assertSequenceEqual(table, [{0: 0.5, 1: 0.2}, {0: 0.3, 1: 1.0},
+                                         {2: 0.4}])
+        return
+
+    def testStreamingDataset(self):
+        model = AlignmentModelBase()
+        dataset = [
+            ([("a", "X"), ("b", "Y")], [("A", "X")], []),
+            ([("b", "X")], [("B", "Y"), ("A", "Y")], [])
+        ]
+        corpus = model.extendLexikon(iter(dataset))
+        self.assertEqual(len(corpus), 2)
+        self.assertSequenceEqual(list(model.eLex[0]), ["A", "B"])
+        model.decodeSentence = lambda sentence: sentence[1][:, 0].tolist()
+        model.decodeChunkSize = 1
+        self.assertSequenceEqual(model.decode(iter(dataset)), [[0], [1, 0]])
+        self.assertSequenceEqual(model.decode(corpus), [[0], [1, 0]])
+        output = []
+
+        class Writer():
+            write = output.append
+
+        self.assertIsNone(model.decode(iter(dataset), output=Writer()))
+        self.assertSequenceEqual(output, [[0], [1, 0]])
+        return
+
+    def testParallelDecode(self):
+        model = AlignmentModelBase()
+        dataset = [([("a", )] * (i % 7 + 1), [("A", ), ("B", )] * (i % 5 + 1),
+                    []) for i in range(50)]
+        model.extendLexikon(dataset)
+        model.decodeSentence = lambda sentence: [(len(sentence[0]),
+                                                  len(sentence[1]))]
+        expected = model.decode(dataset)
+        model.decodeWorkers = 3
+        model.decodeChunkSize = 20
+        self.assertSequenceEqual(model.decode(dataset), expected)
+        self.assertSequenceEqual(model.decode(iter(dataset)), expected)
+        return
+
+    def testParallelDecodeThreads(self):
+        import threading
+        model = AlignmentModelBase()
+        datasets = [[([("a", )] * (i % 7 + 1 + k),
+                      [("A", ), ("B", )] * (i % 5 + 1), [])
+                     for i in range(30)] for k in range(6)]
+        for dataset in datasets:
+            model.extendLexikon(dataset)
+        model.decodeSentence = lambda sentence: [(len(sentence[0]),
+                                                  len(sentence[1]))]
+        expected = [model.decode(dataset) for dataset in datasets]
+        model.decodeWorkers = 2
+        results = [None] * len(datasets)
+
+        def work(k):
+            for repeat in range(10):
+                results[k] = model.decode(datasets[k])
+        threads = [threading.Thread(target=work, args=(k, ))
+                   for k in range(len(datasets))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertSequenceEqual(results, expected)
+        return
+
+    def testIterDecode(self):
+        model = AlignmentModelBase()
+        dataset = [([("a", )] * (i % 7 + 1), [("A", ), ("B", )] * (i % 5 + 1),
+                    []) for i in range(50)]
+        model.extendLexikon(dataset)
+        score = np.zeros((1, 1))
+        model.decodeSentence = lambda sentence: ([(len(sentence[0]),
+                                                   len(sentence[1]))], score)
+        expected = model.decode(dataset)
+        batches = list(model.iterDecode(iter(dataset), 20))
+        self.assertEqual([len(batch) for batch in batches], [20, 20, 10])
+        self.assertSequenceEqual(sum(batches, []), expected)
+        batches = model.iterDecode(dataset, 20, scores=True)
+        self.assertSequenceEqual(sum(list(batches), []),
+                                 [(item, score) for item in expected])
+        return
+
+    def testLoadSaveTranslationTable(self):
+        t = [defaultdict(float, {0: 0.5, 3: 0.25}), defaultdict(float),
+             defaultdict(float, {1: 1.0})]
+        saveTranslationTable(t, "support/dump.npz")
+        loaded = loadTranslationTable("support/dump.npz")
+        os.remove("support/dump.npz")
+        self.assertEqual(loaded, t)
+        self.assertEqual(loaded[1][2], 0.0)
+        return
+
+    def testLoadSaveLexikon(self):
+        for testFileName in ("support/dump.pkl", "support/dump.pklz"):
+            model = AlignmentModelBase()
+            model.hashBuckets = [0, 8]
+            model.extendLexikon([([("a", "x"), ("b", "y")], [("A", "X")], [])])
+            model.modelComponents = ["fLex", "eLex", "fIndex", "eIndex"]
+            model.saveModel(testFileName)
+
+            model2 = AlignmentModelBase()
+            model2.modelComponents = ["fLex", "eLex", "fIndex", "eIndex"]
+            model2.loadModel(testFileName, True)
+            self.assertSequenceEqual(list(model2.fLex[0]), ["a", "b"])
+            self.assertEqual(isinstance(model2.fLex[0].buffer, np.memmap),
+                             testFileName.endswith("pkl"))
+            self.assertIsInstance(model2.fLex[1], HashedLexikon)
+            self.assertSequenceEqual(list(model2.eLex[0]), ["A"])
+            self.assertEqual(model2.fIndex[0]["b"], 1)
+            y = model2.fLex[1].lookup(["y"])[0]
+            self.assertEqual(
+                model2.lexiSentence(([("b", "y"), ("c", "y")], [], []))[0],
+                [(1, y), (424242424242, y)])
+
+            # Saving over the file the lexikons are mapped from
+            model2.extendLexikon([([("c", "z")], [("B", "W")], [])])
+            model2.saveModel(testFileName)
+            self.assertSequenceEqual(list(model2.fLex[0]), ["a", "b", "c"])
+            model2.loadModel(testFileName, True)
+            self.assertSequenceEqual(list(model2.eLex[0]), ["A", "B"])
+            os.remove(testFileName)
+        return
+
     def testKeyDiv3D(self):
         import math
         n = 3
@@ -95,7 +95,9 @@ def checkAlignmentModel(modelClass, logger=True):
                 "(with Tag) " + str(requiredMethods2[methodName]))
             return False
 
-        args, _, _, _ = inspect.getargspec(method)
+        args, _, _, defaults = inspect.getargspec(method)
+        # Additional arguments are fine as long as they are optional
+        optionalArgs = args[len(args) - len(defaults or ()):]
         if [a for a in requiredMethods[methodName] if a not in args]:
             error(
                 "Specified Model class's '" + methodName + "' method should " +
@@ -103,10 +105,11 @@ def checkAlignmentModel(modelClass, logger=True):
                 str(requiredMethods[methodName]))
             return False
 
-        if [a for a in args if a not in requiredMethods[methodName]]:
+        if [a for a in args if a not in requiredMethods[methodName] and
+                a not in optionalArgs]:
             error(
                 "Specified Model class's '" + methodName + "' method should " +
-                "contain only the following arguments: " +
+                "contain only the following arguments, and optional ones: " +
                 str(requiredMethods[methodName]))
             return False
 
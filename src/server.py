@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+
+#
+# Alignment server of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is a long running alignment service. The model (or the forward and
+# reverse pair of models used in intersection mode, see aligner.py) is loaded
+# once, and sentence pairs are aligned on request through a local HTTP
+# endpoint, in JSON:
+#
+#     POST /align   {"sentences": [["source sentence", "target sentence"],
+#                                  ...]}
+#              ->   {"alignments": [[[1, 1], [2, 3]], ...]}
+#     POST /reload  {"model": "model.pklz"}  (both fields optional)
+#              ->   {"generation": 2}
+#     GET  /status  -> {"generation": 1, "model": "model.pklz", ...}
+#
+# A sentence is either a string of space separated words, or a list of words,
+# each a string or a list of factors (FORM, POS, etc.). Requests arriving
+# together are decoded together in one batch. Reloading loads the new models
+# next to the old ones and swaps them in between batches, so no request is
+# dropped or decoded by a half loaded model.
+#
+import os
+import json
+import time
+import Queue
+import argparse
+import importlib
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from loggers import logging, init_logger
+from models.modelChecker import checkAlignmentModel
+from fileIO import loadDataset
+from symmetrisation import methods
+from session import AlignmentSession, reversedModelFile, sentencePair
+__version__ = "0.1a"
+logger = logging.getLogger('SERVER')
+
+
+class _Request():
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        return
+
+
+class AlignmentService():
+    def __init__(self, Model, modelFile, reverseModelFile=None,
+                 symmetrisation="intersection", force=False, batchSize=256,
+                 batchDelay=0.005):
+        '''
+        Loads the models into an AlignmentSession and starts the thread
+        decoding the batches.
+
+        @param Model: class, the AlignmentModel of a module in models
+        @param modelFile: str, the model file to load
+        @param reverseModelFile: str, the file of the reverse model, for
+            symmetrised alignments. None to use the forward model only.
+        @param symmetrisation: str, see symmetrisation.symmetrise
+        @param force: bool, see loadModel of the models
+        @param batchSize: int, the number of sentences up to which concurrent
+            requests are put together into a batch
+        @param batchDelay: float, the time in seconds a batch waits for more
+            requests after the first one
+        '''
+        self.session = AlignmentSession(Model, modelFile, reverseModelFile,
+                                        symmetrisation, force, batchSize)
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.lock = threading.Lock()
+        self.reloadLock = threading.Lock()
+        self.sentences = 0
+        self.batches = 0
+        self.generation = 1
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def reload(self, modelFile=None, reverseModelFile=None):
+        '''
+        Load the model files again, or new ones. The current models keep
+        decoding until the new ones are completely loaded.
+
+        @param modelFile: str, the new model file, the current one if None
+        @param reverseModelFile: str, the new reverse model file, the current
+            one if None
+        @return: int, the number of times models have been loaded
+        '''
+        with self.reloadLock:
+            self.session.reload(modelFile, reverseModelFile)
+            with self.lock:
+                self.generation += 1
+                return self.generation
+
+    def align(self, dataset):
+        '''
+        Align sentences, together with those of any other concurrent request.
+
+        @param dataset: Dataset, the sentences to align
+        @return: Alignment, the alignment of each sentence
+        '''
+        if len(dataset) == 0:
+            return []
+        request = _Request(dataset)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        '''
+        Stop the decoding thread, once the requests queued are answered.
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        return
+
+    def status(self):
+        '''
+        @return: dict, the models in use and what has been decoded so far
+        '''
+        with self.lock:
+            return {"generation": self.generation,
+                    "model": self.session.modelFile,
+                    "reverseModel": self.session.reverseModelFile,
+                    "symmetrisation": self.session.symmetrisation,
+                    "sentences": self.sentences,
+                    "batches": self.batches}
+
+    def _run(self):
+        while True:
+            requests = [self.queue.get()]
+            if requests[0] is None:
+                return
+            size = len(requests[0].dataset)
+            deadline = time.time() + self.batchDelay
+            while size < self.batchSize:
+                try:
+                    request = self.queue.get(
+                        timeout=max(deadline - time.time(), 0))
+                except Queue.Empty:
+                    break
+                if request is None:
+                    # Stop after this batch
+                    self.queue.put(None)
+                    break
+                requests.append(request)
+                size += len(request.dataset)
+
+            try:
+                dataset = []
+                for request in requests:
+                    dataset += request.dataset
+                alignment = self.session.align(dataset)
+                start = 0
+                for request in requests:
+                    request.result =\
+                        alignment[start:start + len(request.dataset)]
+                    start += len(request.dataset)
+                with self.lock:
+                    self.sentences += len(dataset)
+                    self.batches += 1
+            except Exception as e:
+                logger.error("Decoding failed: " + repr(e))
+                for request in requests:
+                    request.error = e
+            for request in requests:
+                request.done.set()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def _reply(self, code, content):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._reply(404, {"error": "Unknown path " + self.path})
+            return
+        self._reply(200, self.server.service.status())
+        return
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.getheader("Content-Length", 0))
+            content = json.loads(self.rfile.read(length)) if length else {}
+            if not isinstance(content, dict):
+                raise ValueError("Request must be a JSON object")
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+
+        service = self.server.service
+        if self.path == "/align":
+            try:
+                dataset = [sentencePair(pair)
+                           for pair in content.get("sentences", [])]
+            except (TypeError, ValueError) as e:
+                self._reply(400, {"error": "Invalid sentences: " + str(e)})
+                return
+            try:
+                self._reply(200, {"alignments": service.align(dataset)})
+            except Exception as e:
+                self._reply(500, {"error": repr(e)})
+        elif self.path == "/reload":
+            try:
+                self._reply(200, {"generation": service.reload(
+                    content.get("model"), content.get("reverseModel"))})
+            except Exception as e:
+                logger.error("Reloading failed: " + repr(e))
+                self._reply(500, {"error": repr(e)})
+        else:
+            self._reply(404, {"error": "Unknown path " + self.path})
+        return
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+        return
+
+
+class AlignmentHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host="127.0.0.1", port=8080):
+        '''
+        @param service: AlignmentService, the service answering requests
+        @param host: str, the address to listen on
+        @param port: int, the port to listen on, 0 for any free port
+        '''
+        HTTPServer.__init__(self, (host, port), _RequestHandler)
+        self.service = service
+        return
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        from models.IBM1 import AlignmentModel
+        self.dataset = loadDataset(("support/ut_source.txt", ),
+                                   ("support/ut_target.txt", ),
+                                   linesToLoad=20)
+        self.modelFiles = ["support/ut_server.pkl",
+                           "support/ut_server.rev.pkl"]
+        self.models = []
+        for dataset, fileName in zip(
+                (self.dataset, [(e, f, []) for f, e, a in self.dataset]),
+                self.modelFiles):
+            model = AlignmentModel()
+            model.train(dataset, 1)
+            model.saveModel(fileName)
+            self.models.append(model)
+        self.Model = AlignmentModel
+        return
+
+    def tearDown(self):
+        for fileName in self.modelFiles:
+            if os.path.isfile(fileName):
+                os.remove(fileName)
+        return
+
+    def testBatching(self):
+        service = AlignmentService(self.Model, self.modelFiles[0],
+                                   batchSize=8, batchDelay=0.05)
+        expected = self.models[0].decode(self.dataset)
+        results = [None] * 5
+
+        def work(k):
+            results[k] = service.align(self.dataset[k * 4:k * 4 + 4])
+        threads = [threading.Thread(target=work, args=(k, ))
+                   for k in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertSequenceEqual(sum(results, []), expected)
+        self.assertEqual(service.status()["sentences"], 20)
+        self.assertTrue(service.status()["batches"] < 5)
+        service.close()
+        return
+
+    def testHTTP(self):
+        import urllib2
+        service = AlignmentService(self.Model, self.modelFiles[0],
+                                   self.modelFiles[1])
+        server = AlignmentHTTPServer(service, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+        try:
+            sentences = [[" ".join([word[0] for word in f]),
+                          [word[0] for word in e]]
+                         for f, e, alignment in self.dataset[:3]]
+            reply = json.loads(urllib2.urlopen(
+                url + "/align", json.dumps({"sentences": sentences})).read())
+            self.assertSequenceEqual(
+                [[tuple(link) for link in sentence]
+                 for sentence in reply["alignments"]],
+                service.align(self.dataset[:3]))
+            reply = json.loads(urllib2.urlopen(url + "/reload", "{}").read())
+            self.assertEqual(reply["generation"], 2)
+            status = json.loads(urllib2.urlopen(url + "/status").read())
+            self.assertEqual(status["generation"], 2)
+            self.assertEqual(status["reverseModel"], self.modelFiles[1])
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+        return
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description="""SFU HMM Aligner server %s""" % __version__)
+    ap.add_argument(
+        "-m", "--model", dest="model", default="IBM1",
+        help="model to use, default is IBM1")
+    ap.add_argument(
+        "-l", "--loadModel", dest="loadModel", required=True,
+        help="Specify the model file to load")
+    ap.add_argument(
+        "--forceLoad", dest="forceLoad", action='store_true',
+        help="Ignore version and force loading model file")
+    ap.add_argument(
+        "--intersect", dest="intersect", action='store_true',
+        help="Also load the reverse model saved by the aligner in " +
+             "intersection mode, and symmetrise the alignments")
+    ap.add_argument(
+        "--symmetrise", dest="symmetrisation", choices=methods,
+        default="intersection",
+        help="How the alignments of both directions are combined in " +
+             "--intersect mode, default intersection")
+    ap.add_argument(
+        "--host", dest="host", default="127.0.0.1",
+        help="Address to listen on, default 127.0.0.1")
+    ap.add_argument(
+        "--port", dest="port", type=int, default=8080,
+        help="Port to listen on, default 8080")
+    ap.add_argument(
+        "--batch-size", dest="batchSize", type=int, default=256,
+        help="Number of sentences up to which concurrent requests are " +
+             "decoded together, default 256")
+    ap.add_argument(
+        "--batch-delay", dest="batchDelay", type=float, default=0.005,
+        help="Seconds a batch waits for more requests, default 0.005")
+    args = ap.parse_args()
+
+    init_logger('server.log')
+    logger.info("Loading model: " + args.model)
+    Model = importlib.import_module("models." + args.model).AlignmentModel
+    if not checkAlignmentModel(Model):
+        raise TypeError("Invalid Model class")
+    service = AlignmentService(
+        Model, args.loadModel,
+        reversedModelFile(args.loadModel) if args.intersect else None,
+        args.symmetrisation, args.forceLoad, args.batchSize, args.batchDelay)
+    server = AlignmentHTTPServer(service, args.host, args.port)
+    logger.info("Listening on %s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
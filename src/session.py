@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+#
+# Alignment session of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the interface for using the aligner as a library, from within
+# another Python programme. A session loads a saved model (or the forward and
+# reverse pair of models saved in intersection mode, see aligner.py) once,
+# and keeps it in memory to align any number of sentence pairs, given either
+# directly or in files, without temporary files or starting aligner.py:
+#
+#     from session import AlignmentSession
+#     session = AlignmentSession("HMM", "model.pklz")
+#     session.align([("source sentence", "target sentence"), ...])
+#     session.alignFile("corpus.txt", outputFile="corpus.wa")
+#
+import os
+import importlib
+import threading
+import unittest
+from loggers import logging
+from models.modelChecker import checkAlignmentModel
+from corpus import iterChunks
+from fileIO import AlignmentBuilder, AlignmentWriter, iterDataset, openFile,\
+    parseStreamLine, loadDataset, exportToFile
+from symmetrisation import symmetrise, methods
+__version__ = "0.1a"
+logger = logging.getLogger('SESSION')
+
+
+def reversedModelFile(fileName):
+    '''
+    @param fileName: str, the file of a forward model
+    @return: str, the file of the matching reverse model, as saved by the
+        aligner in intersection mode
+    '''
+    return ".".join(fileName.split(".")[:-1] + ["rev"] +
+                    [fileName.split(".")[-1]])
+
+
+def _sentence(words):
+    # A sentence as a list of tuples of factors
+    if isinstance(words, basestring):
+        words = words.split()
+    return [(word, ) if isinstance(word, basestring) else tuple(word)
+            for word in words]
+
+
+def sentencePair(pair):
+    '''
+    @param pair: the source and target language sentences. Each is either a
+        string of space separated words, or a list of words, each a string or
+        a tuple of factors (FORM, POS, etc.). Sentences of a Dataset are
+        accepted too, their alignment is dropped.
+    @return: sentence of a Dataset, with an empty alignment
+    '''
+    return (_sentence(pair[0]), _sentence(pair[1]), [])
+
+
+class AlignmentSession():
+    def __init__(self, model, modelFile, reverseModelFile=None,
+                 symmetrisation="intersection", force=False, batchSize=1000,
+                 decodeWorkers=1):
+        '''
+        Loads the models, which then stay in memory until the session is
+        dropped. A session can be shared by several threads. With more than
+        one decodeWorkers, the batches of different threads are decoded one
+        after the other, each by all of the worker processes.
+
+        @param model: str or class, the name of a module in models, such as
+            "HMM", or its AlignmentModel
+        @param modelFile: str, the model file to load
+        @param reverseModelFile: str, the file of the reverse model, for
+            symmetrised alignments. None to use the forward model only.
+        @param symmetrisation: str, see symmetrisation.symmetrise
+        @param force: bool, see loadModel of the models
+        @param batchSize: int, the number of sentences decoded together
+        @param decodeWorkers: int, the number of processes decoding each
+            batch, see AlignmentModelBase.decode
+        '''
+        if symmetrisation not in methods:
+            raise ValueError("Unknown symmetrisation method: " +
+                             str(symmetrisation))
+        if isinstance(model, basestring):
+            model = importlib.import_module("models." + model).AlignmentModel
+            if not checkAlignmentModel(model):
+                raise TypeError("Invalid Model class")
+        self.Model = model
+        self.symmetrisation = symmetrisation
+        self.force = force
+        self.batchSize = batchSize
+        self.decodeWorkers = decodeWorkers
+        self.decodeLock = threading.Lock()
+        self.models = self._load(modelFile, reverseModelFile)
+        self.modelFile = modelFile
+        self.reverseModelFile = reverseModelFile
+        return
+
+    def _load(self, modelFile, reverseModelFile):
+        models = []
+        for fileName in (modelFile, reverseModelFile):
+            if fileName is None:
+                continue
+            model = self.Model()
+            model.loadModel(fileName, force=self.force)
+            model.decodeWorkers = self.decodeWorkers
+            models.append(model)
+        return models
+
+    def reload(self, modelFile=None, reverseModelFile=None):
+        '''
+        Load the model files again, or new ones. Alignments already under way
+        finish with the models they started with.
+
+        @param modelFile: str, the new model file, the current one if None
+        @param reverseModelFile: str, the new reverse model file, the current
+            one if None
+        '''
+        if modelFile is None:
+            modelFile = self.modelFile
+        if reverseModelFile is None:
+            reverseModelFile = self.reverseModelFile
+        self.models = self._load(modelFile, reverseModelFile)
+        self.modelFile = modelFile
+        self.reverseModelFile = reverseModelFile
+        logger.info("Models reloaded from " + str(modelFile) +
+                    (", " + reverseModelFile if reverseModelFile else ""))
+        return
+
+    def align(self, pairs):
+        '''
+        Align sentence pairs.
+
+        @param pairs: list of pairs of sentences, see sentencePair
+        @return: Alignment, the alignment of each sentence
+        '''
+        return list(self.iterAlign(pairs))
+
+    def iterAlign(self, pairs):
+        '''
+        Align sentence pairs lazily, self.batchSize sentences at a time.
+
+        @param pairs: iterable of pairs of sentences, see sentencePair
+        @return: generator of SentenceAlignments
+        '''
+        models = self.models
+        dataset = (sentencePair(pair) for pair in pairs)
+        for batch in iterChunks(dataset, self.batchSize):
+            for sentenceAlignment in self._alignBatch(models, batch):
+                yield sentenceAlignment
+        return
+
+    def alignFile(self, sourceFile, targetFile=None, outputFile=None):
+        '''
+        Align the sentence pairs of a file, or of a pair of files.
+
+        @param sourceFile: str, a file of "source ||| target" lines (see
+            fileIO.parseStreamLine) when targetFile is None. Otherwise the
+            source language file, or a list of files of its factors (FORM,
+            POS, etc.), as in fileIO.loadDataset.
+        @param targetFile: str or list of str, the target language files
+        @param outputFile: str, the file to write the alignment to, in the
+            format of fileIO.exportToFile. None to return it instead.
+        @return: Alignment, or nothing when outputFile is given
+        '''
+        if targetFile is None:
+            dataset = self._iterPairFile(sourceFile)
+        else:
+            if isinstance(sourceFile, basestring):
+                sourceFile = (sourceFile, )
+            if isinstance(targetFile, basestring):
+                targetFile = (targetFile, )
+            dataset = iterDataset(sourceFile, targetFile)
+        if outputFile is None:
+            return self.align(dataset)
+        with AlignmentWriter(outputFile) as writer:
+            for sentenceAlignment in self.iterAlign(dataset):
+                writer.write(sentenceAlignment)
+        return None
+
+    def _iterPairFile(self, fileName):
+        inputFile = openFile(fileName)
+        try:
+            for line in inputFile:
+                yield parseStreamLine(line)
+        finally:
+            inputFile.close()
+        return
+
+    def _alignBatch(self, models, dataset):
+        if self.decodeWorkers > 1:
+            # Forking from several threads at once can leave locks held by
+            # the other threads locked in the worker processes
+            with self.decodeLock:
+                return self._decodeBatch(models, dataset)
+        return self._decodeBatch(models, dataset)
+
+    def _decodeBatch(self, models, dataset):
+        results = []
+        for model, sentences in zip(models, (dataset, [
+                (e, f, []) for f, e, alignment in dataset])):
+            builder = AlignmentBuilder()
+            model.decode(sentences, output=builder)
+            results.append(builder.alignment())
+        if len(results) > 1:
+            results = [symmetrise(results[0], results[1].reversed(),
+                                  self.symmetrisation)]
+        return [sentence["certain"] for sentence in results[0]]
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        from models.IBM1 import AlignmentModel
+        self.dataset = loadDataset(("support/ut_source.txt", ),
+                                   ("support/ut_target.txt", ),
+                                   linesToLoad=20)
+        self.modelFiles = ["support/ut_session.pkl",
+                           "support/ut_session.rev.pkl"]
+        self.models = []
+        for dataset, fileName in zip(
+                (self.dataset, [(e, f, []) for f, e, a in self.dataset]),
+                self.modelFiles):
+            model = AlignmentModel()
+            model.train(dataset, 1)
+            model.saveModel(fileName)
+            self.models.append(model)
+        self.pairFile = "support/ut_session.txt"
+        self.outputFile = "support/ut_session.wa"
+        return
+
+    def tearDown(self):
+        for fileName in self.modelFiles + [self.pairFile, self.outputFile]:
+            if os.path.isfile(fileName):
+                os.remove(fileName)
+        return
+
+    def testAlign(self):
+        session = AlignmentSession("IBM1", self.modelFiles[0], batchSize=8)
+        expected = self.models[0].decode(self.dataset)
+        pairs = [(" ".join([word[0] for word in f]), [word[0] for word in e])
+                 for f, e, alignment in self.dataset]
+        self.assertSequenceEqual(session.align(pairs), expected)
+        self.assertSequenceEqual(session.align(self.dataset), expected)
+        self.assertSequenceEqual(list(session.iterAlign(iter(pairs))),
+                                 expected)
+        return
+
+    def testThreads(self):
+        session = AlignmentSession("IBM1", self.modelFiles[0], batchSize=4,
+                                   decodeWorkers=2)
+        expected = self.models[0].decode(self.dataset)
+        results = [None] * 4
+
+        def work(k):
+            for repeat in range(3):
+                results[k] = session.align(self.dataset[k * 5:k * 5 + 5])
+        threads = [threading.Thread(target=work, args=(k, ))
+                   for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertSequenceEqual(sum(results, []), expected)
+        return
+
+    def testAlignFile(self):
+        session = AlignmentSession("IBM1", self.modelFiles[0],
+                                   self.modelFiles[1], "union", batchSize=8)
+        expected = session.align(self.dataset)
+        with open(self.pairFile, "w") as pairFile:
+            for f, e, alignment in self.dataset:
+                pairFile.write(" ".join([word[0] for word in f]) + " ||| " +
+                               " ".join([word[0] for word in e]) + "\n")
+        self.assertSequenceEqual(session.alignFile(self.pairFile), expected)
+        alignment = session.alignFile("support/ut_source.txt",
+                                      "support/ut_target.txt")
+        self.assertSequenceEqual(alignment[:len(expected)], expected)
+        session.alignFile(self.pairFile, outputFile=self.outputFile)
+        exportToFile(expected, self.pairFile)
+        with open(self.pairFile) as expectedFile:
+            with open(self.outputFile) as outputFile:
+                self.assertEqual(outputFile.read(), expectedFile.read())
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+#
+# Parameter sweep of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the programme that decodes a development set with one trained HMM
+# model over a grid of values of p0H, the probability of going to a NULL
+# state, and of nullEmissionProb, the probability of a NULL state emitting a
+# word. Neither needs the model to be trained again: the model keeps the raw
+# transition probabilities and gives the NULL states their share at decoding
+# time, and the NULL emission probability is only used in decoding.
+#
+#     python sweep.py -m HMM -l model.pklz -s dev.cn -t dev.en -r dev.wa \
+#         --p0H 0.1 0.2 0.3 --nullEmissionProb 0.000005 0.0001 -w 4
+#
+# The grid points are decoded by a pool of processes, forked once the model
+# is loaded and the development set lexicalised, so they inherit both. The
+# scores of every grid point are written to one file, as JSON.
+#
+import os
+import sys
+import json
+import argparse
+import importlib
+import multiprocessing
+import unittest
+from itertools import chain
+from loggers import logging, init_logger
+from models.modelChecker import checkAlignmentModel
+from fileIO import loadDataset, loadAlignment, findFile
+__version__ = "0.1a"
+logger = logging.getLogger('SWEEP')
+
+# The sweep whose grid points are decoded by the worker processes, set before
+# they are forked
+_sweep = None
+
+
+def _decodePoint(point):
+    return _sweep.decodePoint(point)
+
+
+class ParameterSweep():
+    def __init__(self, Model, modelFile, dataset, reference, force=False):
+        '''
+        Loads the model, and lexicalises the development set.
+
+        @param Model: class, the AlignmentModel of an HMM module in models
+        @param modelFile: str, the model file to load
+        @param dataset: Dataset, the development set
+        @param reference: GoldAlignment, the reference alignment of the
+            development set
+        @param force: bool, see loadModel of the models
+        '''
+        self.model = Model()
+        if "p0H" not in vars(self.model):
+            raise TypeError("Only HMM models can be swept")
+        self.model.loadModel(modelFile, force=force)
+        self.dataset = self.model.lexiDataset(dataset)
+        self.reference = reference
+        return
+
+    def decodePoint(self, point):
+        '''
+        Decode and evaluate the development set at a grid point.
+
+        @param point: (float, float), the p0H and the nullEmissionProb
+        @return: dict, the p0H, the nullEmissionProb and the scores given by
+            the evaluator of the model
+        '''
+        model = self.model
+        oldPoint = model.p0H, model.nullEmissionProb
+        model.p0H, model.nullEmissionProb = point
+        logger.info("Decoding with p0H = %s, nullEmissionProb = %s" % point)
+        try:
+            scores = model.evaluate(
+                chain.from_iterable(model.iterDecode(self.dataset)),
+                self.reference)
+        finally:
+            model.p0H, model.nullEmissionProb = oldPoint
+        return {"p0H": point[0],
+                "nullEmissionProb": point[1],
+                "scores": scores}
+
+    def run(self, p0Hs, nullEmissionProbs, workers=1):
+        '''
+        Decode and evaluate the development set at every grid point.
+
+        @param p0Hs: list of float, the values of p0H
+        @param nullEmissionProbs: list of float, the values of
+            nullEmissionProb
+        @param workers: int, the number of grid points decoded at the same
+            time, each in a process of its own
+        @return: list of dict, the result of each grid point, see decodePoint
+        '''
+        global _sweep
+        points = [(p0H, nullEmissionProb) for p0H in p0Hs
+                  for nullEmissionProb in nullEmissionProbs]
+        if workers <= 1:
+            return [self.decodePoint(point) for point in points]
+        _sweep = self
+        pool = multiprocessing.Pool(min(workers, len(points)))
+        try:
+            return pool.map(_decodePoint, points)
+        finally:
+            pool.close()
+            pool.join()
+            _sweep = None
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.dataset = loadDataset(["support/ut_align_no_tag.cn"],
+                                   ["support/ut_align_no_tag.en"],
+                                   linesToLoad=100)
+        self.reference = loadAlignment("support/ut_align_no_type.a",
+                                       linesToLoad=100)
+        self.modelFile = "support/ut_sweep.pkl"
+        return
+
+    def tearDown(self):
+        if os.path.isfile(self.modelFile):
+            os.remove(self.modelFile)
+        return
+
+    def testRun(self):
+        from models.HMM import AlignmentModel
+        model = AlignmentModel()
+        model.train(self.dataset, 1)
+        model.saveModel(self.modelFile)
+        sweep = ParameterSweep(AlignmentModel, self.modelFile, self.dataset,
+                               self.reference)
+        results = sweep.run([0.1, 0.3], [0.000005, 0.001], workers=2)
+        self.assertEqual([(result["p0H"], result["nullEmissionProb"])
+                          for result in results],
+                         [(0.1, 0.000005), (0.1, 0.001),
+                          (0.3, 0.000005), (0.3, 0.001)])
+        self.assertEqual(sweep.model.p0H, 0.3)
+        for result in results[:2]:
+            # The same as when the model is trained with that p0H
+            model = AlignmentModel()
+            model.p0H = result["p0H"]
+            model.nullEmissionProb = result["nullEmissionProb"]
+            model.train(self.dataset, 1)
+            self.assertEqual(result["scores"], model.evaluate(
+                model.decode(self.dataset), self.reference))
+        self.assertEqual(results[2]["scores"], sweep.decodePoint(
+            (0.3, 0.000005))["scores"])
+        return
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description="""SFU HMM Aligner parameter sweep %s""" % __version__)
+    ap.add_argument(
+        "-m", "--model", dest="model", default="HMM",
+        help="model to use, default is HMM")
+    ap.add_argument(
+        "-l", "--loadModel", dest="loadModel", required=True,
+        help="Specify the model file to load")
+    ap.add_argument(
+        "--forceLoad", dest="forceLoad", action='store_true',
+        help="Ignore version and force loading model file")
+    ap.add_argument(
+        "-s", "--source", dest="source", nargs="+", required=True,
+        help="Source language files of the development set, the FORMs " +
+             "first, then the POS tags if the model uses them")
+    ap.add_argument(
+        "-t", "--target", dest="target", nargs="+", required=True,
+        help="Target language files of the development set, in the same " +
+             "order")
+    ap.add_argument(
+        "-r", "--reference", dest="reference", required=True,
+        help="Reference alignment of the development set")
+    ap.add_argument(
+        "-v", "--testSize", dest="testSize", type=int, default=sys.maxint,
+        help="Number of sentences of the development set to use")
+    ap.add_argument(
+        "--p0H", dest="p0H", type=float, nargs="+", default=[0.3],
+        help="Values of p0H to try, default 0.3")
+    ap.add_argument(
+        "--nullEmissionProb", dest="nullEmissionProb", type=float,
+        nargs="+", default=[0.000005],
+        help="Values of nullEmissionProb to try, default 0.000005")
+    ap.add_argument(
+        "-w", "--workers", dest="workers", type=int, default=1,
+        help="Number of grid points decoded at the same time, default 1")
+    ap.add_argument(
+        "-o", "--results", dest="results", default="sweep.json",
+        help="File to write the results of the grid points to, default " +
+             "sweep.json")
+    args = ap.parse_args()
+
+    init_logger('sweep.log')
+    Model = importlib.import_module("models." + args.model).AlignmentModel
+    if not checkAlignmentModel(Model):
+        raise TypeError("Invalid Model class")
+    dataset = loadDataset([findFile(fileName) for fileName in args.source],
+                          [findFile(fileName) for fileName in args.target],
+                          linesToLoad=args.testSize)
+    reference = loadAlignment(findFile(args.reference),
+                              linesToLoad=args.testSize)
+    sweep = ParameterSweep(Model, args.loadModel, dataset, reference,
+                           args.forceLoad)
+    results = sweep.run(args.p0H, args.nullEmissionProb, args.workers)
+    with open(args.results, "w") as resultsFile:
+        json.dump(results, resultsFile, indent=4, sort_keys=True)
+    for result in results:
+        logger.info("p0H = %s, nullEmissionProb = %s: " % (
+            result["p0H"], result["nullEmissionProb"]) + ", ".join(
+            ["%s = %s" % item for item in sorted(result["scores"].items())]))
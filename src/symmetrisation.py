@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+#
+# Symmetrisation of HMM Aligner
+# Simon Fraser University
+# NLP Lab
+#
+# This is the symmetrisation of the alignments produced by two models trained
+# in opposite directions (see the --intersect option of the aligner). Each
+# side is taken as a fileIO.CompactAlignment in source-target orientation.
+# Intersection and union are done for all of the sentences at once, on
+# sorted link arrays; the grow-diag heuristics add links one sentence at a
+# time, in the order of the usual definition:
+#
+#     Koehn, Och and Marcu (2003). Statistical Phrase-Based Translation.
+#
+# Links carrying an alignment type only match links of the same type in the
+# intersection; elsewhere the type of the forward link is kept when both
+# sides have the link. Probable links are ignored.
+#
+import os
+import sys
+import inspect
+import optparse
+import unittest
+from bisect import insort
+import numpy as np
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, currentdir)
+from fileIO import CompactAlignment, iterAlignment, openFile,\
+    formatAlignment, loadAlignment
+from loggers import logging, init_logger
+if __name__ == '__main__':
+    init_logger('symmetrisation.log')
+logger = logging.getLogger('SYMMETRISATION')
+__version__ = "0.1a"
+
+methods = ("intersection", "union", "grow-diag", "grow-diag-final",
+           "grow-diag-final-and")
+
+_neighbours = ((-1, 0), (0, -1), (1, 0), (0, 1),
+               (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def _links(alignment, typeMapping):
+    # The certain links as one (n, 4) array of (sentence, f, e, type) rows,
+    # with the types renumbered by typeMapping
+    certain = ~alignment.probable
+    sentences = np.repeat(np.arange(len(alignment)),
+                          np.diff(alignment.offsets))[certain]
+    types = alignment.types[certain]
+    types = np.where(types < 0, -1,
+                     typeMapping[np.maximum(types, 0)] if len(typeMapping)
+                     else -1)
+    return np.column_stack((sentences, alignment.f[certain],
+                            alignment.e[certain], types)).astype(np.int64)
+
+
+def _rowKeys(rows):
+    # One comparable item per row, to use rows with np.in1d and np.unique
+    rows = np.ascontiguousarray(rows)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize *
+                                rows.shape[1]))).ravel()
+
+
+def _compact(rows, sentences, typeList):
+    # Build a CompactAlignment from (sentence, f, e, type) rows sorted by
+    # sentence
+    offsets = np.zeros(sentences + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[:, 0], minlength=sentences), out=offsets[1:])
+    return CompactAlignment(offsets,
+                            rows[:, 1].astype(np.int32),
+                            rows[:, 2].astype(np.int32),
+                            rows[:, 3].astype(np.int32),
+                            np.zeros(len(rows), dtype=np.bool_),
+                            typeList)
+
+
+def _growDiag(alignment, union, eAligned, fAligned):
+    # alignment and union are sets of (e, f). Every link of the alignment is
+    # visited in (e, f) order, and a neighbouring link of the union is added
+    # when one of its words is still unaligned. Links added behind the
+    # current one are visited in the same pass, as in a scan of the whole
+    # alignment matrix, and passes are repeated until nothing is added.
+    added = True
+    while added:
+        added = False
+        points = sorted(alignment)
+        i = 0
+        while i < len(points):
+            e, f = points[i]
+            i += 1
+            for de, df in _neighbours:
+                point = (e + de, f + df)
+                if point in union and point not in alignment and\
+                        (point[0] not in eAligned or
+                         point[1] not in fAligned):
+                    alignment.add(point)
+                    eAligned.add(point[0])
+                    fAligned.add(point[1])
+                    added = True
+                    if point > (e, f):
+                        insort(points, point, i)
+    return
+
+
+def _final(alignment, links, eAligned, fAligned, both):
+    # Add the links of one direction whose words are still unaligned, either
+    # or both of them
+    for point in sorted(links):
+        if point in alignment:
+            continue
+        eFree = point[0] not in eAligned
+        fFree = point[1] not in fAligned
+        if (eFree and fFree) if both else (eFree or fFree):
+            alignment.add(point)
+            eAligned.add(point[0])
+            fAligned.add(point[1])
+    return
+
+
+def symmetrise(forward, backward, method="intersection"):
+    '''
+    This function is used to combine the alignments of the same sentences
+    produced by two models trained in opposite directions.
+
+    @param forward: CompactAlignment, the alignment of the source to target
+        model
+    @param backward: CompactAlignment, the alignment of the target to source
+        model, with the positions swapped into source-target orientation (see
+        CompactAlignment.reversed)
+    @param* method: str, one of intersection, union, grow-diag,
+        grow-diag-final and grow-diag-final-and
+    @return: CompactAlignment, with certain links only
+    '''
+    if method not in methods:
+        raise ValueError("Unknown symmetrisation method: " + str(method))
+    if len(forward) != len(backward):
+        raise ValueError("The alignments differ in number of sentences")
+
+    # Both sides use the alignment types of the forward alignment, followed
+    # by those only found in the backward one
+    typeList = list(forward.typeList)
+    typeIndex = dict([(t, i) for i, t in enumerate(typeList)])
+    for alignmentType in backward.typeList:
+        if alignmentType not in typeIndex:
+            typeIndex[alignmentType] = len(typeList)
+            typeList.append(alignmentType)
+    forwardRows = _links(forward, np.arange(len(forward.typeList)))
+    backwardRows = _links(backward, np.array(
+        [typeIndex[t] for t in backward.typeList], dtype=np.int64))
+
+    if method == "intersection":
+        # Keep the forward links, in their order, that the backward
+        # alignment also has with the same type
+        rows = forwardRows[np.in1d(_rowKeys(forwardRows),
+                                   _rowKeys(backwardRows))]
+        return _compact(rows, len(forward), typeList)
+
+    # Links of the backward alignment missing from the forward one, whatever
+    # their type. They come after the forward links of the same sentence.
+    extra = backwardRows[~np.in1d(_rowKeys(backwardRows[:, :3]),
+                                  _rowKeys(forwardRows[:, :3]))]
+    unused, first = np.unique(_rowKeys(extra[:, :3]), return_index=True)
+    extra = extra[np.sort(first)]
+    rows = np.concatenate((forwardRows, extra))
+    rows = rows[np.argsort(rows[:, 0], kind="mergesort")]
+    if method == "union":
+        return _compact(rows, len(forward), typeList)
+
+    # The grow-diag heuristics start from the intersection, regardless of
+    # alignment types, and grow it within the union
+    result = []
+    forwardOffsets = np.searchsorted(forwardRows[:, 0],
+                                     np.arange(len(forward) + 1))
+    backwardOffsets = np.searchsorted(backwardRows[:, 0],
+                                      np.arange(len(forward) + 1))
+    unionOffsets = np.searchsorted(rows[:, 0], np.arange(len(forward) + 1))
+    forwardLinks = forwardRows[:, 1:3].tolist()
+    backwardLinks = backwardRows[:, 1:3].tolist()
+    unionLinks = rows[:, 1:4].tolist()
+    for i in range(len(forward)):
+        forwardSet = set([(e, f) for f, e in forwardLinks[
+            forwardOffsets[i]:forwardOffsets[i + 1]]])
+        backwardSet = set([(e, f) for f, e in backwardLinks[
+            backwardOffsets[i]:backwardOffsets[i + 1]]])
+        types = dict([((e, f), t) for f, e, t in unionLinks[
+            unionOffsets[i]:unionOffsets[i + 1]]])
+        alignment = forwardSet & backwardSet
+        eAligned = set([e for e, f in alignment])
+        fAligned = set([f for e, f in alignment])
+        _growDiag(alignment, forwardSet | backwardSet, eAligned, fAligned)
+        if method != "grow-diag":
+            both = method == "grow-diag-final-and"
+            _final(alignment, forwardSet, eAligned, fAligned, both)
+            _final(alignment, backwardSet, eAligned, fAligned, both)
+        result += [(i, f, e, types[(e, f)]) for e, f in
+                   sorted(alignment, key=lambda point: point[::-1])]
+    return _compact(np.array(result, dtype=np.int64).reshape(-1, 4),
+                    len(forward), typeList)
+
+
+def symmetriseFiles(forwardFile, backwardFile, outputFile,
+                    method="intersection", blockSize=100000, reverse=True):
+    '''
+    This function is used to symmetrise two alignment files into a third, a
+    block of lines at a time, so the files are never held in memory as a
+    whole. The positions are written out as they are read.
+
+    @param forwardFile: str, the alignment of the source to target model
+    @param backwardFile: str, the alignment of the target to source model
+    @param outputFile: str, the file to write to, see fileIO.openFile
+    @param* method: str, see symmetrise
+    @param* blockSize: int, the number of sentences in each block
+    @param* reverse: bool, whether the backward file is in target-source
+        orientation, as written by the reversed model of the aligner
+    @return: int, the number of sentences written
+    '''
+    output = openFile(outputFile, "w")
+    count = 0
+    try:
+        backwardBlocks = iterAlignment(backwardFile, blockSize, reverse)
+        for forward in iterAlignment(forwardFile, blockSize):
+            backward = next(backwardBlocks, None)
+            if backward is None or len(backward) != len(forward):
+                raise ValueError("The alignment files differ in length")
+            output.writelines([formatAlignment(sentence["certain"]) for
+                               sentence in symmetrise(forward, backward,
+                                                      method)])
+            count += len(forward)
+        if next(backwardBlocks, None) is not None:
+            raise ValueError("The alignment files differ in length")
+    finally:
+        output.close()
+    logger.info("Symmetrised " + str(count) + " sentences with " + method)
+    return count
+
+
+class TestSymmetrisation(unittest.TestCase):
+    def alignment(self, sentences):
+        fileName = "support/ut_symmetrisation.a"
+        output = open(fileName, "w")
+        output.write("".join([formatAlignment(sentence)
+                              for sentence in sentences]))
+        output.close()
+        try:
+            return loadAlignment(fileName)
+        finally:
+            os.remove(fileName)
+
+    def certain(self, alignment):
+        return [sorted(sentence["certain"]) for sentence in alignment]
+
+    def testIntersectionAndUnion(self):
+        forward = self.alignment([[(1, 1), (2, 2), (3, 2)], [(1, 2)]])
+        backward = self.alignment([[(1, 1), (3, 2), (3, 3)], []])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "intersection")),
+            [[(1, 1), (3, 2)], []])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "union")),
+            [[(1, 1), (2, 2), (3, 2), (3, 3)], [(1, 2)]])
+        return
+
+    def testTypes(self):
+        forward = self.alignment([[(1, 1, "SEM"), (2, 2, "FUN")]])
+        backward = self.alignment([[(1, 1, "SEM"), (2, 2, "GIS"),
+                                    (3, 3, "COI")]])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "intersection")),
+            [[(1, 1, "SEM")]])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "union")),
+            [[(1, 1, "SEM"), (2, 2, "FUN"), (3, 3, "COI")]])
+        return
+
+    def testGrowDiag(self):
+        # The diagonal neighbour (2, 2) of (1, 1) joins, the others aren't
+        # next to any link and only join in the final steps. (3, 4) and
+        # (4, 4) share a target language word, both only join when either
+        # word of a link may already be aligned.
+        forward = self.alignment([[(1, 1), (2, 2), (4, 4), (3, 4)]])
+        backward = self.alignment([[(1, 1), (5, 5)]])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "grow-diag")),
+            [[(1, 1), (2, 2)]])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward, "grow-diag-final")),
+            [[(1, 1), (2, 2), (3, 4), (4, 4), (5, 5)]])
+        self.assertSequenceEqual(
+            self.certain(symmetrise(forward, backward,
+                                    "grow-diag-final-and")),
+            [[(1, 1), (2, 2), (3, 4), (5, 5)]])
+        return
+
+    def testSymmetriseFiles(self):
+        forward = [[(1, 1), (2, 2)], [(1, 1)], [(2, 1), (1, 2)]]
+        backward = [[(1, 1)], [(1, 1)], [(2, 1)]]
+        names = ["support/ut_forward.a", "support/ut_backward.a",
+                 "support/ut_symmetrised.a"]
+        try:
+            for name, sentences in zip(names, (forward, backward)):
+                output = open(name, "w")
+                output.write("".join([formatAlignment(sentence)
+                                      for sentence in sentences]))
+                output.close()
+            self.assertEqual(symmetriseFiles(names[0], names[1], names[2],
+                                             blockSize=2, reverse=False), 3)
+            self.assertSequenceEqual(
+                self.certain(loadAlignment(names[2])),
+                [[(1, 1)], [(1, 1)], [(2, 1)]])
+        finally:
+            for name in names:
+                if os.path.isfile(name):
+                    os.remove(name)
+        return
+
+
+if __name__ == '__main__':
+    # Parsing the options
+    optparser = optparse.OptionParser()
+    optparser.add_option("-f", "--forward", dest="forward", default="",
+                         help="Location of the source to target alignment")
+    optparser.add_option("-b", "--backward", dest="backward", default="",
+                         help="Location of the target to source alignment")
+    optparser.add_option("-o", "--output", dest="output", default="",
+                         help="Location of output file")
+    optparser.add_option("-m", "--method", dest="method",
+                         default="grow-diag-final-and",
+                         help="One of " + ", ".join(methods))
+    optparser.add_option("--source-target", dest="reverse",
+                         action="store_false", default=True,
+                         help="The backward alignment is already in source " +
+                              "to target orientation")
+    (opts, _) = optparser.parse_args()
+
+    if not opts.forward or not opts.backward or not opts.output:
+        logger.error("forward, backward and output files are required")
+        sys.exit(1)
+    symmetriseFiles(opts.forward, opts.backward, opts.output, opts.method,
+                    reverse=opts.reverse)